@@ -1,7 +1,7 @@
 cd '.'
 set datafile separator "|"
 set terminal pngcairo size 900,400
-set title "{} Hours Worked"
+set title "{label} Hours Worked"
 set ylabel "Hours"
 set xlabel "Date"
 set xdata time
@@ -9,7 +9,9 @@ set timefmt "%Y-%m-%d"
 set format x "%m/%d"
 set key left top
 set grid
-set output "{} Hours.png"
-plot "hoursrpt" using 1:8 with lines lw 2 lt 3 title 'Daily Hours', \
-     "hoursrpt" using 1:9 with lines lw 2 lt 4 title 'Avg Hours'
+set output "{label} Hours.png"
+plot "{datafile}" using 1:8 with lines lw 2 lt 3 title 'Daily Hours', \
+     "{datafile}" using 1:9 with lines lw 2 lt 4 title 'Avg Hours', \
+     "{datafile}" using 1:10 with lines lw 1 lt 2 title '7-day Avg', \
+     "{datafile}" using 1:11 with lines lw 1 lt 1 title '30-day Avg'
 set output
@@ -0,0 +1 @@
+from TimeClock.timeclock.service import TimeClock
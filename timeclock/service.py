@@ -0,0 +1,218 @@
+#! /usr/bin/env python
+'''
+TimeClock as a library.
+
+The TimeClock class keeps one connection open for its lifetime, so an
+application can punch, look up and report in-process without starting a
+new interpreter for every badge swipe:
+
+    from TimeClock.timeclock import TimeClock
+
+    with TimeClock() as clock:
+        clock.punch('clockin', employee='alice')
+        record = clock.lookup('2014-04-28', employee='alice')
+        hours, days = clock.totals('2014-04-01', '2014-04-30', employee='alice')
+
+Each operation always sends the same SQL text, so the sqlite3 module's
+statement cache keeps it prepared across calls.  punch_many() writes a
+batch of punches in one transaction.
+
+The punch, lookup, report, hoursrpt and changes methods mirror those of
+the daemon client (utils/daemon.py), so callers can use either one; the
+maintenance methods work on the database only.
+
+With memory=True the database is copied into memory when opened (see
+utils/memory.py): nothing done through the clock reaches the file unless
+save() writes it back, which suits tests and what-if edits, and large
+reports read no pages from disk.
+
+Only what a punch or lookup needs is imported with this module; the
+report, rollup and bulk modules are imported by the methods that use
+them, which keeps start up short for a one-off punch.
+'''
+
+import os
+import sys
+
+from TimeClock.utils.connection import connect, retry_on_lock
+from TimeClock.utils.schema import ensure_schema, convert_storage
+from TimeClock.utils.storage import storage_format
+from TimeClock.utils.sqlhelpers import write_punch, commit_punch, lookup_record, \
+    lookup_records, recent_start, transaction, current_date, current_time, \
+    DEFAULT_EMPLOYEE, LAST_DATE
+
+DB_NAME = 'timeclock.db'
+TEST_DB_NAME = 'timeclock_test.db'
+
+def app_dir():
+    '''Return the directory TimeClock keeps its database and reports in.'''
+    if sys.platform == 'win32':
+        return r"%s\AppData\Local\TimeClock" % os.getenv('USERPROFILE')
+    return r"%s/.timeclock" % os.getenv('HOME')
+
+def default_db(test=False):
+    '''Return the path of the user's database, or of the test database.'''
+    return os.path.join(app_dir(), TEST_DB_NAME if test else DB_NAME)
+
+class TimeClock(object):
+    '''
+    One open TimeClock database.  db defaults to the user's database and
+    profile to the SQLite profile chosen in timeclock.cfg.  Operations
+    are for employee unless they name someone else.  The schema is
+    brought up to date on opening unless upgrade_schema is False.  With
+    memory, the database is worked on in an in-memory copy.
+    '''
+
+    def __init__(self, db=None, profile=None, employee=DEFAULT_EMPLOYEE,
+                 upgrade_schema=True, memory=False, **kwargs):
+        self.db = db or default_db()
+        self.employee = employee
+        self.memory = memory
+        if memory:
+            from TimeClock.utils.memory import load_memory
+            self.conn, self.loaded = load_memory(self.db, **kwargs)
+        else:
+            self.conn = connect(self.db, profile, **kwargs)
+        self.fmt = None
+        if upgrade_schema:
+            self.upgrade_schema()
+
+    def upgrade_schema(self):
+        '''Bring the schema up to date.  Returns the version it was at.'''
+        version = ensure_schema(self.conn)
+        self.fmt = storage_format(self.conn)
+        return version
+
+    def punch(self, column, date=None, time=None, employee=None, replace=False):
+        '''
+        Set and commit one punch column ('clockin', 'lunchout', 'lunchin' or
+        'clockout'), for today and now unless told otherwise.  With replace
+        it takes the place of the day's punches of its kind; see
+        sqlhelpers.write_punch.  Raises sqlite3.OperationalError if the
+        lock cannot be had after retrying.
+        '''
+        commit_punch(self.conn, column, date or current_date(),
+                     time or current_time(),
+                     self.fmt, employee or self.employee, replace)
+
+    def punch_many(self, punches, replace=False):
+        '''
+        Write (column, date, time, employee) punches in one transaction.
+        date, time and employee may be None, and replace is as for punch().
+        If any punch is refused, none of them is written.
+        '''
+        punches = list(punches)
+        def attempt():
+            try:
+                for column, date, time, employee in punches:
+                    write_punch(self.conn, column, date or current_date(),
+                                time or current_time(), self.fmt,
+                                employee or self.employee, replace)
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+        retry_on_lock(attempt)
+
+    def lookup(self, date=None, employee=None):
+        '''Return the (date, clockin, lunchout, lunchin, clockout) record, or None.'''
+        return lookup_record(self.conn, date or current_date(), self.fmt,
+                             employee or self.employee)
+
+    def records(self, start_date, end_date, employee=None):
+        '''Return an iterator over the records from start_date to end_date, oldest first.'''
+        return lookup_records(self.conn, start_date, end_date, self.fmt,
+                              employee or self.employee)
+
+    def last_records(self, count, employee=None):
+        '''Return an iterator over the count most recent records, oldest first.'''
+        employee = employee or self.employee
+        start = recent_start(self.conn, count, self.fmt, employee)
+        if start is None:
+            return iter([])
+        return lookup_records(self.conn, start, LAST_DATE, self.fmt, employee)
+
+    def report(self, start_date, end_date, employee=None):
+        '''Yield report rows, in the order of reports.REPORT_COLUMNS.'''
+        from TimeClock.utils.reports import report_rows
+        return report_rows(self.conn, start_date, end_date, self.fmt,
+                           employee or self.employee)
+
+    def update_hoursrpt(self, path, start_date, end_date, employee=None):
+        '''
+        Bring the hoursrpt data file at path up to date with a report.
+        Returns the number of rows (kept, written); see reports.update_hoursrpt.
+        '''
+        from TimeClock.utils.reports import update_hoursrpt
+        return update_hoursrpt(self.conn, path, start_date, end_date, self.fmt,
+                               employee or self.employee, self.db)
+
+    def totals(self, start_date, end_date, employee=None):
+        '''Return (hours, days) worked between two dates, inclusive.'''
+        from TimeClock.utils.rollups import range_totals
+        return range_totals(self.conn, start_date, end_date, self.fmt,
+                            employee or self.employee)
+
+    def changes(self):
+        '''Return the database's change counter.'''
+        from TimeClock.utils.rollups import change_counter
+        return change_counter(self.conn)
+
+    def rebuild_rollups(self):
+        '''Recompute the daily and monthly hours rollups.'''
+        from TimeClock.utils.rollups import rebuild_rollups
+        with transaction(self.conn):
+            rebuild_rollups(self.conn, self.fmt)
+
+    def convert_storage(self, name):
+        '''Convert to 'text' or 'integer' storage.  False if already in use.'''
+        converted = convert_storage(self.conn, name)
+        self.fmt = storage_format(self.conn)
+        return converted
+
+    def archive(self, year):
+        '''
+        Move every closed year up to year into its own shard.  Returns
+        (year, records moved) per year archived; see archive.archive_years.
+        '''
+        from TimeClock.utils.archive import archive_years
+        if self.memory:
+            raise ValueError("Years can only be archived from the database file.")
+        return archive_years(self.conn, year, self.fmt)
+
+    def import_records(self, handle, file_format='csv', employee=None):
+        '''Import records from an open file.  See bulk.import_records.'''
+        from TimeClock.utils.bulk import import_records
+        return import_records(self.conn, handle, file_format, self.fmt,
+                              employee or self.employee)
+
+    def export_records(self, handle, file_format='csv'):
+        '''Export every record to an open file.  Returns the row count.'''
+        from TimeClock.utils.bulk import export_records
+        return export_records(self.conn, handle, file_format, self.fmt)
+
+    def save(self, force=False):
+        '''
+        Write an in-memory database back over its file.  Raises
+        memory.ConflictError if the file has changed since it was loaded,
+        unless force.
+        '''
+        from TimeClock.utils.memory import save_memory
+        if not self.memory:
+            raise ValueError("Only an in-memory database can be saved.")
+        self.loaded = save_memory(self.conn, self.db, self.loaded, force)
+
+    def export_columnar(self, directory):
+        '''Export every record as column files.  See columnar.export_columnar.'''
+        from TimeClock.utils.columnar import export_columnar
+        return export_columnar(self.conn, directory, self.fmt)
+
+    def close(self):
+        self.conn.commit()
+        self.conn.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
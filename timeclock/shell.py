@@ -0,0 +1,237 @@
+#! /usr/bin/env python
+'''
+The TimeClock shell.
+
+TimeClock --shell keeps one database connection open and reads commands
+from the terminal, or from stdin when it is a pipe or a file:
+
+    in [HH:MM:SS] [YYYY-MM-DD]  : Clock in, now unless a time is given.
+    out, lout, lin ...          : Likewise for the other punches.
+    update [YYYY-MM-DD]         : Punch and look up on this date from now
+                                  on, or on the day itself again.
+
+A punch given a date, or made after update, replaces that day's punches
+of its kind, as --update does; other punches are added to the day.
+
+    employee [NAME]             : Punch, look up and report for NAME.
+    lookup [DATE [DATE]]        : Look up a day, or a range of days.
+    last N                      : Look up the last N records.
+    format {block,table,json}   : How lookups are printed.
+    total PERIOD [PERIOD]       : Hours and days worked in a period.
+    report PERIOD [PERIOD]      : The report rows of a period.
+    commit                      : Write the punches held so far.
+    quit                        : Leave the shell (so does end of input).
+
+Lines starting with # are skipped.  Every command sends the same SQL
+text each time, so its statements stay prepared in the connection's
+statement cache and a command costs little more than its query.
+
+Read from a pipe or a file, punches are held and written together, in
+one transaction for each run of corrections or of new punches: every
+BATCH_PUNCHES of them, before any command that reads them, and at the
+end.  A script of corrections then runs at the speed of SQLite instead of
+one process per line.  A line that fails is reported with its number and
+the rest still run.  If the database refuses a punch, none of the run it
+was written with is stored, and the lines of the whole run are reported.
+'''
+
+import cmd
+import itertools
+from sqlite3 import OperationalError, IntegrityError
+
+from TimeClock.utils.validation import validate_date, validate_time
+from TimeClock.utils.sqlhelpers import current_date, current_time, DEFAULT_EMPLOYEE
+from TimeClock.utils.records import write_records, LOOKUP_STYLES
+
+# Punches held before they are written, when reading from a pipe.
+BATCH_PUNCHES = 1000
+
+REPORT_HEADER = \
+"""   DATE    | CLOCK IN | LUNCH OUT | LUNCH IN | CLOCK OUT |  HOURS  | AVERAGE
+-----------+----------+-----------+----------+-----------+---------+---------
+"""
+REPORT_ROW = "%s | %8s | %9s | %8s | %9s | %7s | %7s\n"
+
+def _hours(value):
+    return '' if value is None else "%.2f" % value
+
+class TimeClockShell(cmd.Cmd):
+    '''
+    A command loop over clock, a TimeClock, for employee, printing
+    lookups in style.  status is 1 once a command has failed.
+    '''
+
+    intro = "TimeClock shell.  Type help for the commands, quit to leave."
+    prompt = 'timeclock> '
+
+    def __init__(self, clock, employee=DEFAULT_EMPLOYEE, style='block',
+                 stdin=None, stdout=None):
+        cmd.Cmd.__init__(self, stdin=stdin, stdout=stdout)
+        self.clock = clock
+        self.employee = employee
+        self.style = style
+        self.date = None
+        self.pending = []
+        self.status = 0
+        self.lineno = 0
+        self.batch = not self.stdin.isatty()
+        if self.batch:
+            self.use_rawinput = False
+            self.intro = None
+            self.prompt = ''
+
+    def _say(self, text):
+        print >> self.stdout, text
+
+    def _fail(self, message):
+        self.status = 1
+        if self.batch:
+            message = "line %d: %s" % (self.lineno, message)
+        self._say(message)
+
+    def precmd(self, line):
+        self.lineno += 1
+        return '' if line.lstrip().startswith('#') else line
+
+    def onecmd(self, line):
+        try:
+            return cmd.Cmd.onecmd(self, line)
+        except (ValueError, OperationalError, IntegrityError) as err:
+            self._fail(str(err))
+
+    def emptyline(self):
+        pass
+
+    def default(self, line):
+        self._fail("Unknown command: %s" % line.split()[0])
+
+    def flush(self):
+        '''Write the punches held so far.'''
+        pending, self.pending = self.pending, []
+        for replace, run in itertools.groupby(pending, lambda item: item[1]):
+            run = list(run)
+            try:
+                self.clock.punch_many([punch for punch, replace, lineno in run], replace)
+            except (ValueError, OperationalError, IntegrityError) as err:
+                self.status = 1
+                self._say("lines %d-%d: none of %d punches written: %s"
+                          % (run[0][2], run[-1][2], len(run), err))
+
+    def _punch(self, column, line):
+        date = time_text = None
+        for arg in line.split():
+            if '-' in arg:
+                validate_date(arg)
+                date = arg
+            else:
+                validate_time(arg)
+                time_text = arg
+        date = date or self.date
+        punch = (column, date or current_date(), time_text or current_time(),
+                 self.employee)
+        if self.batch:
+            self.pending.append((punch, bool(date), self.lineno))
+            if len(self.pending) >= BATCH_PUNCHES:
+                self.flush()
+        else:
+            self.clock.punch(*punch, replace=bool(date))
+            self._say("Punch accepted!")
+
+    def do_in(self, line):
+        '''in [HH:MM:SS] [YYYY-MM-DD] : Clock in, now unless a time is given.'''
+        self._punch('clockin', line)
+
+    def do_out(self, line):
+        '''out [HH:MM:SS] [YYYY-MM-DD] : Clock out.'''
+        self._punch('clockout', line)
+
+    def do_lout(self, line):
+        '''lout [HH:MM:SS] [YYYY-MM-DD] : Clock out for lunch.'''
+        self._punch('lunchout', line)
+
+    def do_lin(self, line):
+        '''lin [HH:MM:SS] [YYYY-MM-DD] : Clock in from lunch.'''
+        self._punch('lunchin', line)
+
+    def do_update(self, line):
+        '''update [YYYY-MM-DD] : Punch on this date from now on, or today again.'''
+        if line.strip():
+            validate_date(line.strip())
+        self.date = line.strip() or None
+
+    def do_employee(self, line):
+        '''employee [NAME] : Punch, look up and report for NAME, or show whose.'''
+        if line.strip():
+            self.employee = line.strip()
+        else:
+            self._say(self.employee)
+
+    def do_format(self, line):
+        '''format {block,table,json} : How lookups are printed.'''
+        if line.strip() not in LOOKUP_STYLES:
+            raise ValueError("format takes one of %s." % ', '.join(LOOKUP_STYLES))
+        self.style = line.strip()
+
+    def do_lookup(self, line):
+        '''lookup [YYYY-MM-DD [YYYY-MM-DD]] : Look up a day, or every day in a range.'''
+        self.flush()
+        dates = line.split()
+        for date in dates:
+            validate_date(date)
+        if len(dates) == 2:
+            rows = self.clock.records(dates[0], dates[1], self.employee)
+        elif len(dates) < 2:
+            row = self.clock.lookup(dates[0] if dates else self.date or current_date(),
+                                    self.employee)
+            rows = [row] if row else []
+        else:
+            raise ValueError("lookup takes a date or a start and an end date.")
+        write_records(rows, self.style, self.stdout)
+
+    def do_last(self, line):
+        '''last N : Look up the last N records.'''
+        self.flush()
+        write_records(self.clock.last_records(int(line), self.employee), self.style,
+                      self.stdout)
+
+    def _period(self, line):
+        from TimeClock.utils.periods import parse_period
+        return parse_period(line.split())
+
+    def do_total(self, line):
+        '''total PERIOD [PERIOD] : Hours and days worked in a period or range.'''
+        from TimeClock.utils.periods import period_title
+        self.flush()
+        start_date, end_date, label = self._period(line)
+        hours, days = self.clock.totals(start_date, end_date, self.employee)
+        self._say("%s: %.2f hours in %d days, %.2f a day"
+                  % (period_title(start_date, end_date, label), hours, days,
+                     hours / days if days else 0))
+
+    def do_report(self, line):
+        '''report PERIOD [PERIOD] : Print the report rows of a period or range.'''
+        self.flush()
+        start_date, end_date, label = self._period(line)
+        self.stdout.write(REPORT_HEADER)
+        last = None
+        for last in self.clock.report(start_date, end_date, self.employee):
+            self.stdout.write(REPORT_ROW % (tuple(value or '' for value in last[:5]) +
+                                            (_hours(last[7]), _hours(last[8]))))
+        self._say("%s: %s hours" % (label, _hours(last and last[9]) or '0.00'))
+
+    def do_commit(self, line):
+        '''commit : Write the punches held so far.'''
+        self.flush()
+
+    def do_quit(self, line):
+        '''quit : Leave the shell.'''
+        self.flush()
+        return True
+
+    do_exit = do_quit
+
+    def do_EOF(self, line):
+        '''Leave the shell at the end of input.'''
+        if not self.batch:
+            self._say('')
+        return self.do_quit(line)
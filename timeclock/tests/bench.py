@@ -0,0 +1,189 @@
+#! /usr/bin/env python
+'''
+Benchmark harness for punch, lookup, report, range total and import.
+
+"run" builds a seeded database of years x employees in a temporary
+directory with datagen.py and times each operation against it, for a
+random employee each time, plus one batch report of the last year for
+every employee.  "total" is range_totals() alone over a random range of
+the whole history.  The results are written as JSON together with the
+commit, Python and SQLite versions they were measured with.
+
+"compare" reads two result files and shows the change in median latency
+of each operation.  It exits with status 1 if any operation got slower
+by more than the threshold, so it can gate a change.
+
+Usage:
+
+ $ python bench.py run [--years N] [--employees N] [--seed N]
+                       [--repeats N] [--output FILE]
+
+ $ python bench.py compare BASELINE.json CURRENT.json [--threshold 0.10]
+'''
+
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..', '..', '..')))
+
+from TimeClock.utils.connection import connect
+from TimeClock.utils.storage import TEXT
+from TimeClock.utils.schema import ensure_schema
+from TimeClock.utils.sqlhelpers import commit_punch, lookup_record, PUNCH_COLUMNS
+from TimeClock.utils.reports import report_rows
+from TimeClock.utils.rollups import range_totals
+from TimeClock.utils.bulk import import_records
+from TimeClock.utils.batch import batch_reports
+import datagen
+
+def summarise(timings):
+    '''Summary statistics, in milliseconds, for a list of timings.'''
+    timings = sorted(timings)
+    pick = lambda q: timings[min(int(len(timings) * q), len(timings) - 1)]
+    return {'n': len(timings),
+            'mean_ms': sum(timings) / len(timings),
+            'p50_ms': pick(.5),
+            'p95_ms': pick(.95),
+            'max_ms': timings[-1]}
+
+def timed(func, *args):
+    start = time.time()
+    func(*args)
+    return (time.time() - start) * 1000.
+
+def commit_id():
+    '''Return the current git commit, or None outside a checkout.'''
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'],
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=open(os.devnull, 'w')).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _report(conn, start, end, employee):
+    for row in report_rows(conn, start, end, employee=employee):
+        pass
+    range_totals(conn, start, end, employee=employee)
+
+def _import(db, csv_path):
+    conn = connect(db)
+    ensure_schema(conn)
+    with open(csv_path, 'rb') as handle:
+        import_records(conn, handle)
+    conn.close()
+
+def run(years, employees, seed, repeats):
+    '''Build the database and return the results document.'''
+    rng = random.Random(seed)
+    first, last = datagen.FIRST_YEAR, datagen.FIRST_YEAR + years - 1
+    reports = {'report_month': ('%d-06-01' % last, '%d-06-30' % last),
+               'report_year': ('%d-01-01' % last, '%d-12-31' % last),
+               'report_all': ('%d-01-01' % first, '%d-12-31' % last)}
+    timings = dict((name, []) for name in
+                   ['punch', 'lookup', 'total', 'import', 'batch_year'] +
+                   sorted(reports))
+    names = [datagen.employee_name(number) for number in range(employees)]
+
+    workdir = tempfile.mkdtemp(prefix='timeclock-bench-')
+    try:
+        db, csv_path, rows = datagen.build(workdir, years, employees, seed)
+        conn = connect(db)
+        dates = [row[0] for row in conn.execute(
+            "SELECT date FROM times WHERE employee = ?;", (names[0],))]
+        for i in range(repeats):
+            timings['punch'].append(timed(
+                commit_punch, conn, PUNCH_COLUMNS[i % 4], rng.choice(dates),
+                '08:%02d:%02d' % (rng.randrange(60), rng.randrange(60)),
+                TEXT, rng.choice(names)))
+            timings['lookup'].append(timed(lookup_record, conn, rng.choice(dates),
+                                           TEXT, rng.choice(names)))
+            start, end = sorted([rng.choice(dates), rng.choice(dates)])
+            timings['total'].append(timed(range_totals, conn, start, end, TEXT,
+                                          rng.choice(names)))
+        for name, (start, end) in reports.items():
+            for i in range(repeats):
+                timings[name].append(timed(_report, conn, start, end,
+                                           rng.choice(names)))
+        conn.close()
+
+        start, end = reports['report_year']
+        timings['batch_year'].append(timed(batch_reports, db, start, end, str(last),
+                                           os.path.join(workdir, 'batch'), 'svg'))
+
+        # Import the same history again into a fresh database.
+        timings['import'].append(timed(_import, db + '.import', csv_path))
+    finally:
+        shutil.rmtree(workdir)
+
+    results = dict((name, summarise(values)) for name, values in timings.items())
+    results['import']['rows_per_s'] = \
+        rows / (sum(timings['import']) / 1000.) if timings['import'] else 0
+    return {'meta': {'commit': commit_id(),
+                     'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     'python': platform.python_version(),
+                     'sqlite': sqlite3.sqlite_version,
+                     'years': years, 'employees': employees,
+                     'seed': seed, 'repeats': repeats, 'rows': rows},
+            'results': results}
+
+def compare(baseline, current, threshold):
+    '''Print the change in p50 per operation.  Returns the regressions.'''
+    print "baseline %s, current %s\n" % (baseline['meta']['commit'],
+                                         current['meta']['commit'])
+    print "%-14s | %11s | %11s | %8s" % ('operation', 'base (ms)', 'now (ms)', 'change')
+    print "-" * 53
+    regressions = []
+    for name in sorted(set(baseline['results']) & set(current['results'])):
+        old = baseline['results'][name]['p50_ms']
+        new = current['results'][name]['p50_ms']
+        change = (new - old) / old if old else 0.
+        flag = ''
+        if change > threshold:
+            regressions.append(name)
+            flag = '  SLOWER'
+        print "%-14s | %11.3f | %11.3f | %+7.1f%%%s" % (name, old, new,
+                                                       change * 100, flag)
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description="TimeClock benchmarks.")
+    commands = parser.add_subparsers(dest='command')
+    runner = commands.add_parser('run', help='Run the benchmarks.')
+    runner.add_argument('--years', type=int, default=5)
+    runner.add_argument('--employees', type=int, default=1)
+    runner.add_argument('--seed', type=int, default=1)
+    runner.add_argument('--repeats', type=int, default=50)
+    runner.add_argument('--output', '-o', help='Write the results to FILE.')
+    comparer = commands.add_parser('compare', help='Compare two result files.')
+    comparer.add_argument('baseline')
+    comparer.add_argument('current')
+    comparer.add_argument('--threshold', type=float, default=0.10,
+                          help='Allowed slowdown as a fraction (default 0.10).')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        with open(args.baseline) as old, open(args.current) as new:
+            regressions = compare(json.load(old), json.load(new), args.threshold)
+        sys.exit(1 if regressions else 0)
+
+    document = run(args.years, args.employees, args.seed, args.repeats)
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(text + '\n')
+        print "Results written to %s" % args.output
+    else:
+        print text
+
+if __name__ == '__main__':
+    main()
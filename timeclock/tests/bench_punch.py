@@ -0,0 +1,78 @@
+#! /usr/bin/env python
+'''
+Benchmark punch latency against the size of the punches table.
+
+A scratch database is grown from 1k to 10M punches and, at each size, a
+series of punches is timed against today's record.  Every punch is
+appended to punches and its day compacted again from an index range on
+(employee, date, time), plus a commit, so latency should stay flat as the
+table grows.
+
+A single person's history can hold at most ~3.6M distinct calendar dates,
+so the filler rows use synthetic date keys; only the depth of the index
+matters for the punch path.
+
+Usage:
+
+ $ python bench_punch.py [max_rows] [punches_per_size]
+'''
+
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..', '..', '..')))
+
+from TimeClock.utils.schema import ensure_schema
+from TimeClock.utils.sqlhelpers import commit_punch, PUNCH_COLUMNS, DEFAULT_EMPLOYEE
+
+SIZES = [1000, 10000, 100000, 1000000, 10000000]
+
+def grow(conn, current, target):
+    '''Add filler punches so the table holds target rows.'''
+    conn.execute('''
+                 WITH RECURSIVE n(x) AS (
+                     SELECT ? UNION ALL SELECT x + 1 FROM n WHERE x < ?)
+                 INSERT INTO punches (employee, date, time, kind)
+                 SELECT ?, printf('F%09d', x / 4), '08:30:00',
+                        CASE x % 4 WHEN 0 THEN 'clockin' WHEN 1 THEN 'lunchout'
+                        WHEN 2 THEN 'lunchin' ELSE 'clockout' END
+                 FROM n;
+                 ''', (current, target - 1, DEFAULT_EMPLOYEE))
+    conn.commit()
+
+def time_punches(conn, count):
+    '''Return the sorted latencies, in milliseconds, of count punches.'''
+    latencies = []
+    for i in range(count):
+        column = PUNCH_COLUMNS[i % len(PUNCH_COLUMNS)]
+        start = time.time()
+        commit_punch(conn, column, '2014-04-28', '08:%02d:00' % (i % 60))
+        latencies.append((time.time() - start) * 1000.)
+    return sorted(latencies)
+
+def main(max_rows=SIZES[-1], count=200):
+    workdir = tempfile.mkdtemp(prefix='timeclock-bench-')
+    try:
+        conn = sqlite3.connect(os.path.join(workdir, 'bench.db'))
+        ensure_schema(conn)
+        print "%10s | %9s | %9s | %9s" % ('rows', 'p50 (ms)', 'p95 (ms)', 'max (ms)')
+        print "-" * 47
+        rows = 0
+        for size in [s for s in SIZES if s <= max_rows]:
+            grow(conn, rows, size)
+            rows = size
+            latencies = time_punches(conn, count)
+            print "%10d | %9.3f | %9.3f | %9.3f" % (
+                size, latencies[len(latencies) // 2],
+                latencies[int(len(latencies) * .95)], latencies[-1])
+        conn.close()
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
@@ -0,0 +1,93 @@
+#! /usr/bin/env python
+'''
+Benchmark report latency against the length of the report range.
+
+A scratch database is filled with 20 years of synthetic weekday punches
+and reports are timed over ranges from one week to the whole history.
+Reports read an index range on daily_hours, so their cost should follow
+the number of days in the range rather than the size of the table.
+
+Usage:
+
+ $ python bench_report.py [repeats]
+'''
+
+import os
+import sys
+import time
+import shutil
+import sqlite3
+import tempfile
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..', '..', '..')))
+
+from TimeClock.utils.schema import ensure_schema
+from TimeClock.utils.periods import parse_period
+from TimeClock.utils.reports import report_rows, report_sql, report_params
+from TimeClock.utils.rollups import range_totals
+from TimeClock.utils.sqlhelpers import DEFAULT_EMPLOYEE
+
+FIRST_DAY = '1994-01-01'
+LAST_DAY = '2013-12-31'
+
+PERIODS = [['2013-W40'],
+           ['2013-10'],
+           ['2013-Q4'],
+           ['2013'],
+           ['2009', '2013'],
+           ['1994', '2013']]
+
+def populate(conn):
+    '''Fill punches with randomised weekday punches from FIRST_DAY to LAST_DAY.'''
+    conn.execute('''
+                 WITH RECURSIVE days(d) AS (
+                     SELECT date(?) UNION ALL
+                     SELECT date(d, '+1 day') FROM days WHERE d < date(?)),
+                 windows(kind, start, spread) AS (
+                     VALUES ('clockin', '08:15:00', 2700), ('lunchout', '12:00:00', 3600),
+                            ('lunchin', '13:00:00', 1800), ('clockout', '17:30:00', 1800))
+                 INSERT INTO punches (employee, date, time, kind)
+                 SELECT ?, d, time(start, '+' || abs(random() % spread) || ' seconds'), kind
+                 FROM days, windows WHERE strftime('%w', d) NOT IN ('0', '6')
+                 ORDER BY d, start;
+                 ''', (FIRST_DAY, LAST_DAY, DEFAULT_EMPLOYEE))
+    conn.commit()
+
+def time_report(conn, period, repeats):
+    '''Return (rows, median milliseconds) for a full report over period.'''
+    timings = []
+    for i in range(repeats):
+        start = time.time()
+        rows = sum(1 for row in report_rows(conn, period.start, period.end))
+        range_totals(conn, period.start, period.end)
+        timings.append((time.time() - start) * 1000.)
+    return rows, sorted(timings)[len(timings) // 2]
+
+def main(repeats=20):
+    workdir = tempfile.mkdtemp(prefix='timeclock-bench-')
+    try:
+        conn = sqlite3.connect(os.path.join(workdir, 'bench.db'))
+        ensure_schema(conn)
+        populate(conn)
+        print "%d days of history\n" % conn.execute(
+            "SELECT COUNT(*) FROM times;").fetchone()[0]
+
+        print "Query plan:"
+        for row in conn.execute("EXPLAIN QUERY PLAN " + report_sql(),
+                                report_params(FIRST_DAY, LAST_DAY)):
+            print "  ", row[-1]
+        print
+
+        print "%-22s | %6s | %9s" % ('period', 'rows', 'p50 (ms)')
+        print "-" * 43
+        for specs in PERIODS:
+            period = parse_period(specs)
+            rows, median = time_report(conn, period, repeats)
+            print "%-22s | %6d | %9.3f" % (period.label, rows, median)
+        conn.close()
+    finally:
+        shutil.rmtree(workdir)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:2]])
@@ -0,0 +1,168 @@
+#! /usr/bin/env python
+'''
+Benchmark the start up cost of a one-off punch from the command line.
+
+Each run starts a new interpreter for "timeclock.py --in HH:MM:SS" against
+a scratch database and times it from outside, alongside the --profile
+phases it reports from inside.  For comparison the bare interpreter
+("python -c pass") is timed too: what a punch costs above that floor
+should be mostly the SQLite write itself, not imports.
+
+The modules a punch imports are also checked against HEAVY, the modules
+only reports, bulk jobs and the daemon should load.  The check fails, and
+the script exits with status 1, if any of them turn up on the punch
+path.  Where the interpreter has -X importtime (Python 3.7 and later) its
+per-module import times are saved to --importtime FILE as well.
+
+The results use the layout of bench.py, so two runs can be compared with
+"bench.py compare".
+
+Usage:
+
+ $ python bench_startup.py [--runs N] [--output FILE] [--importtime FILE]
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import sqlite3
+import argparse
+import platform
+import tempfile
+import subprocess
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..', '..', '..')))
+
+from bench import summarise, commit_id
+
+SCRIPT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'timeclock.py'))
+
+# Modules that a punch should never need to import.
+HEAVY = ['argparse', 'json', 'csv', 'random', 'socket', 'subprocess', 'shutil',
+         'threading', 'multiprocessing', 'SocketServer', 'ConfigParser',
+         '_strptime', 'TimeClock.utils.bulk', 'TimeClock.utils.reports',
+         'TimeClock.utils.periods', 'TimeClock.utils.cache',
+         'TimeClock.utils.render', 'TimeClock.utils.batch',
+         'TimeClock.utils.daemon', 'TimeClock.utils.analytics', 'numpy']
+
+# Runs the command line in-process and prints the modules it imported.
+MODULES_PROBE = '''
+import sys
+sys.argv = [%r] + %r
+try:
+    execfile(sys.argv[0], {'__name__': '__main__'})
+except SystemExit:
+    pass
+sys.stderr.write('\\n'.join(sorted(sys.modules)) + '\\n')
+'''
+
+def _environment(home):
+    env = dict(os.environ)
+    env['HOME'] = home
+    env['USERPROFILE'] = home
+    env['PYTHONPATH'] = os.pathsep.join(
+        [sys.path[0]] + filter(None, [os.environ.get('PYTHONPATH')]))
+    return env
+
+def _punch_args(run):
+    return ['--in', '08:%02d:%02d' % (run // 60 % 60, run % 60),
+            '-u', '2014-04-28']
+
+def timed_run(command, env):
+    '''Run command and return its wall time in milliseconds.'''
+    with open(os.devnull, 'w') as null:
+        start = time.time()
+        subprocess.check_call(command, env=env, stdout=null)
+        return (time.time() - start) * 1000.
+
+def imported_modules(env):
+    '''Return the modules a punch imports, as a sorted list.'''
+    probe = subprocess.Popen([sys.executable, '-c',
+                              MODULES_PROBE % (SCRIPT, _punch_args(0))],
+                             env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    output, modules = probe.communicate()
+    return [name for name in modules.splitlines()
+            if name and not name.startswith(('Traceback', ' '))]
+
+def import_times(env, path):
+    '''Save -X importtime output for one punch to path, if supported.'''
+    if sys.version_info < (3, 7):
+        return False
+    with open(path, 'w') as out:
+        subprocess.call([sys.executable, '-X', 'importtime', SCRIPT] + _punch_args(0),
+                        env=env, stdout=open(os.devnull, 'w'), stderr=out)
+    return True
+
+def run(runs, importtime=None):
+    '''Time the punches and return the results document.'''
+    timings = {'interpreter': [], 'punch_cli': [], 'punch_import': [],
+               'punch_write': []}
+    home = tempfile.mkdtemp(prefix='timeclock-startup-')
+    try:
+        os.makedirs(os.path.join(home, '.timeclock'))
+        env = _environment(home)
+        profile = os.path.join(home, 'profile.json')
+
+        # The first punch creates the database.
+        timed_run([sys.executable, SCRIPT] + _punch_args(0), env)
+        for number in range(runs):
+            timings['interpreter'].append(timed_run([sys.executable, '-c', 'pass'], env))
+            timings['punch_cli'].append(timed_run(
+                [sys.executable, SCRIPT, '--profile', profile] + _punch_args(number + 1),
+                env))
+            with open(profile) as handle:
+                phases = dict((phase['name'], phase['wall_ms'])
+                              for phase in json.load(handle)['phases'])
+            timings['punch_import'].append(phases['import'])
+            timings['punch_write'].append(phases['punch clockin'])
+
+        modules = imported_modules(env)
+        if importtime and not import_times(env, importtime):
+            print >> sys.stderr, "-X importtime needs Python 3.7 or later; skipped."
+    finally:
+        shutil.rmtree(home)
+
+    results = dict((name, summarise(values)) for name, values in timings.items())
+    overhead = results['punch_cli']['p50_ms'] - results['interpreter']['p50_ms']
+    return {'meta': {'commit': commit_id(),
+                     'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                     'python': platform.python_version(),
+                     'sqlite': sqlite3.sqlite_version,
+                     'runs': runs,
+                     'modules': len(modules),
+                     'heavy_modules': [name for name in HEAVY if name in modules],
+                     'write_share': (results['punch_write']['p50_ms'] / overhead
+                                     if overhead > 0 else None)},
+            'results': results}
+
+def main():
+    parser = argparse.ArgumentParser(description="TimeClock start up benchmark.")
+    parser.add_argument('--runs', type=int, default=20)
+    parser.add_argument('--output', '-o', help='Write the results to FILE.')
+    parser.add_argument('--importtime', metavar='FILE',
+                        help='Save -X importtime output to FILE (Python 3.7+).')
+    args = parser.parse_args()
+
+    document = run(args.runs, args.importtime)
+    text = json.dumps(document, indent=2, sort_keys=True)
+    if args.output:
+        with open(args.output, 'w') as out:
+            out.write(text + '\n')
+        print "Results written to %s" % args.output
+    else:
+        print text
+
+    meta = document['meta']
+    results = document['results']
+    print >> sys.stderr, "punch %.1f ms, interpreter %.1f ms, imports %.1f ms, write %.1f ms" % (
+        results['punch_cli']['p50_ms'], results['interpreter']['p50_ms'],
+        results['punch_import']['p50_ms'], results['punch_write']['p50_ms'])
+    if meta['heavy_modules']:
+        print >> sys.stderr, "A punch imported: %s" % ', '.join(meta['heavy_modules'])
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
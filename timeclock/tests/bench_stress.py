@@ -0,0 +1,103 @@
+#! /usr/bin/env python
+'''
+Multi-process punch stress test.
+
+Several worker processes punch into one scratch database at the same time
+while another process runs reports in a loop, once for each SQLite
+profile.  For every profile the script reports punch throughput, tail
+latency and how many punches failed even after retrying.
+
+Usage:
+
+ $ python bench_stress.py [workers] [punches_per_worker]
+'''
+
+import os
+import sys
+import time
+import shutil
+import tempfile
+import multiprocessing
+from sqlite3 import OperationalError
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..', '..', '..')))
+
+from TimeClock.utils.connection import connect, PROFILES
+from TimeClock.utils.schema import ensure_schema
+from TimeClock.utils.sqlhelpers import commit_punch, PUNCH_COLUMNS
+from TimeClock.utils.reports import report_rows
+
+def puncher(db, profile, worker, count, start, results):
+    '''Punch count times, each into a day of its own, and send latencies.'''
+    conn = connect(db, profile)
+    latencies, failures = [], 0
+    start.wait()
+    for i in range(count):
+        date = '%04d-%02d-%02d' % (1900 + worker, i // 28 % 12 + 1, i % 28 + 1)
+        began = time.time()
+        try:
+            commit_punch(conn, PUNCH_COLUMNS[i % 4], date, '08:%02d:00' % (i % 60))
+        except OperationalError:
+            failures += 1
+        latencies.append((time.time() - began) * 1000.)
+    conn.close()
+    results.put((latencies, failures))
+
+def reporter(db, profile, start, stop):
+    '''Keep reading reports until told to stop; lock errors are ignored.'''
+    conn = connect(db, profile)
+    start.wait()
+    while not stop.is_set():
+        try:
+            for row in report_rows(conn, '1900-01-01', '1999-12-31'):
+                pass
+        except OperationalError:
+            pass
+    conn.close()
+
+def run(db, profile, workers, count):
+    conn = connect(db, profile)
+    ensure_schema(conn)
+    conn.close()
+
+    start, stop = multiprocessing.Event(), multiprocessing.Event()
+    results = multiprocessing.Queue()
+    procs = [multiprocessing.Process(target=puncher,
+                                     args=(db, profile, worker, count, start, results))
+             for worker in range(workers)]
+    watcher = multiprocessing.Process(target=reporter, args=(db, profile, start, stop))
+    for proc in procs + [watcher]:
+        proc.start()
+
+    began = time.time()
+    start.set()
+    latencies, failures = [], 0
+    for proc in procs:
+        worker_latencies, worker_failures = results.get()
+        latencies.extend(worker_latencies)
+        failures += worker_failures
+    elapsed = time.time() - began
+    stop.set()
+    for proc in procs + [watcher]:
+        proc.join()
+
+    latencies.sort()
+    pick = lambda q: latencies[min(int(len(latencies) * q), len(latencies) - 1)]
+    return len(latencies) / elapsed, pick(.5), pick(.99), latencies[-1], failures
+
+def main(workers=8, count=250):
+    print "%d workers x %d punches, plus one reporting process\n" % (workers, count)
+    print "%-8s | %9s | %9s | %9s | %9s | %6s" % (
+        'profile', 'punch/s', 'p50 (ms)', 'p99 (ms)', 'max (ms)', 'failed')
+    print "-" * 63
+    for profile in sorted(PROFILES):
+        workdir = tempfile.mkdtemp(prefix='timeclock-bench-')
+        try:
+            result = run(os.path.join(workdir, 'stress.db'), profile, workers, count)
+        finally:
+            shutil.rmtree(workdir)
+        print "%-8s | %9.1f | %9.3f | %9.3f | %9.3f | %6d" % ((profile,) + result)
+
+if __name__ == '__main__':
+    main(*[int(arg) for arg in sys.argv[1:3]])
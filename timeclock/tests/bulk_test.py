@@ -0,0 +1,91 @@
+#! /usr/bin/env python
+'''
+Checks of bulk import and export.
+
+    python bulk_test.py
+'''
+
+import os
+import sys
+from StringIO import StringIO
+
+from service_test import scratch_clock, stored, main
+
+def run_cli(directory, argv):
+    '''Run the command line with its home in directory.  Returns (status, output).'''
+    from TimeClock.timeclock.timeclock import main as cli_main
+    home, stdout = os.environ.get('HOME'), sys.stdout
+    os.environ['HOME'] = directory
+    if not os.path.isdir(os.path.join(directory, '.timeclock')):
+        os.mkdir(os.path.join(directory, '.timeclock'))
+    sys.stdout = StringIO()
+    try:
+        status = cli_main(argv)
+        return status, sys.stdout.getvalue()
+    finally:
+        sys.stdout = stdout
+        if home is None:
+            del os.environ['HOME']
+        else:
+            os.environ['HOME'] = home
+
+def test_bad_header_is_rejected(directory):
+    '''An unknown header column rejects line 1, and no record is imported.'''
+    clock = scratch_clock(directory)
+    imported, rejected = clock.import_records(StringIO(
+        "date,clockin,nap,clockout\n"
+        "2014-08-01,08:00:00,x,17:00:00\n"))
+    assert imported == 0, imported
+    assert rejected[0] == (1, "unknown column 'nap' in header"), rejected
+    assert [number for number, reason in rejected] == [1, 2], rejected
+    assert stored(clock) == [], stored(clock)
+    clock.close()
+
+def test_bad_header_from_the_command_line(directory):
+    '''The command line reports a bad header by line and exits with 1.'''
+    path = os.path.join(directory, 'records.csv')
+    with open(path, 'w') as handle:
+        handle.write("date,clockin,nap\n2014-08-01,08:00:00,x\n")
+    status, output = run_cli(directory, ['--import', path])
+    assert status == 1, status
+    assert output.startswith("Line 1 rejected: unknown column 'nap' in header"), output
+
+def test_missing_import_file(directory):
+    '''Importing a file that is not there prints why and exits with 1.'''
+    path = os.path.join(directory, 'missing.csv')
+    status, output = run_cli(directory, ['--import', path])
+    assert status == 1, status
+    assert output == "Cannot read %s: No such file or directory\n" % path, output
+
+def test_split_days_survive_a_round_trip(directory):
+    '''A day of several stretches of work exports and imports back unchanged.'''
+    clock = scratch_clock(directory)
+    clock.punch_many([('clockin', '2014-08-01', '08:00:00', None),
+                      ('clockout', '2014-08-01', '12:00:00', None),
+                      ('clockin', '2014-08-01', '13:00:00', None),
+                      ('lunchout', '2014-08-01', '15:00:00', None),
+                      ('lunchin', '2014-08-01', '15:30:00', None),
+                      ('clockout', '2014-08-01', '18:00:00', None)])
+    day = "SELECT gross, lunch, total FROM daily_hours WHERE date = '2014-08-01';"
+    expected = clock.conn.execute(day).fetchone()
+    for file_format in ('csv', 'jsonl'):
+        exported = StringIO()
+        clock.export_records(exported, file_format)
+        assert len(exported.getvalue().splitlines()) == (3 if file_format == 'csv'
+                                                         else 2), exported.getvalue()
+        os.mkdir(os.path.join(directory, file_format))
+        copy = scratch_clock(os.path.join(directory, file_format))
+        for attempt in range(2):
+            copy.import_records(StringIO(exported.getvalue()), file_format)
+            assert sorted(stored(copy)) == sorted(stored(clock)), stored(copy)
+            assert copy.conn.execute(day).fetchone() == expected
+        copy.close()
+    clock.close()
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                    '..', '..', '..')))
+    sys.exit(main([test_bad_header_is_rejected,
+                   test_bad_header_from_the_command_line,
+                   test_missing_import_file,
+                   test_split_days_survive_a_round_trip]))
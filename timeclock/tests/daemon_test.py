@@ -0,0 +1,48 @@
+#! /usr/bin/env python
+'''
+Checks of the punch daemon's replies over its socket.
+
+    python daemon_test.py
+'''
+
+import os
+import sys
+import json
+import socket
+import threading
+
+from service_test import main
+
+def test_requests_that_are_not_objects(directory):
+    '''JSON that is not an object gets the malformed request reply, and the
+    connection keeps serving.'''
+    from TimeClock.utils.daemon import PunchServer
+    path = os.path.join(directory, 'timeclock.sock')
+    server = PunchServer(os.path.join(directory, 'timeclock.db'), path)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(path)
+        stream = client.makefile('r+')
+        for line in ('[]', '"x"', '3', 'null', '{'):
+            stream.write(line + '\n')
+            stream.flush()
+            response = json.loads(stream.readline())
+            assert response == {'ok': False, 'error': "Malformed request."}, \
+                (line, response)
+        stream.write(json.dumps({'op': 'lookup', 'date': '2014-08-01'}) + '\n')
+        stream.flush()
+        response = json.loads(stream.readline())
+        assert response == {'ok': True, 'record': None}, response
+        stream.close()
+    finally:
+        client.close()
+        server.shutdown()
+        thread.join()
+        server.server_close()
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                    '..', '..', '..')))
+    sys.exit(main([test_requests_that_are_not_objects]))
@@ -0,0 +1,96 @@
+#! /usr/bin/env python
+'''
+Seeded generator of synthetic punch histories.
+
+Records follow the punch windows of the test fixtures (see
+timeclock_test.PUNCH_WINDOWS): one record per weekday, each punch at a
+random second inside its window.  The same seed always gives the same
+history, so results from different commits can be compared.
+
+Every employee gets a history of their own, generated from a seed
+derived from the main one, and all of them go into one database.
+
+Usage:
+
+ $ python datagen.py DIRECTORY [years] [employees] [seed]
+'''
+
+import os
+import sys
+import random
+import datetime
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                '..', '..', '..')))
+
+from TimeClock.utils.connection import connect
+from TimeClock.utils.schema import ensure_schema
+from TimeClock.utils.bulk import import_records
+from timeclock_test import PUNCH_WINDOWS
+
+FIRST_YEAR = 2000
+
+def _seconds(text):
+    hours, minutes, seconds = [int(part) for part in text.split(':')]
+    return hours * 3600 + minutes * 60 + seconds
+
+WINDOWS = [(_seconds(start), _seconds(end)) for start, end in PUNCH_WINDOWS]
+
+def records(years, seed, first_year=FIRST_YEAR):
+    '''Yield (date, clockin, lunchout, lunchin, clockout) for every weekday.'''
+    rng = random.Random(seed)
+    day = datetime.date(first_year, 1, 1)
+    stop = datetime.date(first_year + years, 1, 1)
+    one_day = datetime.timedelta(days=1)
+    while day < stop:
+        if day.weekday() < 5:
+            punches = []
+            for start, end in WINDOWS:
+                second = rng.randint(start, end)
+                punches.append("%02d:%02d:%02d" % (second // 3600, second // 60 % 60,
+                                                   second % 60))
+            yield (day.isoformat(),) + tuple(punches)
+        day += one_day
+
+def employee_name(number):
+    return 'employee%03d' % number
+
+def employee_seed(seed, number):
+    '''Seed for one employee's history.'''
+    return seed * 1000003 + number
+
+def write_csv(path, years, employees, seed, first_year=FIRST_YEAR):
+    '''Write the generated histories to a CSV file.  Returns the row count.'''
+    count = 0
+    with open(path, 'wb') as out:
+        out.write("date,clockin,lunchout,lunchin,clockout,employee\n")
+        for number in range(employees):
+            name = employee_name(number)
+            for record in records(years, employee_seed(seed, number), first_year):
+                out.write(','.join(record + (name,)) + '\n')
+                count += 1
+    return count
+
+def build(directory, years, employees, seed, profile='bulk'):
+    '''
+    Create history.csv and history.db in directory.  Returns (database
+    path, csv path, rows).
+    '''
+    csv_path = os.path.join(directory, 'history.csv')
+    db = os.path.join(directory, 'history.db')
+    rows = write_csv(csv_path, years, employees, seed)
+    conn = connect(db, profile)
+    ensure_schema(conn)
+    with open(csv_path, 'rb') as handle:
+        import_records(conn, handle)
+    conn.close()
+    return db, csv_path, rows
+
+def main(directory, years=5, employees=1, seed=1):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    db, csv_path, rows = build(directory, int(years), int(employees), int(seed))
+    print "%s: %d records" % (db, rows)
+
+if __name__ == '__main__':
+    main(*sys.argv[1:5])
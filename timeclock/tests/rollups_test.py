@@ -0,0 +1,105 @@
+#! /usr/bin/env python
+'''
+Check the two ways daily_hours compacts a day against each other.
+
+rollups.day_sql() takes most days through a grouped fast path and walks
+the punches of the rest in time order.  This writes random days of both
+kinds, in either storage format, and checks the lunch and total of
+every day, as the triggers and then rebuild_rollups() stored them,
+against the walk run over every day.
+
+    python rollups_test.py [DAYS] [SEED]
+'''
+
+import sys
+import random
+import datetime
+import sqlite3
+
+# Punch kinds in the order of a simple day.
+KINDS = ('clockin', 'lunchout', 'lunchin', 'clockout')
+
+def random_day(rand):
+    '''
+    Return the (kind, HH:MM:SS) punches of a day: half the time a few of
+    the kinds in order, otherwise any kinds at any times.
+    '''
+    if rand.random() < .5:
+        kinds = [kind for kind in KINDS if rand.random() < .8]
+        times = sorted(rand.randrange(6 * 60, 20 * 60) for kind in kinds)
+    else:
+        kinds = [rand.choice(KINDS) for number in range(rand.randrange(1, 7))]
+        times = [rand.randrange(6 * 60, 20 * 60) for kind in kinds]
+    return [(kind, "%02d:%02d:00" % divmod(minutes, 60))
+            for kind, minutes in zip(kinds, times)]
+
+def walked(conn, fmt):
+    '''
+    Return a cursor over every day's date, gross, stored lunch and total,
+    and the lunch and whether its punches alternate as walked.
+    '''
+    from TimeClock.utils.rollups import _walk_day
+    return conn.execute('''
+                        SELECT %s, gross, lunch, total, %s, %s FROM daily_hours day
+                        ORDER BY date;
+                        ''' % (fmt.date_sql('date'),
+                               _walk_day("SUM(CASE WHEN starts AND after_start = 0 "
+                                         "THEN seconds - since END) / 3600.", fmt),
+                               _walk_day("COUNT(*) = 2 * SUM(starts) AND "
+                                         "SUM(starts = (after_start IS NOT 1)) = COUNT(*)",
+                                         fmt)))
+
+def _differs(stored, expected):
+    if stored is None or expected is None:
+        return stored is not expected
+    return abs(stored - expected) > 1e-9
+
+def mismatches(conn, fmt):
+    '''Return the days whose stored lunch or total differs from the walk's.'''
+    bad = []
+    for date, gross, lunch, total, lunch_walked, alternates in walked(conn, fmt):
+        total_walked = (gross - (lunch_walked or 0)
+                        if alternates and gross is not None else None)
+        if _differs(lunch, lunch_walked) or _differs(total, total_walked):
+            bad.append((date, (lunch, total), (lunch_walked, total_walked)))
+    return bad
+
+def check(storage, days, seed):
+    '''Return the mismatches found over days random days in storage.'''
+    from TimeClock.utils.schema import ensure_schema, convert_storage
+    from TimeClock.utils.storage import FORMATS
+    from TimeClock.utils.sqlhelpers import write_punch, transaction
+    from TimeClock.utils.rollups import rebuild_rollups
+
+    rand = random.Random(seed)
+    conn = sqlite3.connect(':memory:')
+    ensure_schema(conn)
+    convert_storage(conn, storage)
+    fmt = FORMATS[storage]
+    first = datetime.date(2000, 1, 1)
+    for number in range(days):
+        date = (first + datetime.timedelta(days=number)).isoformat()
+        for kind, time in random_day(rand):
+            write_punch(conn, kind, date, time, fmt)
+    conn.commit()
+    bad = mismatches(conn, fmt)
+    with transaction(conn):
+        rebuild_rollups(conn, fmt)
+    bad.extend(mismatches(conn, fmt))
+    conn.close()
+    return bad
+
+if __name__ == '__main__':
+    import os
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                    '..', '..', '..')))
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    seed = int(sys.argv[2]) if len(sys.argv) > 2 else 0
+    status = 0
+    for storage in ('text', 'integer'):
+        bad = check(storage, days, seed)
+        print "%s storage: %d days, %d mismatches" % (storage, days, len(bad))
+        for date, stored, expected in bad[:10]:
+            print "    %s: stored lunch, total %r, walked %r" % (date, stored, expected)
+        status = status or int(bool(bad))
+    sys.exit(status)
@@ -0,0 +1,81 @@
+#! /usr/bin/env python
+'''
+Checks of the TimeClock library class.
+
+Each check runs against a scratch database and raises AssertionError on
+failure.
+
+    python service_test.py
+'''
+
+import os
+import sys
+import shutil
+import tempfile
+from sqlite3 import IntegrityError
+
+def scratch_clock(directory):
+    from TimeClock.timeclock.service import TimeClock
+    return TimeClock(os.path.join(directory, 'timeclock.db'), employee='dave')
+
+def stored(clock):
+    return clock.conn.execute("SELECT date, time, kind FROM punches ORDER BY id;"
+                              ).fetchall()
+
+def test_refused_batch_leaves_nothing(directory):
+    '''A batch with a punch the database refuses writes none of its punches.'''
+    clock = scratch_clock(directory)
+    clock.punch('clockin', '2013-08-01', '08:00:00')
+    clock.archive(2013)
+    before = stored(clock)
+    try:
+        clock.punch_many([('clockin', '2014-08-01', '08:00:00', None),
+                          ('clockin', '2013-08-02', '08:00:00', None)])
+    except IntegrityError:
+        pass
+    else:
+        raise AssertionError("a punch in an archived year was accepted")
+    clock.conn.commit()
+    clock.close()
+
+    clock = scratch_clock(directory)
+    assert stored(clock) == before, stored(clock)
+    clock.close()
+
+def test_invalid_batch_leaves_nothing(directory):
+    '''A batch failing on a bad value partway through writes nothing.'''
+    clock = scratch_clock(directory)
+    try:
+        clock.punch_many([('clockin', '2014-08-01', '08:00:00', None),
+                          ('lunchout', '2014-08-01', '12:00:00', None),
+                          ('nap', '2014-08-01', '12:30:00', None)])
+    except ValueError:
+        pass
+    else:
+        raise AssertionError("an unknown punch column was accepted")
+    clock.close()
+
+    clock = scratch_clock(directory)
+    assert stored(clock) == [], stored(clock)
+    clock.close()
+
+def main(tests):
+    '''Run each test in a scratch directory of its own.  Returns 1 on a failure.'''
+    status = 0
+    for test in tests:
+        directory = tempfile.mkdtemp(prefix='timeclock-test-')
+        try:
+            test(directory)
+            print "ok      %s" % test.__name__
+        except AssertionError as err:
+            print "FAILED  %s: %s" % (test.__name__, err)
+            status = 1
+        finally:
+            shutil.rmtree(directory)
+    return status
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                    '..', '..', '..')))
+    sys.exit(main([test_refused_batch_leaves_nothing,
+                   test_invalid_batch_leaves_nothing]))
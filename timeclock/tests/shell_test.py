@@ -0,0 +1,72 @@
+#! /usr/bin/env python
+'''
+Checks of the TimeClock shell reading commands from a pipe.
+
+    python shell_test.py
+'''
+
+import os
+import sys
+from StringIO import StringIO
+
+from service_test import scratch_clock, stored, main
+
+def run_shell(clock, script):
+    '''Run script through a batch shell on clock.  Returns (status, output).'''
+    from TimeClock.timeclock.shell import TimeClockShell
+    out = StringIO()
+    shell = TimeClockShell(clock, stdin=StringIO(script), stdout=out)
+    shell.cmdloop()
+    return shell.status, out.getvalue()
+
+def test_refused_run_is_reported_whole(directory):
+    '''A run with one refused punch stores none, and says so for its lines.'''
+    clock = scratch_clock(directory)
+    clock.punch('clockin', '2013-08-01', '08:00:00')
+    clock.archive(2013)
+    before = stored(clock)
+    status, output = run_shell(clock, "employee dave\n"
+                                      "in 08:00:00 2014-08-01\n"
+                                      "in 08:00:00 2013-08-02\n")
+    clock.close()
+
+    assert status == 1, status
+    assert output.startswith("lines 2-3: none of 2 punches written:"), output
+    clock = scratch_clock(directory)
+    assert stored(clock) == before, stored(clock)
+    clock.close()
+
+def test_bad_line_leaves_the_rest(directory):
+    '''A line that fails validation is reported and the others are stored.'''
+    clock = scratch_clock(directory)
+    status, output = run_shell(clock, "in 08:00:00 2014-08-01\n"
+                                      "out 8:00 2014-08-01\n"
+                                      "out 17:00:00 2014-08-01\n")
+    clock.close()
+
+    assert status == 1, status
+    assert output.startswith("line 2: Incorrect time format."), output
+    clock = scratch_clock(directory)
+    assert [kind for date, time, kind in stored(clock)] == ['clockin', 'clockout']
+    clock.close()
+
+def test_total_names_a_range_once(directory):
+    '''A total over a range of dates gives the dates once, a named period with them.'''
+    clock = scratch_clock(directory)
+    status, output = run_shell(clock, "in 08:00:00 2014-08-01\n"
+                                      "out 16:00:00 2014-08-01\n"
+                                      "total 2014-08-01 2014-08-31\n"
+                                      "total 2014-08\n")
+    clock.close()
+
+    assert status == 0, status
+    assert output.splitlines() == [
+        "2014-08-01 to 2014-08-31: 8.00 hours in 1 days, 8.00 a day",
+        "2014-08 (2014-08-01 to 2014-08-31): 8.00 hours in 1 days, 8.00 a day"], output
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__),
+                                                    '..', '..', '..')))
+    sys.exit(main([test_refused_run_is_reported_whole,
+                   test_bad_line_leaves_the_rest,
+                   test_total_names_a_range_once]))
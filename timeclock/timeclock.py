@@ -1,364 +1,754 @@
-#! /usr/bin/env python
-'''
-TimeClock is a utility to help keep track of your time.
-
-Flags:
-
-    --in [HH:MM]    : Clock in for the day. Defaults to now.
-
-    --out [HH:MM]   : Clock out for the day.  Defaults to now.
-
-    --lout [HH:MM]  : Clock out for lunch.  Defaults to now.
-
-    --lin [HH:MM]   : Clock in from lunch.  Defaults to now.
-
-    --update, -u YYYY-MM-DD : Update a time from a previous date.
-
-    --lookup [YYYY-MM-DD] : Lookup time for given date.  Defaults to today.
-
-    --report, -r MM : Show simple monthly report of time worked
-                      in month MM (1-12).  Integer month argument required.
-
-    --test, -t : Use the pre-populated test database.
-
-    --debug, -d : Print debug messages to help find errors.
-
-    --help, -h : View this help page.
-
-Usage:
-
- $ TimeClock --in
-
- $ TimeClock --out
-
- $ TimeClock --lookup 2014-04-28
-
- $ TimeClock --report 2014-04-01 2014-04-30
-
-Times are saved into a SQLite database timeclock.db, which
-can be further queried, though this goes beyond the scope of
-this module.
-
-Please use the GitHub page (http://github.com/jcrabtree1/TimeClock) to
-submit any issues, bug reports, or suggestions.
-
-'''
-
-import time
-import os
-import sys
-import sqlite3
-from sqlite3 import OperationalError
-import argparse
-from TimeClock.utils.validation import validate_date, validate_time
-from TimeClock.utils.sqlhelpers import update_record, new_record, check_record_exists
-
-LOOKUPSTRING = \
-"""
-==========================
-   DATE    | %(date)s
---------------------------
- CLOCK IN  |  %(cin)s
- LUNCH OUT |  %(lout)s
- LUNCH IN  |  %(lin)s
- CLOCK OUT |  %(cout)s
-==========================
-"""
-
-LINUX = sys.platform == 'linux2'
-WINDOWS = sys.platform == 'win32'
-
-if not (LINUX or WINDOWS):
-    print "Unknown or unsupported OS. Exiting script."
-    exit(1)
-
-today = time.strftime("%Y-%m-%d", time.localtime())
-now = time.strftime("%H:%M:%S", time.localtime())
-
-parser = argparse.ArgumentParser()
-parser.add_argument('-u', '--update', nargs='?', const=today, default="",
-                    help="Update a previous record.")
-parser.add_argument('--in', nargs='?', const="now', 'localtime", default='',
-                    help="Clock in for the day.")
-parser.add_argument('--out', nargs='?', const="now', 'localtime", default='',
-                    help="Clock out for the day.")
-parser.add_argument('--lout', nargs='?', const="now', 'localtime", default='',
-                    help="Go to lunch.")
-parser.add_argument('--lin', nargs='?', const="now', 'localtime", default='',
-                    help="Return from lunch.")
-parser.add_argument('--lookup', nargs='?', const=today,
-                    help="Look up times from a previous record")
-parser.add_argument('-r', '--report', help='Report on monthly hours.')
-parser.add_argument('-d', '--debug', action='store_true',
-                    help='Debug the program.', default=False)
-parser.add_argument('-t', '--test', action='store_true', default=False,
-                    help='Run the test suite.')
-
-args = parser.parse_args()
-
-if args.debug:
-    print '\n', args, '\n'
-
-# Validation
-if args.update:
-    validate_date(args.update)
-if args.lookup:
-    validate_date(args.lookup)
-if vars(args)['in']:
-    validate_time(vars(args)['in'])
-if args.out:
-    validate_time(args.out)
-if args.lout:
-    validate_time(args.lout)
-if args.lin:
-    validate_time(args.lin)
-
-# Find correct DB location based on platform
-if LINUX:
-    DB_PATH = r"%s/.timeclock/timeclock.db" % os.getenv('HOME')
-    TEST_DB_PATH = r"%s/.timeclock/timeclock_test.db" % os.getenv('HOME')
-if WINDOWS:
-    DB_PATH = r"%s\AppData\Local\TimeClock\timeclock.db" % os.getenv('USERPROFILE')
-    TEST_DB_PATH = r"%s\AppData\Local\TimeClock\timeclock_test.db" % os.getenv('USERPROFILE')
-
-# Connect to database
-if args.test:
-    db = TEST_DB_PATH
-else:
-    db = DB_PATH
-
-conn = sqlite3.connect(db)
-
-# Check that DB is initialized with the correct schema
-try:
-    conn.execute('''SELECT * FROM times LIMIT 1;''')
-except OperationalError:
-    conn.execute('''
-                 CREATE TABLE times (
-                 date TEXT,
-                 clockin TEXT,
-                 lunchout TEXT,
-                 lunchin TEXT,
-                 clockout TEXT);
-                 ''')
-
-# Clock in
-if vars(args)['in']:
-    if args.update:
-        if args.debug:
-            print "Updating clockin time for ", args.update
-
-        if check_record_exists(conn, args.update):
-            update_record(conn, 'clockin', args.update, vars(args)['in'])
-        else:
-            new_record(conn, 'clockin', args.update, vars(args)['in'])
-
-    else:
-        if args.debug:
-            print "Creating new clockin time for today"
-        if check_record_exists(conn):
-            update_record(conn, 'clockin', time=vars(args)['in'])
-        else:
-            new_record(conn, 'clockin', time=vars(args)['in'])
-
-# Go to lunch.
-if args.lout:
-    if args.update:
-        if args.debug:
-            print "Updating lunch out time for ", args.update
-
-        if check_record_exists(conn, args.update):
-            update_record(conn, 'lunchout', args.update, args.lout)
-        else:
-            new_record(conn, 'lunchout', args.update, args.lout)
-
-    else:
-        if args.debug:
-            print "Creating new lunch out time for today"
-        if check_record_exists(conn):
-            update_record(conn, 'lunchout', time=args.lout)
-        else:
-            new_record(conn, 'lunchout', time=args.lout)
-
-# Return from lunch
-if args.lin:
-    if args.update:
-        if args.debug:
-            print "Updating lunch in time for ", args.update
-
-        if check_record_exists(conn, args.update):
-            update_record(conn, 'lunchin', args.update, args.lin)
-        else:
-            new_record(conn, 'lunchin', args.update, args.lin)
-
-    else:
-        if args.debug:
-            print "Creating new lunch in time for today"
-        if check_record_exists(conn):
-            update_record(conn, 'lunchin', time=args.lin)
-        else:
-            new_record(conn, 'lunchin', time=args.lin)
-
-# Clock out
-if args.out:
-    if args.update:
-        if args.debug:
-            print "Updating clock out time for ", args.update
-
-        if check_record_exists(conn, args.update):
-            update_record(conn, 'clockout', args.update, args.out)
-        else:
-            new_record(conn, 'clockout', args.update, args.out)
-
-    else:
-        if args.debug:
-            print "Creating new clock out time for today"
-        if check_record_exists(conn):
-            update_record(conn, 'clockout', time=args.out)
-        else:
-            new_record(conn, 'clockout', time=args.out)
-
-# Look up a previous record
-if args.lookup:
-    lu_date = args.lookup
-    cursor = conn.execute(
-        '''SELECT * FROM times WHERE date="%s";''' % (lu_date)
-    )
-    for row in cursor:
-        print LOOKUPSTRING % dict(zip(['date', 'cin',
-                                   'lout', 'lin', 'cout'], row)), '\n'
-
-# Reporting
-if args.report:
-    if args.report in ['ytd', 'YTD']:
-        start_date = "date('2014-01-01')"
-        end_date = "date('now', 'localtime')"
-        label = "YTD"
-    elif int(args.report) in range(1, 13):
-        start_date = "date('2014-%s-01')" % args.report.zfill(2)
-        end_date = "date('2014-%s-01', 'start of month', '+1 month', '-1 day')" % args.report.zfill(2)
-        label = "Month %s" % args.report
-    else:
-        print "Unrecognized argument.  Please use and integer from 1 to 12 or 'YTD'."
-        exit(1)
-
-    # Check if a report table already exists and delete it if so
-    try:
-        conn.execute("SELECT * FROM report LIMIT 1;")
-    except OperationalError:
-        conn.execute('''
-                     CREATE TABLE report (
-                     date TEXT,
-                     clockin TEXT,
-                     lunchout TEXT,
-                     lunchin TEXT,
-                     clockout TEXT);
-                     ''')
-    else:
-        conn.execute("DROP TABLE report;")
-        conn.execute('''
-                     CREATE TABLE report (
-                     date TEXT,
-                     clockin TEXT,
-                     lunchout TEXT,
-                     lunchin TEXT,
-                     clockout TEXT);
-                     ''')
-
-    # Create a temporary reporting table
-    conn.execute('''
-                 INSERT INTO report
-                 SELECT * FROM times WHERE date
-                 BETWEEN %s AND %s
-                 ORDER BY date(date);
-                 ''' % (start_date, end_date)
-                 )
-
-    # Add gross, lunch, total, and average columns
-    conn.execute('''
-                 ALTER TABLE report
-                 ADD COLUMN gross REAL;
-                 ''')
-
-    conn.execute('''
-                 ALTER TABLE report
-                 ADD COLUMN lunch REAL;
-                 ''')
-
-    conn.execute('''
-                 ALTER TABLE report
-                 ADD COLUMN total REAL;
-                 ''')
-
-    conn.execute('''
-                 ALTER TABLE report
-                 ADD COLUMN average REAL;
-                 ''')
-    conn.commit()
-
-    # Fill with appropriate values
-    conn.execute('''
-                 UPDATE report
-                 SET gross = (strftime('%s', clockout) - strftime('%s', clockin)) / 3600.
-                 WHERE 1=1;
-                 ''')
-
-
-    conn.execute('''
-                 UPDATE report
-                 SET lunch = (strftime('%s', lunchin) - strftime('%s', lunchout)) / 3600.
-                 WHERE 1=1;
-                 ''')
-
-
-    conn.execute("UPDATE report SET total = gross - lunch WHERE 1=1;")
-
-
-    conn.execute('''
-                 UPDATE report SET average = (
-                 SELECT AVG(total) FROM report WHERE 1=1);
-                 ''')
-    conn.commit()
-
-    if LINUX:
-        RPT_DATAFILE = r"%s/.timeclock/hoursrpt" % os.getenv('HOME')
-    if WINDOWS:
-        RPT_DATAFILE = r"%s\AppData\Local\TimeClock\hoursrpt" % os.getenv('USERPROFILE')
-    with open(RPT_DATAFILE, 'w') as out:
-        for row in conn.execute("SELECT * FROM report;").fetchall():
-            out.write("{}|{}|{}|{}|{}|{}|{}|{}|{}\n".format(row[0], row[1], row[2],
-                                                          row[3], row[4], row[5],
-                                                          row[6], row[7], row[8],))
-
-    TOTAL = conn.execute("SELECT SUM(total) FROM report;").fetchone()[0]
-    AVERAGE = conn.execute("SELECT average FROM report LIMIT 1;").fetchone()[0]
-    conn.execute("DROP TABLE report;")
-
-    # Print total and average
-    print "\n\nTotal Hours: %3.2f" % TOTAL
-    print "Average daily hours: %3.2f" % AVERAGE
-
-    # Create a GNUPLOT .plt file
-    if LINUX:
-        PLT_TEMP = r"%s/.timeclock/hoursreport.plt" % os.getenv('HOME')
-        PLT = r"%s/.timeclock/%shoursreport.plt" % (os.getenv('HOME'), args.report)
-    if WINDOWS:
-        PLT_TEMP = r"%s\AppData\Local\TimeClock\hoursreport.plt" % os.getenv('USERPROFILE')
-        PLT = r"%s\AppData\Local\TimeClock\%shoursreport.plt" % (os.getenv('USERPROFILE'), args.report)
-    with open(PLT, 'w') as newfile:
-        newfile.write(open(PLT_TEMP).read().format(label, label))
-
-    curr_dir = os.getcwd()
-    if LINUX:
-        os.chdir(r"%s/.timeclock" % os.getenv('HOME'))
-    if WINDOWS:
-        os.chdir(r"%s\AppData\Local\TimeClock" % os.getenv('USERPROFILE'))
-    os.system('gnuplot %shoursreport.plt' % args.report)
-
-    if LINUX:
-        os.system("firefox \"%s Hours.png\"" % label)
-    if WINDOWS:
-        os.system("\"%s Hours.png\"" % label)
-
-conn.commit()
-conn.close()
+#! /usr/bin/env python
+'''
+TimeClock is a utility to help keep track of your time.
+
+Flags:
+
+    --in [HH:MM]    : Clock in for the day. Defaults to now.
+
+    --out [HH:MM]   : Clock out for the day.  Defaults to now.
+
+    --lout [HH:MM]  : Clock out for lunch.  Defaults to now.
+
+    --lin [HH:MM]   : Clock in from lunch.  Defaults to now.
+
+                      Every punch is kept, so a day may hold several
+                      stretches of work: clock out and in again for a
+                      split shift, or take more than one break.  Lunch is
+                      the time between them.
+
+    --update, -u YYYY-MM-DD : Update a time from a previous date.  The
+                      time given replaces that day's punches of its kind.
+
+    --lookup [YYYY-MM-DD [YYYY-MM-DD]] : Lookup time for given date, or
+                      for every record from a START to an END date.
+                      Defaults to today.
+
+    --last N : Lookup the last N records.
+
+    --format {block,table,json} : How --lookup and --last print records:
+                      a block per record, a table line per record, or
+                      JSON lines.  Records are printed as they are read,
+                      so long ranges can be piped into other tools.
+
+    --report, -r PERIOD [PERIOD] : Show a report of time worked over a
+                      period: a month MM (1-12) of this year, YYYY-MM,
+                      YYYY-QN, YYYY-WNN (ISO week), YYYY-PNN (pay period),
+                      YYYY, YTD, week, month, quarter, year, payperiod, or
+                      a START END pair of dates or periods.
+                      Reports also list overtime per week, records with
+                      missing punches and lunch lengths, and chart 7 and
+                      30 day rolling averages of daily hours.
+                      Finished reports are cached in the cache directory
+                      and reused until a punch changes the database.  When
+                      the same report is run again, only the days changed
+                      since are rewritten in its hoursrpt data file.
+
+    --report-all PERIOD [PERIOD ...] : Write a report for each period
+                      given, or for every month of a year YYYY and the
+                      year itself (or the year to date), into the periods
+                      directory, plus a summary.csv of their totals.  The
+                      days are read once for all of them, and the charts
+                      drawn side by side.
+
+    --overtime HOURS : Weekly hours above which --report counts overtime.
+                      Defaults to 40.
+
+    --total PERIOD [PERIOD] : Show the hours and days worked over a period
+                      or a START END range, as for --report, without
+                      writing a report.  Answered from running totals in
+                      two lookups, however long the history.
+
+    --employee NAME : Whose time to punch, look up or report on.  Defaults
+                      to 'default', which owns all records made before
+                      employees were tracked.
+
+    --all-employees : With --report, write a report for every employee
+                      into the batch directory, using a pool of worker
+                      processes, plus a summary.csv of their totals.
+
+    --jobs N : Worker processes for --all-employees, or threads drawing
+               the charts of --report-all.  Defaults to one per CPU.
+
+    --renderer {gnuplot,matplotlib,svg} : How to draw the report chart.
+                      gnuplot runs gnuplot on hoursreport.plt; svg and
+                      matplotlib draw "<period> Hours.svg" or ".png"
+                      in-process.  Defaults to gnuplot.
+
+    --no-open : Save the report chart without opening it in a viewer.
+
+    --rebuild-rollups : Recompute the daily and monthly hours rollups.
+
+    --convert-storage {integer,text} : Store dates as days since 1970 and
+                      times as seconds since midnight, or back as text.
+
+    --archive YEAR : Move every closed year up to YEAR out of timeclock.db
+                      into read-only per-year files beside it
+                      (timeclock.YEAR.db).  Lookups and reports still see
+                      archived years, opening their files only when they
+                      reach into them; punches for those years are refused.
+
+    --shell : Keep the database open and read commands (in, out, lout,
+               lin, update, employee, lookup, last, total, report and
+               more; type help) from the terminal, or from stdin.  Piped
+               commands have their punches written in batches, so a
+               script of corrections runs without a process per line.
+
+    --daemon : Run the punch daemon.  While it is running, punches, lookups
+               and reports are sent to it over a Unix domain socket and
+               concurrent punches are committed together.
+
+    --import FILE : Import punch records from a CSV or JSON lines (.jsonl)
+               file, or from stdin if FILE is '-'.  Each line holds
+               date,clockin,lunchout,lunchin,clockout; each time given
+               replaces that day's punches of its kind, and blank fields
+               keep what is already stored.
+
+    --export FILE : Export all punch records to a CSV or JSON lines file,
+               or to stdout as CSV if FILE is '-'.
+
+    --export-columnar DIR : Export all punch records into DIR as one
+               binary file per column (dates as days since 1970, punches
+               as seconds since midnight, hours as floats), each punch
+               as well as each day, plus a meta.json describing them,
+               ready for numpy.memmap or the array module without any
+               parsing.
+
+    --db-profile {default,durable,bulk,legacy} : SQLite settings to use.
+               Defaults to the profile set in timeclock.cfg, or 'default'
+               (WAL journal, busy timeout, NORMAL sync).
+
+    --profile [FILE] : Time each phase of the run (start up, imports,
+               argument parsing, connecting, the schema check, punches,
+               report queries, writing hoursrpt, rendering, the viewer)
+               and write the wall clock and CPU times as JSON to FILE, or
+               to stderr.
+
+    --cprofile FILE : Save cProfile statistics for the run to FILE, to be
+               read with the pstats module.
+
+    --memory : Load the database into memory and work on it there.
+               Punches, imports and other changes are lost at exit
+               unless --write-back is given, and reports read nothing
+               from disk.  Archiving needs the database itself.
+
+    --write-back : With --memory, replace the database file with the
+               in-memory one at exit, in one step.  Refused if the file
+               was written to after it was loaded.
+
+    --test, -t : Use the pre-populated test database.
+
+    --debug, -d : Print debug messages to help find errors.
+
+    --help, -h : View this help page.
+
+Usage:
+
+ $ TimeClock --in
+
+ $ TimeClock --out
+
+ $ TimeClock --lookup 2014-04-28
+
+ $ TimeClock --lookup 2014-04-01 2014-04-30 --format table
+
+ $ TimeClock --last 10
+
+ $ TimeClock --report 2014-04-01 2014-04-30
+
+ $ TimeClock --report 2014-Q2
+
+ $ TimeClock --total 2014-01-01 2014-06-30
+
+ $ TimeClock --employee alice --in
+
+ $ TimeClock --report 2014-04 --all-employees
+
+ $ TimeClock --report-all 2014
+
+ $ TimeClock --archive 2012
+
+ $ TimeClock --test --memory --import whatif.csv --report 2014-04
+
+ $ TimeClock --shell < corrections.txt
+
+Times are saved into a SQLite database timeclock.db, which
+can be further queried, though this goes beyond the scope of
+this module.
+
+Please use the GitHub page (http://github.com/jcrabtree1/TimeClock) to
+submit any issues, bug reports, or suggestions.
+
+'''
+
+# Start timing before anything else is imported.
+from TimeClock.utils.profiling import PhaseTimer
+timer = PhaseTimer()
+
+# Only what a punch needs is imported here.  argparse and the report,
+# bulk and daemon modules are imported by the commands that use them.
+import os
+import sys
+import atexit
+from sqlite3 import OperationalError, IntegrityError
+from TimeClock.utils.validation import validate_date, validate_time
+from TimeClock.utils.sqlhelpers import current_date, current_time, NOW, \
+    DEFAULT_EMPLOYEE
+from TimeClock.utils.connection import socket_path
+from TimeClock.timeclock.service import TimeClock, app_dir, default_db
+
+timer.lap('import')
+
+LINUX = sys.platform == 'linux2'
+WINDOWS = sys.platform == 'win32'
+
+# Punch flags, the column each one sets, and how --debug describes it.
+PUNCHES = [('in', 'clockin', "clockin time"),
+           ('lout', 'lunchout', "lunch out time"),
+           ('lin', 'lunchin', "lunch in time"),
+           ('out', 'clockout', "clock out time")]
+
+# Every option and its default, shared by parse_args() and quick_args().
+DEFAULTS = {'update': '', 'in': '', 'out': '', 'lout': '', 'lin': '',
+            'lookup': None, 'last': None, 'lookup_format': 'block',
+            'report': None, 'report_all': None, 'total': None, 'overtime': 40.,
+            'employee': DEFAULT_EMPLOYEE,
+            'all_employees': False, 'jobs': None, 'renderer': 'gnuplot',
+            'no_open': False, 'rebuild_rollups': False, 'convert_storage': None,
+            'archive': None, 'memory': False, 'write_back': False, 'shell': False,
+            'daemon': False, 'import_file': None, 'export_file': None,
+            'export_columnar': None,
+            'db_profile': None, 'profile_file': None, 'cprofile': None,
+            'debug': False, 'test': False}
+
+# Options quick_args() understands that take an optional value, with the
+# option they set and the value used when none is given.
+QUICK_OPTIONS = {'--in': ('in', NOW),
+                 '--out': ('out', NOW),
+                 '--lout': ('lout', NOW),
+                 '--lin': ('lin', NOW),
+                 '-u': ('update', None),
+                 '--update': ('update', None),
+                 '--profile': ('profile_file', '-')}
+
+class Options(object):
+    '''Parsed options, as an argparse.Namespace would hold them.'''
+
+    def __init__(self, **options):
+        self.__dict__.update(DEFAULTS)
+        self.__dict__.update(options)
+
+def validate(args):
+    '''Check the dates and times given on the command line.'''
+    if args.update:
+        validate_date(args.update)
+    for date in args.lookup or []:
+        validate_date(date)
+    for flag, column, description in PUNCHES:
+        if vars(args)[flag] and vars(args)[flag] != NOW:
+            validate_time(vars(args)[flag])
+    return args
+
+def quick_args(argv):
+    '''
+    Parse a plain punch (punch flags, --update, --employee, --test and
+    --profile) without importing argparse.  Returns None for any other
+    command line, which is left to parse_args().
+    '''
+    options = {}
+    tokens = list(argv)
+    while tokens:
+        token = tokens.pop(0)
+        if token in ('-t', '--test'):
+            options['test'] = True
+        elif token == '--employee' and tokens and not tokens[0].startswith('-'):
+            options['employee'] = tokens.pop(0)
+        elif token in QUICK_OPTIONS:
+            dest, const = QUICK_OPTIONS[token]
+            if tokens and not tokens[0].startswith('-'):
+                options[dest] = tokens.pop(0)
+            else:
+                options[dest] = const or current_date()
+        else:
+            return None
+    if not any(options.get(flag) for flag, column, description in PUNCHES):
+        return None
+    return validate(Options(**options))
+
+def parse_args(argv=None):
+    '''Parse and validate the command line.'''
+    import argparse
+    from TimeClock.utils.storage import FORMATS
+    from TimeClock.utils.connection import PROFILES
+    from TimeClock.utils.render import RENDERERS
+    from TimeClock.utils.records import LOOKUP_STYLES
+
+    today = current_date()
+    parser = argparse.ArgumentParser()
+    parser.set_defaults(**DEFAULTS)
+    parser.add_argument('-u', '--update', nargs='?', const=today,
+                        help="Update a previous record.")
+    parser.add_argument('--in', nargs='?', const=NOW,
+                        help="Clock in for the day.")
+    parser.add_argument('--out', nargs='?', const=NOW,
+                        help="Clock out for the day.")
+    parser.add_argument('--lout', nargs='?', const=NOW,
+                        help="Go to lunch.")
+    parser.add_argument('--lin', nargs='?', const=NOW,
+                        help="Return from lunch.")
+    parser.add_argument('--lookup', nargs='*', metavar='DATE',
+                        help="Look up times from a previous record, or from "
+                             "every record between START and END.")
+    parser.add_argument('--last', type=int, metavar='N',
+                        help="Look up the last N records.")
+    parser.add_argument('--format', dest='lookup_format',
+                        choices=LOOKUP_STYLES,
+                        help="How to print looked up records (default: block).")
+    parser.add_argument('-r', '--report', nargs='+', metavar='PERIOD',
+                        help='Report on hours for a period or a START END range.')
+    parser.add_argument('--report-all', nargs='+', metavar='PERIOD',
+                        help='Report on each period, or on every month of a YEAR.')
+    parser.add_argument('--overtime', type=float, metavar='HOURS',
+                        help='Weekly hours above which a report counts overtime '
+                             '(default: 40).')
+    parser.add_argument('--total', nargs='+', metavar='PERIOD',
+                        help='Show hours and days worked in a period or a START END range.')
+    parser.add_argument('--employee',
+                        help='Employee to punch, look up or report on.')
+    parser.add_argument('--all-employees', action='store_true',
+                        help='Report on every employee at once.')
+    parser.add_argument('--jobs', type=int,
+                        help='Worker processes for --all-employees, or chart '
+                             'threads for --report-all (default: CPUs).')
+    parser.add_argument('--renderer', choices=sorted(RENDERERS),
+                        help='How to draw the report chart (default: gnuplot).')
+    parser.add_argument('--no-open', action='store_true',
+                        help='Save the report chart without opening a viewer.')
+    parser.add_argument('--rebuild-rollups', action='store_true',
+                        help='Recompute the daily and monthly hours rollups.')
+    parser.add_argument('--convert-storage', choices=sorted(FORMATS),
+                        help='Convert the database to text or integer storage.')
+    parser.add_argument('--archive', type=int, metavar='YEAR',
+                        help='Move closed years up to YEAR into per-year shards.')
+    parser.add_argument('--memory', action='store_true',
+                        help='Work on an in-memory copy of the database.')
+    parser.add_argument('--write-back', action='store_true',
+                        help='With --memory, save the copy over the database at exit.')
+    parser.add_argument('--shell', action='store_true',
+                        help='Read commands from the terminal or stdin.')
+    parser.add_argument('--daemon', action='store_true',
+                        help='Run the punch daemon for the database.')
+    parser.add_argument('--import', dest='import_file', metavar='FILE',
+                        help='Import punch records from a CSV or JSONL file.')
+    parser.add_argument('--export', dest='export_file', metavar='FILE',
+                        help='Export punch records to a CSV or JSONL file.')
+    parser.add_argument('--export-columnar', metavar='DIR',
+                        help='Export punch records as binary column files.')
+    parser.add_argument('--db-profile', choices=sorted(PROFILES),
+                        help='SQLite tuning profile (default: from timeclock.cfg).')
+    parser.add_argument('--profile', dest='profile_file', nargs='?', const='-',
+                        metavar='FILE', help='Write per-phase timings as JSON.')
+    parser.add_argument('--cprofile', metavar='FILE',
+                        help='Save cProfile statistics to FILE.')
+    parser.add_argument('-d', '--debug', action='store_true',
+                        help='Debug the program.')
+    parser.add_argument('-t', '--test', action='store_true',
+                        help='Run the test suite.')
+
+    args = parser.parse_args(argv)
+    if args.lookup and len(args.lookup) > 2:
+        parser.error("--lookup takes a DATE or a START END pair of dates.")
+    if args.write_back and not args.memory:
+        parser.error("--write-back only applies to --memory.")
+    return validate(args)
+
+def parse_period_args(specs, many=False):
+    '''
+    Return (start date, end date, label) for a period given on the command
+    line, or a list of them if many, or None after explaining what was
+    wrong with it.
+    '''
+    from TimeClock.utils.periods import parse_period, parse_periods
+    try:
+        return (parse_periods if many else parse_period)(specs)
+    except ValueError as err:
+        print err
+        print "Please use a period such as 4, 2014-04, 2014-Q2, 2014-W17, 2014-P08,"
+        print "2014, YTD or a START END pair of dates."
+        return None
+
+def batch_report(args, db, directory, start_date, end_date, label):
+    '''Write a report for every employee.  Returns the exit status.'''
+    from TimeClock.utils.batch import batch_reports
+
+    status = 0
+    batch_dir = os.path.join(directory, 'batch', label.replace(' ', '_'))
+    with timer.phase('batch reports'):
+        results = batch_reports(db, start_date, end_date, label, batch_dir,
+                                args.renderer, args.db_profile, args.jobs, directory,
+                                args.overtime)
+    print "\n%-20s | %9s | %5s | %7s | %8s" % ('Employee', 'Hours', 'Days', 'Average',
+                                              'Overtime')
+    print "-" * 61
+    for employee, hours, days, overtime, chart, error in results:
+        if error:
+            print "%-20s | %s" % (employee, error)
+            status = 1
+        else:
+            print "%-20s | %9.2f | %5d | %7.2f | %8.2f" % (
+                employee, hours, days, hours / days if days else 0, overtime)
+    print "\nReports for %d employees written to %s" % (len(results), batch_dir)
+    return status
+
+def report_all(args, clock, directory, periods):
+    '''
+    Write a report for each period from one pass over the days they
+    cover, drawing the charts side by side.  clock is a TimeClock or a
+    daemon client.  Returns the exit status.
+    '''
+    from TimeClock.utils.batch import period_reports, file_tag
+    from TimeClock.utils.reports import period_rows
+
+    status = 0
+    name = ' '.join(args.report_all)
+    if args.employee != DEFAULT_EMPLOYEE:
+        name = "%s %s" % (name, args.employee)
+        periods = [period._replace(label="%s %s" % (period.label, args.employee))
+                   for period in periods]
+    periods_dir = os.path.join(directory, 'periods', file_tag(name))
+    with timer.phase('report scan'):
+        rows = list(clock.report(min(period.start for period in periods),
+                                 max(period.end for period in periods),
+                                 args.employee))
+        reports = period_rows(rows, [(period.start, period.end) for period in periods])
+    with timer.phase('period reports'):
+        results = period_reports(periods, reports, periods_dir, args.renderer,
+                                 args.jobs, directory, args.overtime)
+    print "\n%-20s | %9s | %5s | %7s | %8s" % ('Period', 'Hours', 'Days', 'Average',
+                                              'Overtime')
+    print "-" * 61
+    for period, hours, days, overtime, chart, error in results:
+        if error:
+            print "%-20s | %s" % (period.label, error)
+            status = 1
+        else:
+            print "%-20s | %9.2f | %5d | %7.2f | %8.2f" % (
+                period.label, hours, days, hours / days if days else 0, overtime)
+    print "\nReports for %d periods written to %s" % (len(results), periods_dir)
+    return status
+
+def report(args, clock, db, directory, start_date, end_date, label):
+    '''
+    Write hoursrpt and the chart for one employee, print the totals and
+    open the chart.  clock is a TimeClock or a daemon client.  Returns the
+    exit status.
+    '''
+    from TimeClock.utils.cache import ReportCache
+    from TimeClock.utils.render import RENDERERS, RenderError, open_viewer
+    from TimeClock.utils.reports import read_hoursrpt, HOURSRPT_COLUMNS, \
+        HOURSRPT_STATE
+    from TimeClock.utils import analytics
+
+    status = 0
+    if args.employee != DEFAULT_EMPLOYEE:
+        label = "%s %s" % (label, args.employee)
+    datafile = os.path.join(directory, 'hoursrpt')
+    analysis = os.path.join(directory, 'hoursanalytics')
+    renderer = RENDERERS[args.renderer]
+    chart = os.path.join(directory, "%s Hours.%s" % (label, renderer.extension))
+
+    # Reuse the last run of this report if times has not changed since.
+    # Changes to an in-memory copy can bring its change counter to a value
+    # the file reaches with other changes, so the copy bypasses the cache.
+    cache = ReportCache(os.path.join(directory, 'cache'))
+    cache_key = cache.key(db, args.employee, start_date, end_date, label,
+                          renderer.name, args.overtime)
+    with timer.phase('cache lookup'):
+        version = clock.changes()
+        cached = None if args.memory else cache.fetch(cache_key, version)
+    if args.debug:
+        print "Report cache %s (%d hits, %d misses)" % (
+            ('hit',) + cache.stats if cached else ('miss',) + cache.stats)
+
+    if cached:
+        total, days = cached
+    else:
+        # Bring the data file up to date, rewriting only the days changed
+        # since it was last written, then chart and analyse what it holds.
+        with timer.phase('hoursrpt update'):
+            kept, written = clock.update_hoursrpt(datafile, start_date, end_date,
+                                                  args.employee)
+        if args.memory:
+            # For the same reason, the next run must not carry on from it.
+            os.remove(HOURSRPT_STATE % datafile)
+        if args.debug:
+            print "hoursrpt: %d rows kept, %d written" % (kept, written)
+        with timer.phase('hoursrpt read'):
+            rows = read_hoursrpt(datafile)
+            series = [(row[0], row[7], row[8]) + row[HOURSRPT_COLUMNS:] for row in rows]
+        with timer.phase('analytics'):
+            lines = analytics.summary(analytics.ReportColumns(rows), args.overtime)
+            with open(analysis, 'w') as out:
+                out.write('\n'.join(lines) + '\n')
+
+        # Total and average from the monthly and daily rollups
+        with timer.phase('report totals'):
+            total, days = clock.totals(start_date, end_date, args.employee)
+
+    print "\n\nTotal Hours: %3.2f" % total
+    print "Average daily hours: %3.2f" % (total / days if days else 0)
+    with open(analysis) as lines:
+        print lines.read()
+
+    # Draw the chart from the rows collected above
+    if not cached:
+        try:
+            with timer.phase('render'):
+                chart = renderer.render(series, label, directory)
+        except RenderError as err:
+            print err
+            chart = None
+            status = 1
+        if chart and os.path.exists(chart) and not args.memory:
+            with timer.phase('cache store'):
+                cache.store(cache_key, version, total, days,
+                            [datafile, HOURSRPT_STATE % datafile, analysis, chart])
+    if chart and not args.no_open:
+        with timer.phase('viewer'):
+            open_viewer(chart)
+    return status
+
+def main(argv=None):
+    '''Run the command line.  Returns the exit status.'''
+    if not (LINUX or WINDOWS):
+        print "Unknown or unsupported OS. Exiting script."
+        return 1
+
+    if argv is None:
+        argv = sys.argv[1:]
+    args = quick_args(argv) or parse_args(argv)
+    if args.debug:
+        print '\n', args, '\n'
+
+    timer.lap('argparse')
+    if args.profile_file:
+        atexit.register(timer.write,
+                        None if args.profile_file == '-' else args.profile_file)
+    if args.cprofile:
+        import cProfile
+        profiler = cProfile.Profile()
+        atexit.register(profiler.dump_stats, args.cprofile)
+        profiler.enable()
+
+    directory = app_dir()
+    db = default_db(args.test)
+
+    # Run as the punch daemon for this database
+    if args.daemon:
+        if not LINUX:
+            print "The TimeClock daemon needs Unix domain sockets."
+            return 1
+        from TimeClock.utils.daemon import serve
+        serve(db, profile=args.db_profile)
+        return 0
+
+    # The daemon would carry on writing to the file that was replaced.
+    if args.write_back and os.path.exists(socket_path(db)):
+        print "Stop the TimeClock daemon before writing back over its database."
+        return 1
+
+    # Hand punches, lookups and reports to a running daemon.  Corrections
+    # and maintenance commands always work on the database directly.
+    status = 0
+    client = None
+    punch_errors = (OperationalError, IntegrityError)
+    if LINUX and os.path.exists(socket_path(db)) and not (
+            args.update or args.memory or args.shell or
+            args.convert_storage or args.rebuild_rollups or args.archive or
+            args.import_file or args.export_file or args.export_columnar):
+        with timer.phase('daemon connect'):
+            from TimeClock.utils.daemon import connect_client, DaemonError
+            client = connect_client(db)
+        punch_errors = (OperationalError, IntegrityError, DaemonError)
+    if args.debug:
+        print "Using the TimeClock daemon" if client else "Using the database directly"
+
+    if client is None:
+        with timer.phase('connect'):
+            clock = TimeClock(db, args.db_profile, args.employee, upgrade_schema=False,
+                              memory=args.memory)
+
+        # Check that DB is initialized with the correct schema
+        with timer.phase('schema check'):
+            clock.upgrade_schema()
+
+        # Change how dates and times are stored
+        if args.convert_storage:
+            with timer.phase('convert storage'):
+                converted = clock.convert_storage(args.convert_storage)
+            if converted:
+                print "Converted to %s storage." % args.convert_storage
+            else:
+                print "Already using %s storage." % args.convert_storage
+
+        if args.debug:
+            print "Using %s storage" % clock.fmt.name
+
+        # Rebuild the rollup tables if they have drifted
+        if args.rebuild_rollups:
+            with timer.phase('rebuild rollups'):
+                clock.rebuild_rollups()
+            print "Rollups rebuilt."
+
+        # Move closed years into their own shards
+        if args.archive:
+            try:
+                with timer.phase('archive'):
+                    archived = clock.archive(args.archive)
+            except ValueError as err:
+                print err
+                return 1
+            for year, moved in archived:
+                print "Archived %d: %d records." % (year, moved)
+            if not archived:
+                print "Nothing to archive."
+
+        # Bulk import and export
+        if args.import_file or args.export_file:
+            from TimeClock.utils.bulk import bulk_format
+        if args.import_file:
+            try:
+                handle = sys.stdin if args.import_file == '-' else open(args.import_file,
+                                                                         'rb')
+            except IOError as err:
+                print "Cannot read %s: %s" % (args.import_file, err.strerror)
+                return 1
+            try:
+                with timer.phase('import'):
+                    imported, rejected = clock.import_records(
+                        handle, bulk_format(args.import_file))
+            finally:
+                if handle is not sys.stdin:
+                    handle.close()
+            for number, reason in rejected:
+                print "Line %d rejected: %s" % (number, reason)
+            print "Imported %d records, rejected %d lines." % (imported, len(rejected))
+            if rejected:
+                status = 1
+
+        if args.export_file:
+            handle = sys.stdout if args.export_file == '-' else open(args.export_file, 'wb')
+            try:
+                with timer.phase('export'):
+                    exported = clock.export_records(handle, bulk_format(args.export_file))
+            finally:
+                if handle is not sys.stdout:
+                    handle.close()
+            if handle is not sys.stdout:
+                print "Exported %d records to %s." % (exported, args.export_file)
+
+        if args.export_columnar:
+            with timer.phase('export columnar'):
+                exported = clock.export_columnar(args.export_columnar)
+            print "Exported %d records to %s." % (exported, args.export_columnar)
+    else:
+        clock = client
+
+    # Punches.  Each one is appended to the day's punches, or replaces the
+    # punch of its kind when updating a previous date.
+    for flag, column, description in PUNCHES:
+        if vars(args)[flag]:
+            if args.debug:
+                if args.update:
+                    print "Updating %s for " % description, args.update
+                else:
+                    print "Creating new %s for today" % description
+            date = args.update or current_date()
+            time_text = vars(args)[flag]
+            if time_text == NOW:
+                time_text = current_time()
+            try:
+                with timer.phase('punch %s' % column):
+                    clock.punch(column, date, time_text, args.employee,
+                                bool(args.update))
+            except punch_errors as err:
+                print "Something went wrong setting the %s column for %s: %s" % (
+                    column, date, err)
+                status = 1
+            else:
+                print "Punch accepted!"
+
+    # Look up previous records, printing each one as it is read
+    if args.lookup is not None or args.last:
+        with timer.phase('lookup'):
+            if args.last:
+                rows = clock.last_records(args.last, args.employee)
+            elif len(args.lookup) == 2:
+                rows = clock.records(args.lookup[0], args.lookup[1], args.employee)
+            else:
+                row = clock.lookup(args.lookup[0] if args.lookup else current_date(),
+                                   args.employee)
+                rows = [row] if row else []
+            from TimeClock.utils.records import write_records
+            write_records(rows, args.lookup_format)
+
+    # Hours and days worked, from the running totals
+    if args.total:
+        period = parse_period_args(args.total)
+        if period is None:
+            return 1
+        start_date, end_date, label = period
+        with timer.phase('total'):
+            hours, days = clock.totals(start_date, end_date, args.employee)
+        from TimeClock.utils.periods import period_title
+        print "\n%s" % period_title(start_date, end_date, label)
+        print "Total Hours: %3.2f" % hours
+        print "Days worked: %d" % days
+        print "Average daily hours: %3.2f" % (hours / days if days else 0)
+
+    # Reporting
+    if args.report:
+        period = parse_period_args(args.report)
+        if period is None:
+            return 1
+        start_date, end_date, label = period
+        if args.all_employees:
+            status |= batch_report(args, db, directory, start_date, end_date, label)
+        else:
+            status |= report(args, clock, db, directory, start_date, end_date, label)
+
+    # Reports over several periods at once
+    if args.report_all:
+        periods = parse_period_args(args.report_all, many=True)
+        if periods is None:
+            return 1
+        status |= report_all(args, clock, directory, periods)
+
+    # Commands from the terminal or stdin, on the same connection
+    if args.shell:
+        from TimeClock.timeclock.shell import TimeClockShell
+        shell = TimeClockShell(clock, args.employee, args.lookup_format)
+        shell.cmdloop()
+        status |= shell.status
+
+    # Save the in-memory database over the file
+    if args.write_back:
+        from TimeClock.utils.memory import ConflictError
+        try:
+            with timer.phase('write back'):
+                clock.save()
+        except ConflictError as err:
+            print "Not written back: %s" % err
+            status = 1
+        else:
+            print "Written back to %s." % db
+
+    clock.close()
+    return status
+
+if __name__ == '__main__':
+    if WINDOWS:
+        # Needed for the --all-employees worker pool in frozen Windows builds.
+        import multiprocessing
+        multiprocessing.freeze_support()
+    sys.exit(main())
@@ -0,0 +1,240 @@
+#! /usr/bin/env python
+'''
+Analytics over the rows of a report.
+
+The rows a report has already read are loaded column-wise into compact
+arrays: NumPy arrays when NumPy is installed, otherwise arrays from the
+array module.  Each statistic is then one pass over whole columns rather
+than a query per day:
+
+ - rolling averages of daily hours over the last 7 and 30 calendar days,
+ - hours and overtime per week (Monday to Sunday) against a threshold,
+ - records with missing punches, and records whose punches do not pair
+   up (two clock ins in a row, say),
+ - the distribution of lunch lengths.
+
+Days without a total (no clock out yet, a missing punch, or punches that
+do not alternate between in and out) are left out of the averages and
+weekly hours.  Missing values are NaN in the float columns.  A day is
+taken as unpaired when it has no total although it has a clock in and a
+clock out and either both lunch punches or neither: nothing is missing,
+so its punches must be out of order.
+
+RollingAverages computes the same rolling averages one day at a time, for
+writers that stream rows rather than hold a whole report.
+'''
+
+import bisect
+import datetime
+import itertools
+import collections
+from array import array
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from TimeClock.utils.sqlhelpers import PUNCH_COLUMNS
+
+NAN = float('nan')
+
+# Windows of the rolling averages, in days.
+ROLLING_WINDOWS = (7, 30)
+
+# Weekly hours above which time counts as overtime.
+OVERTIME_THRESHOLD = 40.
+
+# Bit of ReportColumns.missing set for a day whose punches do not pair up.
+UNPAIRED = 1 << len(PUNCH_COLUMNS)
+
+# Upper edges, in minutes, of the lunch length buckets.  The last bucket
+# holds everything longer.
+LUNCH_EDGES = (15, 30, 45, 60, 90)
+
+class ReportColumns(object):
+    '''
+    Report rows held column-wise.  dates is the list of YYYY-MM-DD texts;
+    days (date ordinals), total and lunch are arrays, and missing is a
+    bit mask per day without a total of the PUNCH_COLUMNS left empty, or
+    UNPAIRED if none of them is missing.
+    '''
+
+    def __init__(self, rows):
+        self.dates = []
+        days = array('l')
+        total = array('d')
+        lunch = array('d')
+        missing = array('B')
+        for row in rows:
+            date = row[0]
+            self.dates.append(date)
+            days.append(_ordinal(date))
+            total.append(NAN if row[7] is None else row[7])
+            lunch.append(NAN if row[6] is None else row[6])
+            # A day with a total is complete, even without a lunch.
+            missing.append(0 if row[7] is not None else _missing(row[1:5]))
+        if numpy is not None:
+            days, total, lunch, missing = [numpy.array(column) for column in
+                                           (days, total, lunch, missing)]
+        self.days, self.total, self.lunch, self.missing = days, total, lunch, missing
+
+    def __len__(self):
+        return len(self.dates)
+
+def _missing(punches):
+    clockin, lunchout, lunchin, clockout = punches
+    if clockin is not None and clockout is not None and \
+            (lunchout is None) == (lunchin is None):
+        return UNPAIRED
+    return sum(1 << bit for bit, value in enumerate(punches) if value is None)
+
+def _ordinal(date):
+    return datetime.date(int(date[:4]), int(date[5:7]), int(date[8:10])).toordinal()
+
+def _prefix_sums(values):
+    '''Running sums of the non-missing values and of their count, from 0.'''
+    sums, counts = array('d', [0.]), array('l', [0])
+    for value in values:
+        present = value == value
+        sums.append(sums[-1] + (value if present else 0.))
+        counts.append(counts[-1] + present)
+    return sums, counts
+
+def rolling_average(columns, window):
+    '''
+    Average daily hours over the window calendar days ending on each day,
+    counting only the days with a total.  NaN where there are none.
+    '''
+    if numpy is not None:
+        present = ~numpy.isnan(columns.total)
+        sums = numpy.concatenate(([0.], numpy.cumsum(numpy.where(present,
+                                                                 columns.total, 0.))))
+        counts = numpy.concatenate(([0], numpy.cumsum(present)))
+        starts = numpy.searchsorted(columns.days, columns.days - (window - 1))
+        ends = numpy.arange(1, len(columns) + 1)
+        hours, days = sums[ends] - sums[starts], counts[ends] - counts[starts]
+        with numpy.errstate(invalid='ignore', divide='ignore'):
+            return numpy.where(days > 0, hours / numpy.maximum(days, 1), NAN)
+
+    sums, counts = _prefix_sums(columns.total)
+    averages = array('d')
+    for end, day in enumerate(columns.days, 1):
+        start = bisect.bisect_left(columns.days, day - (window - 1))
+        days = counts[end] - counts[start]
+        averages.append((sums[end] - sums[start]) / days if days else NAN)
+    return averages
+
+class RollingAverages(object):
+    '''
+    Rolling averages for ROLLING_WINDOWS fed one day at a time, in date
+    order: the averages rolling_columns() gives over the same days.
+    '''
+
+    def __init__(self, windows=ROLLING_WINDOWS):
+        self.windows = windows
+        self.recent = collections.deque()
+
+    def add(self, date, total):
+        '''Add a day's total (None if missing) and return its averages.'''
+        day = _ordinal(date)
+        if total is not None:
+            self.recent.append((day, total))
+        while self.recent and self.recent[0][0] <= day - max(self.windows):
+            self.recent.popleft()
+        averages = []
+        for window in self.windows:
+            values = [value for when, value in self.recent if when > day - window]
+            averages.append(sum(values) / len(values) if values else None)
+        return tuple(averages)
+
+def weekly_hours(columns, threshold=OVERTIME_THRESHOLD):
+    '''
+    Return (Monday's date, hours, overtime) for every week with a day in
+    the report, in order.
+    '''
+    # Ordinal 1 (0001-01-01) was a Monday.
+    if numpy is not None:
+        weeks, index = numpy.unique((columns.days - 1) // 7, return_inverse=True)
+        hours = numpy.bincount(index, weights=numpy.nan_to_num(columns.total),
+                               minlength=len(weeks))
+        overtime = numpy.maximum(hours - threshold, 0.)
+        return [(datetime.date.fromordinal(int(week) * 7 + 1).isoformat(),
+                 float(total), float(extra))
+                for week, total, extra in zip(weeks, hours, overtime)]
+
+    result = []
+    pairs = zip(columns.days, columns.total)
+    for week, days in itertools.groupby(pairs, lambda pair: (pair[0] - 1) // 7):
+        total = sum(value for day, value in days if value == value)
+        result.append((datetime.date.fromordinal(week * 7 + 1).isoformat(),
+                       total, max(total - threshold, 0.)))
+    return result
+
+def _flagged(columns, bits):
+    if numpy is not None:
+        return numpy.nonzero(columns.missing & bits)[0]
+    return [index for index, mask in enumerate(columns.missing) if mask & bits]
+
+def incomplete_days(columns):
+    '''Return (date, [missing punch columns]) for every record with a gap.'''
+    return [(columns.dates[index],
+             [column for bit, column in enumerate(PUNCH_COLUMNS)
+              if columns.missing[index] & (1 << bit)])
+            for index in _flagged(columns, UNPAIRED - 1)]
+
+def unpaired_days(columns):
+    '''Return the dates of the records whose punches do not pair up.'''
+    return [columns.dates[index] for index in _flagged(columns, UNPAIRED)]
+
+def lunch_histogram(columns, edges=LUNCH_EDGES):
+    '''
+    Count the lunches in each bucket of length: under edges[0] minutes,
+    between each pair of edges, and edges[-1] or more.
+    '''
+    if numpy is not None:
+        minutes = columns.lunch[~numpy.isnan(columns.lunch)] * 60
+        return [int(count) for count in
+                numpy.bincount(numpy.digitize(minutes, edges),
+                               minlength=len(edges) + 1)]
+
+    counts = [0] * (len(edges) + 1)
+    for lunch in columns.lunch:
+        if lunch == lunch:
+            counts[bisect.bisect_right(edges, lunch * 60)] += 1
+    return counts
+
+def lunch_labels(edges=LUNCH_EDGES):
+    '''Names of the lunch_histogram buckets.'''
+    return (["<%dm" % edges[0]] +
+            ["%d-%dm" % pair for pair in zip(edges, edges[1:])] +
+            ["%dm+" % edges[-1]])
+
+def rolling_columns(columns):
+    '''
+    Return the rolling averages for ROLLING_WINDOWS as one tuple per day,
+    for the extra hoursrpt columns.
+    '''
+    averages = [rolling_average(columns, window) for window in ROLLING_WINDOWS]
+    return [tuple(None if value != value else float(value) for value in values)
+            for values in zip(*averages)]
+
+def summary(columns, threshold=OVERTIME_THRESHOLD):
+    '''Return the analytics of a report as lines of text.'''
+    weeks = weekly_hours(columns, threshold)
+    over = [week for week in weeks if week[2] > 0]
+    gaps = incomplete_days(columns)
+    unpaired = unpaired_days(columns)
+    lines = ["Overtime: %.2f hours in %d of %d weeks (over %.2f hours a week)"
+             % (sum(week[2] for week in over), len(over), len(weeks), threshold)]
+    for monday, hours, overtime in over:
+        lines.append("    week of %s: %.2f hours, %.2f overtime" % (monday, hours, overtime))
+    lines.append("Records with missing punches: %d" % len(gaps))
+    for date, missing in gaps:
+        lines.append("    %s: no %s" % (date, ', '.join(missing)))
+    lines.append("Records with unpaired punches: %d" % len(unpaired))
+    for date in unpaired:
+        lines.append("    %s: punches do not alternate between in and out" % date)
+    lines.append("Lunch lengths: " + ', '.join(
+        "%s %d" % pair for pair in zip(lunch_labels(), lunch_histogram(columns))))
+    return lines
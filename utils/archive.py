@@ -0,0 +1,127 @@
+#! /usr/bin/env python
+'''
+Move closed years out of the database into per-year shards.
+
+archive_years() moves every record of each closed year not yet archived,
+up to a given year, into a shard file next to the database named after
+it and the year ("timeclock.2012.db").  The year's daily_hours and
+cumulative_hours rows go with its punches, along with the times view, so
+the shard answers lookups and reports on its own; the running totals each
+employee had at the end of the year stay behind in archive_totals.  Reads
+reach the shards through shards.segments().
+
+Each year is moved while holding the database's write lock, so no punch
+can land in it meanwhile.  The shard is written and committed first; the
+year is only registered in archives, and its rows deleted, once the shard
+is safely on disk.  A shard left behind by an interrupted run is not
+registered and is simply written again.  Finished shards are made
+read-only.  Once the years are moved the database is vacuumed, so the
+pages they held are given back and the file shrinks.
+'''
+
+import os
+import stat
+import sqlite3
+
+from TimeClock.utils.storage import TEXT
+from TimeClock.utils.sqlhelpers import transaction, current_date
+from TimeClock.utils.rollups import drop_triggers, create_triggers
+from TimeClock.utils.shards import last_archived, database_path
+
+# Shard file name from the database's name, the year and the extension.
+SHARD_NAME = "%s.%d%s"
+
+# Tables whose rows for the year move to its shard.
+SHARD_TABLES = ('punches', 'daily_hours', 'cumulative_hours')
+
+# Views recreated in every shard.
+SHARD_VIEWS = ('times',)
+
+def shard_name(db, year):
+    '''Return the file name of the shard of year for the database file db.'''
+    root, extension = os.path.splitext(os.path.basename(db))
+    return SHARD_NAME % (root, year, extension)
+
+def _copy_year(conn, shard, first, last, fmt):
+    '''Create the shard's tables like the database's and copy the year into them.'''
+    names = SHARD_TABLES + SHARD_VIEWS
+    for (sql,) in conn.execute('''
+                               SELECT sql FROM main.sqlite_master
+                               WHERE type IN ('table', 'index', 'view') AND sql IS NOT NULL
+                               AND tbl_name IN (%s) ORDER BY type = 'view', type DESC;
+                               ''' % ', '.join('?' * len(names)), names):
+        shard.execute(sql)
+    for table in SHARD_TABLES:
+        columns = ', '.join(row[1] for row in
+                            conn.execute("PRAGMA main.table_info(%s);" % table))
+        shard.executemany("INSERT INTO %s (%s) VALUES (%s);"
+                          % (table, columns, ', '.join('?' * len(columns.split(', ')))),
+                          conn.execute("SELECT %s FROM main.%s WHERE date BETWEEN ? AND ?;"
+                                       % (columns, table),
+                                       (fmt.date_param(first), fmt.date_param(last))))
+    shard.commit()
+    return shard.execute("SELECT COUNT(*) FROM times;").fetchone()[0]
+
+def _archive_year(conn, year, fmt):
+    '''Move one year into its shard.  Returns the number of records moved.'''
+    db = database_path(conn)
+    name = shard_name(db, year)
+    path = os.path.join(os.path.dirname(db), name)
+    first, last = "%04d-01-01" % year, "%04d-12-31" % year
+    if os.path.exists(path):
+        os.remove(path)
+
+    with transaction(conn):
+        shard = sqlite3.connect(path)
+        try:
+            moved = _copy_year(conn, shard, first, last, fmt)
+        finally:
+            shard.close()
+        conn.execute('''
+                     INSERT INTO archive_totals (employee, year, hours, days)
+                     SELECT employee, ?, hours, days FROM cumulative_hours c
+                     WHERE date = (SELECT MAX(date) FROM cumulative_hours
+                                   WHERE employee = c.employee AND date <= ?);
+                     ''', (year, fmt.date_param(last)))
+        # The running totals of later days already count this year, so
+        # the rollup triggers must not take it back out.
+        drop_triggers(conn)
+        for table in SHARD_TABLES:
+            conn.execute("DELETE FROM %s WHERE date BETWEEN ? AND ?;" % table,
+                         (fmt.date_param(first), fmt.date_param(last)))
+        conn.execute("INSERT INTO archives (year, path, storage) VALUES (?, ?, ?);",
+                     (year, name, fmt.name))
+        create_triggers(conn, fmt)
+
+    os.chmod(path, stat.S_IRUSR | stat.S_IRGRP | stat.S_IROTH)
+    return moved
+
+def archive_years(conn, year, fmt=TEXT):
+    '''
+    Archive every year up to year that is not archived yet, starting from
+    the first year with records.  Only years that are over can be
+    archived.  Returns (year, records moved) for each year archived.
+    '''
+    if year >= int(current_date()[:4]):
+        raise ValueError("Only a year that is over can be archived.")
+    last = last_archived(conn)
+    if last is None:
+        first = conn.execute("SELECT %s FROM times WHERE date IS NOT NULL;"
+                             % fmt.date_sql('MIN(date)')).fetchone()[0]
+        if first is None:
+            return []
+        last = int(first[:4]) - 1
+    archived = [(number, _archive_year(conn, number, fmt))
+                for number in range(last + 1, year + 1)]
+    if archived:
+        _reclaim(conn)
+    return archived
+
+def _reclaim(conn):
+    '''Return the pages freed by the moved rows to the file system.'''
+    # With auto_vacuum = INCREMENTAL the free pages can be dropped without
+    # rewriting the whole file.
+    if conn.execute("PRAGMA auto_vacuum;").fetchone()[0] == 2:
+        conn.execute("PRAGMA incremental_vacuum;").fetchall()
+    else:
+        conn.execute("VACUUM;")
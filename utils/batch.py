@@ -0,0 +1,166 @@
+#! /usr/bin/env python
+'''
+Reports for every employee, or every period, at once.
+
+batch_reports() lists everyone with records and hands one report per
+employee to a pool of worker processes.  Each worker opens its own
+connection, so the reports are read side by side (readers do not block
+each other in WAL mode), and writes that employee's data file and chart
+into the batch directory.  A summary.csv of hours, days, average and
+overtime (see analytics.py) per employee is written alongside them.
+
+period_reports() does the same for one employee's reports over several
+periods, such as every month of a year, from rows already read in one
+pass (see reports.period_rows).  Each period gets its own data file and
+chart; the charts are drawn by a pool of threads, as gnuplot does its
+work in a process of its own.
+'''
+
+import os
+import re
+import csv
+import shutil
+import sqlite3
+import multiprocessing
+from multiprocessing.pool import ThreadPool
+
+from TimeClock.utils.connection import connect
+from TimeClock.utils.storage import storage_format
+from TimeClock.utils.reports import report_rows, write_hoursrpt
+from TimeClock.utils.rollups import range_totals, employees
+from TimeClock.utils.render import RENDERERS, RenderError, PLT_TEMPLATE
+from TimeClock.utils.analytics import ReportColumns, rolling_columns, \
+    weekly_hours, OVERTIME_THRESHOLD
+
+SUMMARY_NAME = 'summary.csv'
+
+def file_tag(name):
+    '''A file name safe version of an employee name or period label.'''
+    return re.sub(r'[^\w.-]+', '_', name)
+
+def _employee_report(task):
+    '''
+    Worker: write one employee's report.  Returns (employee, hours, days,
+    overtime, chart path, error message or None).
+    '''
+    (db, profile, start_date, end_date, label, employee, directory, renderer,
+     threshold) = task
+    datafile = "%s.hoursrpt" % file_tag(employee)
+    try:
+        conn = connect(db, profile)
+        try:
+            fmt = storage_format(conn)
+            rows = list(report_rows(conn, start_date, end_date, fmt, employee))
+            columns = ReportColumns(rows)
+            series = write_hoursrpt(os.path.join(directory, datafile), rows,
+                                    rolling_columns(columns))
+            overtime = sum(week[2] for week in weekly_hours(columns, threshold))
+            hours, days = range_totals(conn, start_date, end_date, fmt, employee)
+        finally:
+            conn.close()
+        chart = RENDERERS[renderer].render(series, "%s %s" % (label, file_tag(employee)),
+                                           directory, datafile)
+    except (sqlite3.Error, RenderError, IOError) as err:
+        return employee, 0., 0, 0., None, str(err)
+    return employee, hours, days, overtime, chart, None
+
+def _prepare(directory, renderer, template_dir):
+    '''Create directory and copy the gnuplot template into it if needed.'''
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    if renderer == 'gnuplot' and template_dir:
+        shutil.copy(os.path.join(template_dir, PLT_TEMPLATE), directory)
+
+def batch_reports(db, start_date, end_date, label, directory, renderer='gnuplot',
+                  profile=None, jobs=None, template_dir=None,
+                  overtime=OVERTIME_THRESHOLD):
+    '''
+    Write a report for every employee into directory using jobs worker
+    processes (one per CPU if None; jobs=1 runs in this process).  The
+    gnuplot template is copied from template_dir.  Overtime is counted
+    over overtime hours a week.  Returns the worker results in employee
+    order.
+    '''
+    _prepare(directory, renderer, template_dir)
+    conn = connect(db, profile)
+    try:
+        names = employees(conn)
+    finally:
+        conn.close()
+    tasks = [(db, profile, start_date, end_date, label, employee, directory, renderer,
+              overtime) for employee in names]
+
+    if jobs == 1 or len(tasks) < 2:
+        results = map(_employee_report, tasks)
+    else:
+        pool = multiprocessing.Pool(jobs)
+        try:
+            results = pool.map(_employee_report, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    with open(os.path.join(directory, SUMMARY_NAME), 'wb') as out:
+        writer = csv.writer(out)
+        writer.writerow(['employee', 'hours', 'days', 'average', 'overtime'])
+        for employee, hours, days, overtime, chart, error in results:
+            if error is None:
+                writer.writerow([employee, "%.2f" % hours, days,
+                                 "%.2f" % (hours / days if days else 0),
+                                 "%.2f" % overtime])
+    return results
+
+def _period_report(task):
+    '''
+    Thread: write one period's report.  Returns (period, hours, days,
+    overtime, chart path or None, error message or None).
+    '''
+    period, rows, directory, renderer, threshold = task
+    columns = ReportColumns(rows)
+    days = sum(1 for row in rows if row[7] is not None)
+    hours = rows[-1][9] if days else 0.
+    overtime = sum(week[2] for week in weekly_hours(columns, threshold))
+    if not rows:
+        return period, hours, days, overtime, None, None
+    datafile = "%s.hoursrpt" % file_tag(period.label)
+    try:
+        series = write_hoursrpt(os.path.join(directory, datafile), rows,
+                                rolling_columns(columns))
+        chart = RENDERERS[renderer].render(series, period.label, directory, datafile)
+    except (RenderError, IOError) as err:
+        return period, 0., 0, 0., None, str(err)
+    return period, hours, days, overtime, chart, None
+
+def period_reports(periods, reports, directory, renderer='gnuplot', jobs=None,
+                   template_dir=None, overtime=OVERTIME_THRESHOLD):
+    '''
+    Write the report rows of each of periods (see periods.Period) into
+    directory, drawing the charts with jobs threads (one per CPU if None;
+    jobs=1 draws them in turn).  The gnuplot template is copied from
+    template_dir.  Returns the results of _period_report() in period order.
+    '''
+    _prepare(directory, renderer, template_dir)
+    tasks = [(period, rows, directory, renderer, overtime)
+             for period, rows in zip(periods, reports)]
+
+    if jobs == 1 or len(tasks) < 2:
+        results = map(_period_report, tasks)
+    else:
+        pool = ThreadPool(jobs)
+        try:
+            results = pool.map(_period_report, tasks)
+        finally:
+            pool.close()
+            pool.join()
+
+    with open(os.path.join(directory, SUMMARY_NAME), 'wb') as out:
+        writer = csv.writer(out)
+        writer.writerow(['period', 'start', 'end', 'hours', 'days', 'average',
+                         'overtime'])
+        for period, hours, days, overtime, chart, error in results:
+            if error is None:
+                writer.writerow([period.label, period.start, period.end,
+                                 "%.2f" % hours, days,
+                                 "%.2f" % (hours / days if days else 0),
+                                 "%.2f" % overtime])
+    return results
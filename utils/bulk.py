@@ -0,0 +1,273 @@
+#! /usr/bin/env python
+'''
+Bulk import and export of punch records as CSV or JSON lines.
+
+Both formats carry the columns of the times table:
+
+    date,clockin,lunchout,lunchin,clockout,employee
+    2014-04-28,08:30:00,12:00:00,12:45:00,17:15:00,alice
+
+A CSV header row is optional, and so is the employee column; records
+without one belong to the employee the import is run for.  Each punch
+of a record replaces any punches of the same kind stored for that day
+before the import, so importing a record corrects it; empty fields (or
+missing JSON keys) leave the others untouched.  Several records for one
+day are imported together.
+
+An export reads the punches themselves, in time order.  A day's punches
+go into one record until a punch would not follow the columns already
+filled, which starts another record, so a day of several stretches of
+work is exported as several records and imports back unchanged:
+
+    2014-04-28,08:30:00,,,12:00:00,alice
+    2014-04-28,13:00:00,,,17:15:00,alice
+
+Shards archived before punches were kept one by one hold a single record
+per day, which is exported as it is.
+
+An import validates every line with precompiled patterns instead of one
+strptime() call per field, streams the good rows through executemany(),
+one statement appending all the punches of a row, and commits once.  The
+rollup triggers are switched off for the import and the affected months
+are rebuilt in one pass at the end.  Rejected lines, including any dated
+in an archived year, are returned with their line numbers.
+
+An export streams straight from the cursor, so memory use does not grow
+with the size of the table.  Archived years are exported from their
+shards first, then the main database.
+'''
+
+import re
+import csv
+import json
+import calendar
+import itertools
+
+from TimeClock.utils.storage import TEXT
+from TimeClock.utils.sqlhelpers import PUNCH_COLUMNS, DEFAULT_EMPLOYEE, transaction
+from TimeClock.utils.rollups import rebuild_rollups, drop_triggers, create_triggers
+from TimeClock.utils.shards import segments, has_punches, last_archived, \
+     FIRST_DATE, LAST_DATE
+from TimeClock.utils.validation import DATE_RE, TIME_RE, DATE_PATTERN, TIME_PATTERN
+
+COLUMNS = ('date',) + PUNCH_COLUMNS + ('employee',)
+
+# The date and punches of a record joined with '|', checked with a
+# single match.
+RECORD_RE = re.compile(r'^%s(\|(%s)?){4}$' % (DATE_PATTERN, TIME_PATTERN))
+
+def bulk_format(path):
+    '''
+    Guess 'csv' or 'jsonl' from a file name.  Returns None for '-', in
+    which case an import sniffs the first line and an export writes CSV.
+    '''
+    if path == '-':
+        return None
+    return 'jsonl' if path.lower().endswith(('.jsonl', '.json')) else 'csv'
+
+def _check_day(date):
+    '''Reject year 0 and days past the end of their month.'''
+    year, month, day = int(date[:4]), int(date[5:7]), int(date[8:])
+    return year > 0 and (day <= 28 or day <= calendar.monthrange(year, month)[1])
+
+def _reason(values):
+    '''Explain why a record failed RECORD_RE.'''
+    if not DATE_RE.match(values[0]):
+        return "bad date %r" % values[0]
+    for column, value in zip(PUNCH_COLUMNS, values[1:]):
+        if value and not TIME_RE.match(value):
+            return "bad %s time %r" % (column, value)
+    return "could not parse line"
+
+def _read_csv(handle):
+    '''
+    Yield (line number, values, reason) for each CSV record.  values holds
+    one string per entry of COLUMNS, or is None when reason says why the
+    line could not be read.
+    '''
+    order = None
+    header_error = None
+    reader = csv.reader(handle)
+    for fields in reader:
+        number = reader.line_num
+        if number == 1 and fields and fields[0].strip().lower() == 'date':
+            header = [field.strip().lower() for field in fields]
+            unknown = set(header) - set(COLUMNS)
+            if unknown:
+                # Without the header the columns cannot be told apart.
+                header_error = "unknown column %r in header" % sorted(unknown)[0]
+                yield number, None, header_error
+                continue
+            order = [header.index(column) if column in header else None
+                     for column in COLUMNS]
+            continue
+        if not fields:
+            continue
+        if header_error:
+            yield number, None, "not read: line 1 has an %s" % header_error
+            continue
+        if len(fields) > len(order or COLUMNS):
+            yield number, None, "too many fields"
+            continue
+        fields = [field.strip() for field in fields]
+        if order:
+            fields = [fields[i] if i is not None and i < len(fields) else ''
+                      for i in order]
+        else:
+            fields += [''] * (len(COLUMNS) - len(fields))
+        yield number, fields, None
+
+def _read_jsonl(handle):
+    '''Yield (line number, values, reason) for each JSON line, as _read_csv.'''
+    for number, line in enumerate(handle, 1):
+        if not line.strip():
+            continue
+        try:
+            record = json.loads(line)
+        except ValueError:
+            yield number, None, "could not parse line"
+            continue
+        if not isinstance(record, dict):
+            yield number, None, "not a JSON object"
+            continue
+        unknown = set(record) - set(COLUMNS)
+        if unknown:
+            yield number, None, "unknown column %s" % sorted(unknown)[0]
+            continue
+        values = [record.get(column) or '' for column in COLUMNS]
+        if not all(isinstance(value, basestring) for value in values):
+            yield number, None, "values must be strings"
+            continue
+        yield number, values, None
+
+def _validated(records, fmt, employee, rejected, summary, archived=None):
+    '''
+    Yield bind parameters for every valid record, filling in employee
+    where a record names nobody.  Invalid ones, and any dated in or before
+    the archived year, are added to rejected as (line number, reason);
+    summary counts the valid rows and tracks the first and last dates
+    imported.
+    '''
+    text = fmt is TEXT
+    match = RECORD_RE.match
+    closed = "%04d-12-31" % archived if archived else None
+    for number, values, reason in records:
+        if values is None:
+            rejected.append((number, reason))
+            continue
+        if not match('|'.join(values[:5])):
+            rejected.append((number, _reason(values)))
+            continue
+        date = values[0]
+        if date[8:] > '28' or date[:4] == '0000':
+            if not _check_day(date):
+                rejected.append((number, "bad date %r" % date))
+                continue
+        if closed and date <= closed:
+            rejected.append((number, "%s is in an archived year" % date))
+            continue
+
+        summary['rows'] += 1
+        if summary['first'] is None or date < summary['first']:
+            summary['first'] = date
+        if summary['last'] is None or date > summary['last']:
+            summary['last'] = date
+        if text:
+            params = [value or None for value in values[:5]]
+        else:
+            params = [fmt.date_param(date)] + [fmt.time_param(value) if value else None
+                                               for value in values[1:5]]
+        params.append(values[5] or employee)
+        yield params
+
+# Appends the punches of one record, bound as yielded by _validated().
+INSERT_PUNCHES = '''
+    INSERT INTO punches (employee, date, time, kind)
+    SELECT ?6, ?1, time, kind FROM (%s) WHERE time IS NOT NULL;
+    ''' % ' UNION ALL '.join("SELECT ?%d AS time, '%s' AS kind" % (number, column)
+                             for number, column in enumerate(PUNCH_COLUMNS, 2))
+
+def import_records(conn, handle, file_format='csv', fmt=TEXT,
+                   employee=DEFAULT_EMPLOYEE):
+    '''
+    Import punch records from an open file in one transaction.  Records
+    without an employee are imported for employee.  A file_format of None
+    sniffs the first line.  Returns (rows imported, list of (line number,
+    reason) for rejected lines).
+    '''
+    if file_format is None:
+        first_line = handle.readline()
+        file_format = 'jsonl' if first_line.lstrip().startswith('{') else 'csv'
+        handle = itertools.chain([first_line], handle)
+    reader = _read_jsonl if file_format == 'jsonl' else _read_csv
+    rejected, summary = [], {'rows': 0, 'first': None, 'last': None}
+    with transaction(conn):
+        # The rollups are rebuilt once for the imported range instead of
+        # firing the triggers for every row.
+        drop_triggers(conn)
+        first = conn.execute("SELECT COALESCE(MAX(id), 0) + 1 FROM punches;").fetchone()[0]
+        conn.executemany(INSERT_PUNCHES,
+                         _validated(reader(handle), fmt, employee, rejected, summary,
+                                    last_archived(conn)))
+        # Each imported punch replaces the ones of its kind stored for that
+        # day before the import.
+        conn.execute('''
+                     DELETE FROM punches WHERE id IN (
+                         SELECT earlier.id FROM punches imported
+                         JOIN punches earlier ON earlier.employee = imported.employee
+                         AND earlier.date = imported.date AND earlier.kind = imported.kind
+                         AND earlier.id < ?
+                         WHERE imported.id >= ?);
+                     ''', (first, first))
+        if summary['rows']:
+            rebuild_rollups(conn, fmt, summary['first'], summary['last'])
+        else:
+            create_triggers(conn, fmt)
+    return summary['rows'], rejected
+
+def _export_rows(conn, schema, fmt):
+    '''Yield the records of one database in COLUMNS order, as described above.'''
+    if not has_punches(conn, schema):
+        for row in conn.execute('''
+                                SELECT %s, %s, %s, %s, %s, employee FROM %s.times
+                                WHERE date IS NOT NULL ORDER BY employee, date;
+                                ''' % ((fmt.date_sql('date'),) +
+                                       tuple(fmt.time_sql(column)
+                                             for column in PUNCH_COLUMNS) + (schema,))):
+            yield row
+        return
+
+    places = dict((column, number) for number, column in enumerate(PUNCH_COLUMNS, 1))
+    record, last = None, None
+    for date, time, kind, employee in conn.execute('''
+                                                   SELECT %s, %s, kind, employee
+                                                   FROM %s.punches
+                                                   ORDER BY employee, date, time, id;
+                                                   ''' % (fmt.date_sql('date'),
+                                                          fmt.time_sql('time'), schema)):
+        place = places[kind]
+        if record is None or (record[0], record[5]) != (date, employee) or place <= last:
+            if record:
+                yield record
+            record = [date, None, None, None, None, employee]
+        record[place], last = time, place
+    if record:
+        yield record
+
+def export_records(conn, handle, file_format='csv', fmt=TEXT):
+    '''Write every punch record to an open file.  Returns the row count.'''
+    cursor = itertools.chain.from_iterable(
+        _export_rows(conn, schema, fmt)
+        for schema, fmt, first, last in segments(conn, FIRST_DATE, LAST_DATE, fmt))
+    count = 0
+    if file_format == 'jsonl':
+        for count, row in enumerate(cursor, 1):
+            handle.write(json.dumps(dict((column, value) for column, value
+                                         in zip(COLUMNS, row) if value is not None)))
+            handle.write('\n')
+    else:
+        writer = csv.writer(handle)
+        writer.writerow(COLUMNS)
+        for count, row in enumerate(cursor, 1):
+            writer.writerow(['' if value is None else value for value in row])
+    return count
@@ -0,0 +1,119 @@
+#! /usr/bin/env python
+'''
+Cache of finished reports in the application data directory.
+
+A report is keyed on the database, its date range, its label and the
+renderer that drew its chart.  Each entry keeps the range totals and
+copies of the hoursrpt data file and the chart, stamped with the value of
+the change counter (see rollups.change_counter) when it was made.  While
+the counter is unchanged, a repeated report is answered from the cache
+without reading times at all.
+
+The cache is bounded by MAX_CACHE_BYTES; the least recently used entries
+are evicted first.  Hit and miss counts are kept in the index alongside
+the entries.
+'''
+
+import os
+import sys
+import json
+import time
+import shutil
+import hashlib
+
+MAX_CACHE_BYTES = 32 * 1024 * 1024
+INDEX_NAME = 'index.json'
+
+class ReportCache(object):
+    '''An LRU cache of report files and totals kept in one directory.'''
+
+    def __init__(self, directory, max_bytes=MAX_CACHE_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.index_path = os.path.join(directory, INDEX_NAME)
+        try:
+            with open(self.index_path) as index:
+                self.index = json.load(index)
+        except (IOError, ValueError):
+            self.index = {}
+        self.index.setdefault('entries', {})
+        self.index.setdefault('hits', 0)
+        self.index.setdefault('misses', 0)
+
+    @staticmethod
+    def key(*parts):
+        '''Build a cache key from the parts that identify a report.'''
+        return '|'.join(str(part) for part in parts)
+
+    @property
+    def stats(self):
+        '''Return (hits, misses) over the life of the cache.'''
+        return self.index['hits'], self.index['misses']
+
+    def _path(self, name):
+        return os.path.join(self.directory, name)
+
+    def _save(self):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        temp = self.index_path + '.tmp'
+        with open(temp, 'w') as index:
+            json.dump(self.index, index)
+        if sys.platform == 'win32' and os.path.exists(self.index_path):
+            os.remove(self.index_path)
+        os.rename(temp, self.index_path)
+
+    def _discard(self, key):
+        for name, target in self.index['entries'].pop(key)['files']:
+            if os.path.exists(self._path(name)):
+                os.remove(self._path(name))
+
+    def fetch(self, key, version):
+        '''
+        Return (total, days) for key and copy its files back into place,
+        or return None if the entry is missing or older than version.
+        '''
+        entry = self.index['entries'].get(key)
+        if entry and entry['version'] == version and \
+                all(os.path.exists(self._path(name)) for name, target in entry['files']):
+            for name, target in entry['files']:
+                shutil.copyfile(self._path(name), target)
+            entry['used'] = time.time()
+            self.index['hits'] += 1
+            self._save()
+            return entry['total'], entry['days']
+
+        if entry:
+            self._discard(key)
+        self.index['misses'] += 1
+        self._save()
+        return None
+
+    def store(self, key, version, total, days, paths):
+        '''Save a report's totals and copies of its files under key.'''
+        if key in self.index['entries']:
+            self._discard(key)
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        digest = hashlib.sha1(key).hexdigest()
+        files, size = [], 0
+        for number, path in enumerate(paths):
+            name = "%s-%d%s" % (digest, number, os.path.splitext(path)[1])
+            shutil.copyfile(path, self._path(name))
+            size += os.path.getsize(path)
+            files.append((name, path))
+        self.index['entries'][key] = {'version': version, 'total': total,
+                                      'days': days, 'files': files,
+                                      'size': size, 'used': time.time()}
+        self._evict()
+        self._save()
+
+    def _evict(self):
+        '''Drop the least recently used entries until under max_bytes.'''
+        entries = self.index['entries']
+        used = sum(entry['size'] for entry in entries.values())
+        for key in sorted(entries, key=lambda key: entries[key]['used']):
+            if used <= self.max_bytes:
+                break
+            used -= entries[key]['size']
+            self._discard(key)
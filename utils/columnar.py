@@ -0,0 +1,200 @@
+#! /usr/bin/env python
+'''
+Columnar export of the time history for analytics.
+
+export_columnar() writes every day, from the archived years and the
+main database alike, into a directory holding one file per column:
+
+    employee.i4    index into the "employees" list of meta.json
+    date.i4        days since 1970-01-01
+    clockin.i4, lunchout.i4, lunchin.i4, clockout.i4
+                   seconds since midnight of the day's first clock in,
+                   lunch out and lunch in and of its last clock out, -1
+                   if missing
+    gross.f8, lunch.f8, total.f8
+                   hours, NaN if missing
+
+A day worked in several stretches has more punches than those four, so
+every punch is written as well, one row each, into the files of
+EVENT_COLUMNS:
+
+    punch_employee.i4, punch_date.i4
+                   as employee.i4 and date.i4
+    punch_seconds.i4
+                   seconds since midnight
+    punch_kind.i1  index into sqlhelpers.PUNCH_COLUMNS
+
+Shards archived before punches were stored one by one hold only the four
+punch columns of each day, and those are taken as its punches.
+
+Values are little-endian and of fixed width, so each file maps straight
+onto an array without parsing:
+
+    numpy.memmap('date.i4', dtype='<i4', mode='r')
+
+read_columnar() does that for every column, or reads them into arrays
+from the array module when NumPy is not installed.  Days are in date
+order, then employee order, and punches in date, employee and time
+order.
+
+meta.json lists the day and punch counts, the file and dtype of each
+column, the employees and the change counter (see
+rollups.change_counter) of the database when the export began.  It is
+written last, so a directory without one holds no complete export.  Rows
+are read CHUNK_ROWS at a time and appended to the column files, so
+memory use stays flat however long the history.
+'''
+
+import os
+import sys
+import json
+from array import array
+
+from TimeClock.utils.storage import TEXT
+from TimeClock.utils.sqlhelpers import PUNCH_COLUMNS
+from TimeClock.utils.shards import segments, has_punches, FIRST_DATE, LAST_DATE
+from TimeClock.utils.rollups import change_counter
+
+META_NAME = 'meta.json'
+
+# Rows fetched and written at a time.
+CHUNK_ROWS = 16384
+
+NAN = float('nan')
+
+# Column name, array typecode and dtype of each column, in file order.
+INT, FLOAT = ('i', '<i4'), ('d', '<f8')
+COLUMNS = ([('employee',) + INT, ('date',) + INT] +
+           [(column,) + INT for column in PUNCH_COLUMNS] +
+           [('gross',) + FLOAT, ('lunch',) + FLOAT, ('total',) + FLOAT])
+EVENT_COLUMNS = [('punch_employee',) + INT, ('punch_date',) + INT,
+                 ('punch_seconds',) + INT, ('punch_kind', 'b', '<i1')]
+
+def column_file(name, dtype):
+    '''The file name of a column: its name, then its type and width.'''
+    return "%s.%s%s" % (name, dtype[1], dtype[2:])
+
+def _columnar_sql(fmt, schema):
+    return '''
+           SELECT t.employee, %s, %s, d.gross, d.lunch, d.total
+           FROM %s.times t
+           JOIN %s.daily_hours d ON d.employee = t.employee AND d.date = t.date
+           WHERE t.date IS NOT NULL
+           ORDER BY t.date, t.employee;
+           ''' % (fmt.days_sql('t.date'),
+                  ', '.join("COALESCE(%s, -1)" % fmt.day_seconds_sql('t.' + column)
+                            for column in PUNCH_COLUMNS),
+                  schema, schema)
+
+def _events_sql(conn, fmt, schema):
+    if has_punches(conn, schema):
+        source = "SELECT employee, date, time, kind, id FROM %s.punches" % schema
+    else:
+        source = ' UNION ALL '.join(
+            "SELECT employee, date, %s AS time, %d AS kind, 0 AS id FROM %s.times "
+            "WHERE %s IS NOT NULL" % (column, number, schema, column)
+            for number, column in enumerate(PUNCH_COLUMNS))
+    return '''
+           SELECT employee, %s, %s, %s FROM (%s)
+           WHERE date IS NOT NULL
+           ORDER BY date, employee, time, id;
+           ''' % (fmt.days_sql('date'), fmt.day_seconds_sql('time'),
+                  "CASE kind %s ELSE kind END" % ' '.join(
+                      "WHEN '%s' THEN %d" % (column, number)
+                      for number, column in enumerate(PUNCH_COLUMNS)),
+                  source)
+
+def _append(handle, typecode, values):
+    values = array(typecode, values)
+    if sys.byteorder == 'big':
+        values.byteswap()
+    values.tofile(handle)
+
+def _write_rows(cursor, handles, layout, codes):
+    '''
+    Append the rows of cursor, an employee first, to the files of layout.
+    Returns the row count.
+    '''
+    count = 0
+    for rows in iter(lambda: cursor.fetchmany(CHUNK_ROWS), []):
+        columns = zip(*rows)
+        columns[0] = [codes.setdefault(employee, len(codes)) for employee in columns[0]]
+        for index, (name, typecode, dtype) in enumerate(layout):
+            if typecode == 'd':
+                columns[index] = [NAN if value is None else value
+                                  for value in columns[index]]
+        for handle, (name, typecode, dtype), values in zip(handles, layout, columns):
+            _append(handle, typecode, values)
+        count += len(rows)
+    return count
+
+def export_columnar(conn, directory, fmt=TEXT):
+    '''
+    Write every day into column files in directory, laid out as COLUMNS,
+    and every punch into those of EVENT_COLUMNS, and describe them in
+    meta.json.  Returns the day count.
+    '''
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    meta_path = os.path.join(directory, META_NAME)
+    if os.path.exists(meta_path):
+        os.remove(meta_path)
+
+    # Read before the rows, so the export holds every change up to it.
+    counter = change_counter(conn)
+    codes = {}
+    count = punches = 0
+    handles = [open(os.path.join(directory, column_file(name, dtype)), 'wb')
+               for name, typecode, dtype in COLUMNS + EVENT_COLUMNS]
+    try:
+        for schema, part_fmt, first, last in segments(conn, FIRST_DATE, LAST_DATE, fmt):
+            count += _write_rows(conn.execute(_columnar_sql(part_fmt, schema)),
+                                 handles[:len(COLUMNS)], COLUMNS, codes)
+            punches += _write_rows(conn.execute(_events_sql(conn, part_fmt, schema)),
+                                   handles[len(COLUMNS):], EVENT_COLUMNS, codes)
+    finally:
+        for handle in handles:
+            handle.close()
+
+    describe = lambda layout: [{'name': name, 'file': column_file(name, dtype),
+                                'dtype': dtype} for name, typecode, dtype in layout]
+    meta = {'rows': count, 'punches': punches, 'counter': counter,
+            'employees': sorted(codes, key=codes.get),
+            'columns': describe(COLUMNS), 'event_columns': describe(EVENT_COLUMNS)}
+    with open(meta_path, 'w') as out:
+        json.dump(meta, out, indent=1)
+    return count
+
+def read_columnar(directory):
+    '''
+    Return (meta, {column name: values}) for an export in directory, the
+    columns of its days and of its punches alike.  The values are
+    read-only numpy.memmap arrays if NumPy is installed, or arrays from
+    the array module otherwise.
+    '''
+    try:
+        import numpy
+    except ImportError:
+        numpy = None
+
+    with open(os.path.join(directory, META_NAME)) as handle:
+        meta = json.load(handle)
+    typecodes = dict((dtype, typecode)
+                     for name, typecode, dtype in COLUMNS + EVENT_COLUMNS)
+    columns = {}
+    for layout, rows in (('columns', meta['rows']), ('event_columns', meta['punches'])):
+        for column in meta[layout]:
+            path = os.path.join(directory, column['file'])
+            if numpy is not None:
+                # An empty file cannot be mapped.
+                columns[column['name']] = (numpy.memmap(path, dtype=column['dtype'],
+                                                        mode='r') if rows
+                                           else numpy.zeros(0, column['dtype']))
+                continue
+            values = array(typecodes[column['dtype']])
+            with open(path, 'rb') as handle:
+                values.fromfile(handle, rows)
+            if sys.byteorder == 'big':
+                values.byteswap()
+            columns[column['name']] = values
+    return meta, columns
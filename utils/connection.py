@@ -0,0 +1,133 @@
+#! /usr/bin/env python
+'''
+Open SQLite connections tuned for concurrent punchers.
+
+Every connection is opened through connect(), which applies the PRAGMAs
+of a named profile.  The default profile puts the database in WAL mode so
+reports and lookups never block punches, and sets a busy timeout so that
+writers queue for the lock instead of failing straight away.
+
+Profiles can be chosen, and individual settings overridden, in a
+timeclock.cfg file next to the database:
+
+    [sqlite]
+    profile = durable
+    cache_size = -16000
+
+Writes that still lose the race for the lock are retried with
+exponential backoff by retry_on_lock().
+'''
+
+import os
+import time
+import sqlite3
+from sqlite3 import OperationalError
+
+PROFILES = {
+    # WAL with NORMAL sync: a power loss can roll back the last few
+    # commits but never corrupts the database.
+    'default': {'journal_mode': 'wal',
+                'synchronous': 'normal',
+                'busy_timeout': 5000,
+                'mmap_size': 64 * 1024 * 1024,
+                'cache_size': -8000},
+    # WAL with a sync on every commit.
+    'durable': {'journal_mode': 'wal',
+                'synchronous': 'full',
+                'busy_timeout': 10000,
+                'mmap_size': 64 * 1024 * 1024,
+                'cache_size': -8000},
+    # For one-off bulk jobs on a copy of the database.
+    'bulk': {'journal_mode': 'wal',
+             'synchronous': 'off',
+             'busy_timeout': 5000,
+             'mmap_size': 256 * 1024 * 1024,
+             'cache_size': -64000},
+    # What the program used to run with: SQLite's defaults plus the
+    # five second timeout of the sqlite3 module.
+    'legacy': {'journal_mode': 'delete',
+               'synchronous': 'full',
+               'busy_timeout': 5000,
+               'mmap_size': 0,
+               'cache_size': -2000},
+}
+
+DEFAULT_PROFILE = 'default'
+
+# journal_mode has to be set before anything else touches the database.
+PRAGMA_ORDER = ['busy_timeout', 'journal_mode', 'synchronous',
+                'mmap_size', 'cache_size']
+
+CONFIG_NAME = 'timeclock.cfg'
+
+# Backoff for writes that fail with "database is locked" even after the
+# busy timeout: RETRIES attempts, starting at RETRY_DELAY seconds and
+# doubling up to MAX_RETRY_DELAY, with random jitter.
+RETRIES = 8
+RETRY_DELAY = 0.01
+MAX_RETRY_DELAY = 1.0
+
+def load_settings(db, profile=None):
+    '''
+    Return the PRAGMA settings for db: the named profile (or the one chosen
+    in timeclock.cfg), with any overrides from timeclock.cfg applied.
+    '''
+    overrides = {}
+    path = os.path.join(os.path.dirname(os.path.abspath(db)), CONFIG_NAME)
+    if os.path.exists(path):
+        # Most installs have no timeclock.cfg; only they pay for ConfigParser.
+        from ConfigParser import SafeConfigParser
+        config = SafeConfigParser()
+        config.read(path)
+        if config.has_section('sqlite'):
+            overrides = dict(config.items('sqlite'))
+
+    name = profile or overrides.pop('profile', DEFAULT_PROFILE)
+    overrides.pop('profile', None)
+    if name not in PROFILES:
+        raise ValueError("Unknown SQLite profile: %s" % name)
+    settings = dict(PROFILES[name])
+    for key, value in overrides.items():
+        if key not in settings:
+            raise ValueError("Unknown SQLite setting in %s: %s" % (CONFIG_NAME, key))
+        settings[key] = value
+    return settings
+
+def socket_path(db):
+    '''Return the daemon socket path for a database file.'''
+    return db + '.sock'
+
+def connect(db, profile=None, **kwargs):
+    '''
+    Open db with the PRAGMAs of the given profile.  Extra keyword arguments
+    are passed on to sqlite3.connect.
+    '''
+    settings = load_settings(db, profile)
+    kwargs.setdefault('timeout', int(settings['busy_timeout']) / 1000.)
+    conn = sqlite3.connect(db, **kwargs)
+    for pragma in PRAGMA_ORDER:
+        # In-memory databases cannot use WAL; SQLite quietly keeps 'memory'.
+        conn.execute("PRAGMA %s = %s;" % (pragma, settings[pragma]))
+    return conn
+
+def is_lock_error(err):
+    '''True if an OperationalError means another connection holds the lock.'''
+    message = str(err).lower()
+    return 'locked' in message or 'busy' in message
+
+def retry_on_lock(func, *args, **kwargs):
+    '''
+    Call func, retrying with exponential backoff while it fails because the
+    database is locked.  func must roll back its own partial work before
+    raising.  The last error is re-raised once the retries run out.
+    '''
+    delay = RETRY_DELAY
+    for attempt in range(RETRIES):
+        try:
+            return func(*args, **kwargs)
+        except OperationalError as err:
+            if not is_lock_error(err) or attempt == RETRIES - 1:
+                raise
+        import random   # only needed once a write has lost the race
+        time.sleep(delay * (1 + random.random()))
+        delay = min(delay * 2, MAX_RETRY_DELAY)
@@ -0,0 +1,390 @@
+#! /usr/bin/env python
+'''
+Long-running punch daemon and its command line client.
+
+The daemon owns a single connection to the database and listens on a Unix
+domain socket next to it.  Requests and responses are JSON documents, one
+per line:
+
+    {"op": "punch", "column": "clockin", "date": "2014-04-28", "time": "08:30:00"}
+    {"op": "punch", "column": "clockout", "date": "2014-04-28", "time": "17:00:00",
+     "replace": true}
+    {"op": "punches", "punches": [["clockin", "2014-04-28", "08:30:00", "alice"],
+                                  ["clockin", "2014-04-28", "08:31:00", "bob"]]}
+    {"op": "lookup", "date": "2014-04-28"}
+    {"op": "records", "start": "2014-04-01", "end": "2014-04-30"}
+    {"op": "records", "last": 10}
+    {"op": "report", "start": "2014-04-01", "end": "2014-04-30"}
+    {"op": "totals", "start": "2014-04-01", "end": "2014-04-30"}
+    {"op": "hoursrpt", "path": "/home/alice/.timeclock/hoursrpt",
+     "start": "2014-01-01", "end": "2014-04-30"}
+    {"op": "changes"}
+
+punch, lookup, records, report and hoursrpt requests may name an "employee";
+otherwise they are for DEFAULT_EMPLOYEE.  A punch with "replace" takes the
+place of that day's punches of its kind (see sqlhelpers.write_punch), and
+so do all the punches of a punches request with "replace".
+
+Punches are handed to a single writer thread, which gathers whatever
+arrives within GROUP_COMMIT_DELAY and commits the whole batch at once, so
+a burst of clock-ins pays for one fsync instead of one each.  A report is
+answered with one {"row": [...]} line per day followed by a final line
+holding the range totals.  Records are answered with one {"record": [...]}
+line each, read RECORDS_PAGE at a time so that a long dump neither holds
+the connection between pages nor builds up in memory, followed by a
+final line holding the count.  A hoursrpt request has the daemon bring
+the data file at path up to date (see reports.update_hoursrpt) and is
+answered with the rows it kept and wrote.
+
+Unix domain sockets are not available on Windows, where the command line
+always talks to the database directly.
+'''
+
+import os
+import sys
+import json
+import time
+import datetime
+import signal
+import socket
+import sqlite3
+import threading
+import Queue
+import SocketServer
+
+from TimeClock.utils.schema import ensure_schema
+from TimeClock.utils.connection import connect, retry_on_lock, is_lock_error, \
+    socket_path
+from TimeClock.utils.storage import storage_format
+from TimeClock.utils.sqlhelpers import write_punch, lookup_record, lookup_records, \
+    recent_start, current_date, current_time, DEFAULT_EMPLOYEE, LAST_DATE
+from TimeClock.utils.reports import report_rows, update_hoursrpt
+from TimeClock.utils.rollups import range_totals, change_counter
+
+# How long the writer waits for more punches before committing a batch,
+# and the most punches it will put in one transaction.
+GROUP_COMMIT_DELAY = 0.002
+MAX_BATCH = 256
+
+# Records read per turn on the connection when answering a records request.
+RECORDS_PAGE = 500
+
+SUPPORTED = hasattr(socket, 'AF_UNIX')
+
+def _next_day(date_text):
+    day = datetime.datetime.strptime(date_text, '%Y-%m-%d').date()
+    return (day + datetime.timedelta(days=1)).isoformat()
+
+class DaemonError(Exception):
+    '''Raised by the client when the daemon rejects a request.'''
+
+class _Punch(object):
+    '''A punch waiting for the writer thread.'''
+
+    def __init__(self, column, date, time, employee, replace=False):
+        self.args = (column, date, time)
+        self.employee = employee
+        self.replace = replace
+        self.error = None
+        self.done = threading.Event()
+
+class PunchServer(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    '''Serve punch, lookup and report requests for one database.'''
+
+    daemon_threads = True
+
+    def __init__(self, db, path=None, profile=None):
+        self.db = db
+        self.conn = connect(db, profile, check_same_thread=False)
+        ensure_schema(self.conn)
+        self.fmt = storage_format(self.conn)
+        self.lock = threading.Lock()
+        self.punches = Queue.Queue()
+
+        self.path = path or socket_path(db)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+        SocketServer.UnixStreamServer.__init__(self, self.path, _Handler)
+
+        writer = threading.Thread(target=self._write_punches)
+        writer.daemon = True
+        writer.start()
+
+    def _next_batch(self):
+        batch = [self.punches.get()]
+        deadline = time.time() + GROUP_COMMIT_DELAY
+        while len(batch) < MAX_BATCH:
+            try:
+                batch.append(self.punches.get(timeout=max(deadline - time.time(), 0)))
+            except Queue.Empty:
+                break
+        return batch
+
+    def _apply(self, batch):
+        '''Write a batch of punches and commit them together.'''
+        for item in batch:
+            item.error = None
+            try:
+                write_punch(self.conn, *item.args, fmt=self.fmt,
+                            employee=item.employee, replace=item.replace)
+            except sqlite3.OperationalError as err:
+                if is_lock_error(err):
+                    self.conn.rollback()
+                    raise
+                item.error = str(err)
+            except (sqlite3.Error, ValueError) as err:
+                item.error = str(err)
+        self.conn.commit()
+
+    def _write_punches(self):
+        '''Writer thread: apply queued punches in group commits.'''
+        while True:
+            batch = self._next_batch()
+            with self.lock:
+                try:
+                    retry_on_lock(self._apply, batch)
+                except sqlite3.Error as err:
+                    self.conn.rollback()
+                    for item in batch:
+                        item.error = item.error or str(err)
+            for item in batch:
+                item.done.set()
+
+    def dispatch(self, request):
+        '''Yield the response documents for one request.'''
+        op = request.get('op')
+        employee = request.get('employee', DEFAULT_EMPLOYEE)
+        try:
+            if op == 'punch':
+                item = _Punch(request['column'], request['date'], request['time'],
+                              employee, bool(request.get('replace')))
+                self.punches.put(item)
+                item.done.wait()
+                if item.error:
+                    yield {'ok': False, 'error': item.error}
+                else:
+                    yield {'ok': True}
+            elif op == 'punches':
+                items = [_Punch(column, date, time, name or employee,
+                                bool(request.get('replace')))
+                         for column, date, time, name in request['punches']]
+                for item in items:
+                    self.punches.put(item)
+                for item in items:
+                    item.done.wait()
+                errors = [item.error for item in items if item.error]
+                if errors:
+                    yield {'ok': False, 'error': "%d of %d punches failed: %s"
+                                                 % (len(errors), len(items), errors[0])}
+                else:
+                    yield {'ok': True}
+            elif op == 'lookup':
+                with self.lock:
+                    record = lookup_record(self.conn, request['date'], self.fmt,
+                                           employee)
+                yield {'ok': True, 'record': record}
+            elif op == 'records':
+                start, end = request.get('start'), request.get('end', LAST_DATE)
+                if 'last' in request:
+                    with self.lock:
+                        start = recent_start(self.conn, int(request['last']),
+                                             self.fmt, employee)
+                count = 0
+                while start is not None and start <= end:
+                    with self.lock:
+                        page = list(lookup_records(self.conn, start, end, self.fmt,
+                                                   employee, RECORDS_PAGE))
+                    for record in page:
+                        yield {'record': record}
+                    count += len(page)
+                    start = _next_day(page[-1][0]) if len(page) == RECORDS_PAGE else None
+                yield {'ok': True, 'count': count}
+            elif op == 'report':
+                with self.lock:
+                    rows = list(report_rows(self.conn, request['start'],
+                                            request['end'], self.fmt, employee))
+                    total, days = range_totals(self.conn, request['start'],
+                                               request['end'], self.fmt, employee)
+                for row in rows:
+                    yield {'row': row}
+                yield {'ok': True, 'total': total, 'days': days}
+            elif op == 'totals':
+                with self.lock:
+                    total, days = range_totals(self.conn, request['start'],
+                                               request['end'], self.fmt, employee)
+                yield {'ok': True, 'total': total, 'days': days}
+            elif op == 'hoursrpt':
+                with self.lock:
+                    kept, written = update_hoursrpt(self.conn, request['path'],
+                                                    request['start'], request['end'],
+                                                    self.fmt, employee, self.db)
+                yield {'ok': True, 'kept': kept, 'written': written}
+            elif op == 'changes':
+                with self.lock:
+                    counter = change_counter(self.conn)
+                yield {'ok': True, 'counter': counter}
+            else:
+                yield {'ok': False, 'error': "Unknown request: %s" % op}
+        except (KeyError, ValueError, IOError, sqlite3.Error) as err:
+            yield {'ok': False, 'error': "%s: %s" % (err.__class__.__name__, err)}
+
+    def server_close(self):
+        SocketServer.UnixStreamServer.server_close(self)
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class _Handler(SocketServer.StreamRequestHandler):
+
+    def handle(self):
+        while True:
+            line = self.rfile.readline()
+            if not line:
+                break
+            try:
+                request = json.loads(line)
+            except ValueError:
+                request = None
+            # Valid JSON that is not an object is as malformed as invalid JSON.
+            if isinstance(request, dict):
+                responses = self.server.dispatch(request)
+            else:
+                responses = [{'ok': False, 'error': "Malformed request."}]
+            try:
+                for response in responses:
+                    self.wfile.write(json.dumps(response) + '\n')
+                self.wfile.flush()
+            except socket.error:
+                # The client went away, say after reading the first few
+                # records of a long lookup.
+                break
+
+    def finish(self):
+        try:
+            SocketServer.StreamRequestHandler.finish(self)
+        except socket.error:
+            pass
+
+def serve(db, path=None, profile=None):
+    '''Run the daemon for db until interrupted.'''
+    server = PunchServer(db, path, profile)
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    print "TimeClock daemon listening on %s" % server.path
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+class DaemonClient(object):
+    '''Send requests to a running daemon.'''
+
+    def __init__(self, path):
+        self.last_totals = None
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(path)
+        self.rfile = self.sock.makefile('rb')
+
+    def _send(self, request):
+        self.sock.sendall(json.dumps(request) + '\n')
+    def _receive(self):
+        line = self.rfile.readline()
+        if not line:
+            raise socket.error("TimeClock daemon closed the connection.")
+        response = json.loads(line)
+        if response.get('ok') is False:
+            raise DaemonError(response['error'])
+        return response
+
+    def punch(self, column, date=None, time=None, employee=DEFAULT_EMPLOYEE,
+              replace=False):
+        self._send({'op': 'punch', 'column': column, 'date': date or current_date(),
+                    'time': time or current_time(),
+                    'employee': employee or DEFAULT_EMPLOYEE, 'replace': replace})
+        self._receive()
+
+    def punch_many(self, punches, replace=False):
+        '''
+        Send (column, date, time, employee) punches in one request, which the
+        writer commits in as few group commits as it can.  date, time and
+        employee may be None, as for punch().
+        '''
+        self._send({'op': 'punches', 'replace': replace,
+                    'punches': [(column, date or current_date(), time or current_time(),
+                                 employee) for column, date, time, employee in punches]})
+        self._receive()
+
+    def lookup(self, date, employee=DEFAULT_EMPLOYEE):
+        self._send({'op': 'lookup', 'date': date, 'employee': employee})
+        return self._receive()['record']
+
+    def _records(self, request):
+        self._send(request)
+        while True:
+            response = self._receive()
+            if 'record' not in response:
+                return
+            yield response['record']
+
+    def records(self, start_date, end_date, employee=DEFAULT_EMPLOYEE):
+        '''Yield records from start_date to end_date, as lookup_records would.'''
+        return self._records({'op': 'records', 'start': start_date, 'end': end_date,
+                              'employee': employee})
+
+    def last_records(self, count, employee=DEFAULT_EMPLOYEE):
+        '''Yield the count most recent records, oldest first.'''
+        return self._records({'op': 'records', 'last': count, 'employee': employee})
+
+    def report(self, start_date, end_date, employee=DEFAULT_EMPLOYEE):
+        '''
+        Yield report rows as report_rows would.  The totals line that ends
+        the report is kept for a following call to totals().
+        '''
+        request = {'op': 'report', 'start': start_date, 'end': end_date,
+                   'employee': employee}
+        self._send(request)
+        while True:
+            response = self._receive()
+            if 'row' not in response:
+                self.last_totals = (request, (response['total'], response['days']))
+                return
+            yield response['row']
+
+    def totals(self, start_date, end_date, employee=DEFAULT_EMPLOYEE):
+        '''Return (hours, days), reusing the end of the last report if it matches.'''
+        request = {'op': 'totals', 'start': start_date, 'end': end_date,
+                   'employee': employee}
+        if self.last_totals and self.last_totals[0] == dict(request, op='report'):
+            return self.last_totals[1]
+        self._send(request)
+        response = self._receive()
+        return response['total'], response['days']
+
+    def update_hoursrpt(self, path, start_date, end_date, employee=DEFAULT_EMPLOYEE):
+        '''Have the daemon bring the hoursrpt file at path up to date.'''
+        self._send({'op': 'hoursrpt', 'path': os.path.abspath(path),
+                    'start': start_date, 'end': end_date, 'employee': employee})
+        response = self._receive()
+        return response['kept'], response['written']
+
+    def changes(self):
+        '''Return the database's change counter.'''
+        self._send({'op': 'changes'})
+        return self._receive()['counter']
+
+    def close(self):
+        self.rfile.close()
+        self.sock.close()
+
+def connect_client(db):
+    '''
+    Return a DaemonClient for the daemon serving db, or None if no daemon
+    is running, in which case the caller should use the database directly.
+    '''
+    path = socket_path(db)
+    if not (SUPPORTED and os.path.exists(path)):
+        return None
+    try:
+        return DaemonClient(path)
+    except socket.error:
+        return None
@@ -0,0 +1,159 @@
+#! /usr/bin/env python
+'''
+Whole databases held in memory.
+
+load_memory() copies a database file into a new :memory: connection: with
+the SQLite backup API where the sqlite3 module has it (Python 3.7 and
+later), otherwise by ATTACHing the file and copying its schema and rows
+in one read transaction.  Reports, imports and what-if edits then run
+without touching the disk, and the file is left as it was.
+
+save_memory() writes the database back over its file in one step.  A
+copy is written beside the file, through the backup API or with VACUUM
+INTO, and renamed over it once complete, so a reader sees either the old
+database or the new one.  The file is not replaced if it has been written
+since it was loaded (its change counter has moved, see
+rollups.change_counter) or another connection holds WAL frames the copy
+would lose.
+
+Archived years stay in their shard files; the in-memory copy names them
+by their full paths, and the saved file by their names again.
+'''
+
+import os
+import sys
+import sqlite3
+
+from TimeClock.utils.rollups import change_counter
+
+# Copied first, then their rows; the other objects come after the rows,
+# so triggers do not fire on them.
+_TABLES = "type = 'table' AND name NOT LIKE 'sqlite_%'"
+_OTHERS = "type IN ('index', 'view', 'trigger') AND sql IS NOT NULL"
+
+# Where save_memory() writes the new file before renaming it into place.
+SAVE_NAME = "%s.saving"
+
+class ConflictError(Exception):
+    '''Raised when a database file has changed since it was loaded.'''
+
+def _has_table(conn, name, schema='main'):
+    return conn.execute("SELECT 1 FROM %s.sqlite_master WHERE type = 'table' "
+                        "AND name = ?;" % schema, (name,)).fetchone() is not None
+
+def _counter(conn):
+    '''The change counter, or None for a database without one yet.'''
+    return change_counter(conn) if _has_table(conn, 'data_changes') else None
+
+def _copy_attached(memory, path):
+    '''Copy the file at path into the empty database memory, without the backup API.'''
+    memory.execute("ATTACH DATABASE ? AS source;", (path,))
+    isolation_level = memory.isolation_level
+    memory.isolation_level = None
+    try:
+        memory.execute("BEGIN;")
+        tables = memory.execute("SELECT name, sql FROM source.sqlite_master WHERE %s;"
+                                % _TABLES).fetchall()
+        for name, sql in tables:
+            memory.execute(sql)
+        for name, sql in tables:
+            memory.execute('INSERT INTO main."%s" SELECT * FROM source."%s";'
+                           % (name, name))
+        if _has_table(memory, 'sqlite_sequence', 'source'):
+            memory.execute("INSERT INTO main.sqlite_sequence "
+                           "SELECT * FROM source.sqlite_sequence;")
+        for (sql,) in memory.execute("SELECT sql FROM source.sqlite_master WHERE %s "
+                                     "ORDER BY type = 'trigger';" % _OTHERS).fetchall():
+            memory.execute(sql)
+        version = memory.execute("PRAGMA source.user_version;").fetchone()[0]
+        memory.execute("PRAGMA main.user_version = %d;" % version)
+        memory.execute("COMMIT;")
+    finally:
+        memory.isolation_level = isolation_level
+    memory.execute("DETACH DATABASE source;")
+
+def load_memory(path, **kwargs):
+    '''
+    Return (connection, change counter) for an in-memory copy of the
+    database file at path, or of an empty database if there is none yet.
+    Extra keyword arguments are passed on to sqlite3.connect.
+    '''
+    memory = sqlite3.connect(':memory:', **kwargs)
+    if not os.path.exists(path):
+        return memory, None
+    if hasattr(memory, 'backup'):
+        source = sqlite3.connect(path)
+        try:
+            source.backup(memory)
+        finally:
+            source.close()
+    else:
+        _copy_attached(memory, path)
+    counter = _counter(memory)
+    if _has_table(memory, 'archives'):
+        directory = os.path.dirname(os.path.abspath(path))
+        memory.execute("UPDATE archives SET path = ? || path;",
+                       (directory + os.sep,))
+        memory.commit()
+    return memory, counter
+
+def _write_copy(memory, target):
+    '''Write the whole in-memory database to a new file at target.'''
+    memory.commit()
+    if hasattr(memory, 'backup'):
+        copy = sqlite3.connect(target)
+        try:
+            memory.backup(copy)
+        finally:
+            copy.close()
+    else:
+        memory.execute("VACUUM INTO ?;", (target,))
+    copy = sqlite3.connect(target)
+    try:
+        if _has_table(copy, 'archives'):
+            for year, name in copy.execute("SELECT year, path FROM archives;"
+                                           ).fetchall():
+                copy.execute("UPDATE archives SET path = ? WHERE year = ?;",
+                             (os.path.basename(name), year))
+            copy.commit()
+    finally:
+        copy.close()
+
+def save_memory(memory, path, counter=None, force=False):
+    '''
+    Replace the database file at path with the in-memory database memory.
+    counter is the file's change counter when it was loaded; unless force,
+    raises ConflictError if the file has been written since.  Returns the
+    change counter of the file as saved.
+    '''
+    target = SAVE_NAME % path
+    if os.path.exists(target):
+        os.remove(target)
+    _write_copy(memory, target)
+    if not os.path.exists(path):
+        os.rename(target, path)
+        return _counter(memory)
+
+    disk = sqlite3.connect(path, isolation_level=None)
+    try:
+        # Empty the WAL, then hold the write lock until the file is
+        # replaced, so no commit can land in the old one meanwhile.
+        busy, frames, copied = disk.execute("PRAGMA wal_checkpoint(TRUNCATE);"
+                                            ).fetchone()
+        disk.execute("BEGIN IMMEDIATE;")
+        if busy or frames > 0:
+            raise ConflictError("%s is in use by another connection." % path)
+        if not force and _counter(disk) != counter:
+            raise ConflictError("%s has changed since it was loaded." % path)
+        if sys.platform == 'win32':
+            # Windows cannot replace a file that is open.
+            disk.close()
+            os.remove(path)
+        os.rename(target, path)
+    except Exception:
+        if os.path.exists(target):
+            os.remove(target)
+        raise
+    finally:
+        disk.close()
+    return _counter(memory)
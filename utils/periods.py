@@ -0,0 +1,178 @@
+#! /usr/bin/env python
+'''
+Turn report arguments into inclusive (start, end) date ranges.
+
+Accepted period specifications:
+
+    YYYY-MM-DD   : a single day
+    YYYY         : a calendar year
+    YYYY-MM      : a month
+    MM           : a month (1-12) of the current year
+    YYYY-QN      : a quarter, e.g. 2014-Q2
+    YYYY-WNN     : an ISO week, e.g. 2014-W17
+    YYYY-PNN     : the NNth pay period starting in that year
+    ytd          : January 1st of this year through today
+    week, month, quarter, year, payperiod : the current one of each
+
+Two specifications form a range from the start of the first to the end of
+the second, e.g. "2014-04-01 2014-04-30" or "2014-Q1 2014-Q3".
+
+parse_periods() reads a list of periods for reports run together: each
+specification on its own, or a lone YYYY for every month of that year
+plus the year itself.
+'''
+
+import re
+import time
+import datetime
+import calendar
+from collections import namedtuple
+
+Period = namedtuple('Period', ['start', 'end', 'label'])
+
+# Pay periods are PAY_PERIOD_DAYS long and start on PAY_PERIOD_ANCHOR or a
+# whole number of periods before or after it.
+PAY_PERIOD_ANCHOR = datetime.date(2014, 1, 6)
+PAY_PERIOD_DAYS = 14
+
+ONE_DAY = datetime.timedelta(days=1)
+
+def _today():
+    return datetime.date(*time.localtime()[:3])
+
+def _month(year, month):
+    start = datetime.date(year, month, 1)
+    end = start.replace(day=calendar.monthrange(year, month)[1])
+    return start, end
+
+def _quarter(year, quarter):
+    start = _month(year, 3 * quarter - 2)[0]
+    end = _month(year, 3 * quarter)[1]
+    return start, end
+
+def _iso_week(year, week):
+    jan4 = datetime.date(year, 1, 4)
+    start = jan4 - datetime.timedelta(days=jan4.weekday()) + \
+        datetime.timedelta(weeks=week - 1)
+    return start, start + datetime.timedelta(days=6)
+
+def _pay_period_containing(day):
+    offset = (day - PAY_PERIOD_ANCHOR).days // PAY_PERIOD_DAYS
+    start = PAY_PERIOD_ANCHOR + datetime.timedelta(days=offset * PAY_PERIOD_DAYS)
+    return start, start + datetime.timedelta(days=PAY_PERIOD_DAYS - 1)
+
+def _pay_period(year, number):
+    first = _pay_period_containing(datetime.date(year, 1, 1))[0]
+    if first.year < year:
+        first += datetime.timedelta(days=PAY_PERIOD_DAYS)
+    start = first + datetime.timedelta(days=(number - 1) * PAY_PERIOD_DAYS)
+    return start, start + datetime.timedelta(days=PAY_PERIOD_DAYS - 1)
+
+def _span(spec, today):
+    '''Return (start, end, label) dates for a single specification.'''
+    key = spec.strip().lower()
+
+    if key == 'ytd':
+        return datetime.date(today.year, 1, 1), today, "YTD"
+    if key == 'week':
+        return _iso_week(*today.isocalendar()[:2]) + ("Week",)
+    if key == 'month':
+        return _month(today.year, today.month) + ("Month",)
+    if key == 'quarter':
+        return _quarter(today.year, (today.month - 1) // 3 + 1) + ("Quarter",)
+    if key == 'year':
+        return _month(today.year, 1)[0], _month(today.year, 12)[1], "Year"
+    if key in ('payperiod', 'pp'):
+        return _pay_period_containing(today) + ("Pay Period",)
+
+    match = re.match(r'^(\d{1,2})$', key)
+    if match and 1 <= int(match.group(1)) <= 12:
+        month = int(match.group(1))
+        return _month(today.year, month) + ("%d-%02d" % (today.year, month),)
+
+    match = re.match(r'^(\d{4})(?:-(\d{2})(?:-(\d{2}))?|-q([1-4])|-w(\d{2})|-p(\d{2}))?$', key)
+    if not match:
+        raise ValueError("Unrecognized report period: %s" % spec)
+    year, month, day, quarter, week, pay = match.groups()
+    year = int(year)
+    if day:
+        start = end = datetime.date(year, int(month), int(day))
+    elif month:
+        start, end = _month(year, int(month))
+    elif quarter:
+        start, end = _quarter(year, int(quarter))
+    elif week:
+        if not 1 <= int(week) <= 53:
+            raise ValueError("Unrecognized report period: %s" % spec)
+        start, end = _iso_week(year, int(week))
+    elif pay:
+        if not 1 <= int(pay) <= 27:
+            raise ValueError("Unrecognized report period: %s" % spec)
+        start, end = _pay_period(year, int(pay))
+    else:
+        start, end = _month(year, 1)[0], _month(year, 12)[1]
+    return start, end, spec.strip().upper()
+
+def parse_period(specs, today=None):
+    '''
+    Return a Period for one or two period specifications.  Dates in the
+    result are YYYY-MM-DD strings, ready to bind against times.date.
+    Raises ValueError for anything that is not a recognised period.
+    '''
+    if isinstance(specs, basestring):
+        specs = [specs]
+    if not 1 <= len(specs) <= 2:
+        raise ValueError("A report takes one period or a start and an end.")
+    today = today or _today()
+
+    start, end, label = _span(specs[0], today)
+    if len(specs) == 2:
+        end, last_label = _span(specs[1], today)[1:]
+        label = "%s to %s" % (label, last_label)
+    if start > end:
+        raise ValueError("Report period starts after it ends.")
+    return Period(start.isoformat(), end.isoformat(), label)
+
+def period_title(start, end, label):
+    '''
+    Return the label of a period followed by its dates, or the label
+    alone when it is the dates already.
+    '''
+    dates = start if start == end else "%s to %s" % (start, end)
+    if label in (dates, "%s to %s" % (start, end)):
+        return label
+    return "%s (%s)" % (label, dates)
+
+def year_periods(year, today=None):
+    '''
+    Return the Periods of every month of year that has begun, then of the
+    year to date if it is this year, or of the whole year.
+    '''
+    today = today or _today()
+    periods = []
+    for month in range(1, 13):
+        start, end = _month(year, month)
+        if start > today:
+            break
+        periods.append(Period(start.isoformat(), end.isoformat(),
+                              "%d-%02d" % (year, month)))
+    if year == today.year:
+        periods.append(parse_period('ytd', today))
+    elif year < today.year:
+        periods.append(parse_period(str(year), today))
+    return periods
+
+def parse_periods(specs, today=None):
+    '''
+    Return a list of Periods, one for each specification, or those of
+    year_periods() for a single YYYY.  Raises ValueError for anything that
+    is not a recognised period.
+    '''
+    if isinstance(specs, basestring):
+        specs = [specs]
+    if len(specs) == 1 and re.match(r'^\d{4}$', specs[0].strip()):
+        periods = year_periods(int(specs[0]), today)
+        if not periods:
+            raise ValueError("Report year has not begun: %s" % specs[0])
+        return periods
+    return [parse_period(spec, today) for spec in specs]
@@ -0,0 +1,109 @@
+#! /usr/bin/env python
+'''
+Per-phase wall clock and CPU timing for one run of the command line.
+
+A PhaseTimer is started as the script begins and records named phases,
+either as laps (everything since the previous phase ended) or as
+with-blocks around one piece of work.  For each phase it keeps the wall
+time, the CPU time of this process and the CPU time of any child
+processes that finished during it, such as gnuplot.  Timing is cheap
+enough to be left on; --profile only decides whether the summary is
+written out.
+'''
+
+import os
+import sys
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+def _cpu():
+    '''
+    Return (own CPU, children's CPU) in seconds.  getrusage() counts in
+    microseconds; os.times(), used on Windows, often only in clock ticks.
+    '''
+    if resource:
+        own = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime
+    times = os.times()
+    return times[0] + times[1], times[2] + times[3]
+
+def _clock():
+    '''Return (wall, own CPU, children's CPU) in seconds.'''
+    return (time.time(),) + _cpu()
+
+def process_age():
+    '''
+    Seconds since this process started, or None where that cannot be
+    read.  Only as precise as the kernel's clock tick (usually 10ms).
+    '''
+    try:
+        with open('/proc/self/stat') as stat:
+            # The command name may contain spaces, so split after it.
+            started = int(stat.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as uptime:
+            now = float(uptime.read().split()[0])
+    except (IOError, IndexError, ValueError):
+        return None
+    return now - started / float(os.sysconf('SC_CLK_TCK'))
+
+class PhaseTimer(object):
+    '''Record the cost of each phase of a run.'''
+
+    def __init__(self):
+        self.started = time.time()
+        self.age = process_age()
+        self.phases = []
+        self._last = _clock()
+
+    def _record(self, name, begin, end):
+        self.phases.append({'name': name,
+                            'wall_ms': (end[0] - begin[0]) * 1000.,
+                            'cpu_ms': (end[1] - begin[1]) * 1000.,
+                            'child_cpu_ms': (end[2] - begin[2]) * 1000.})
+        self._last = end
+
+    def lap(self, name):
+        '''Record everything since the previous phase ended as name.'''
+        self._record(name, self._last, _clock())
+
+    @contextmanager
+    def phase(self, name):
+        '''Record the enclosed block as name.'''
+        begin = _clock()
+        try:
+            yield
+        finally:
+            self._record(name, begin, _clock())
+
+    def summary(self):
+        '''Return the phases and totals as a JSON-serialisable dict.'''
+        end = _clock()
+        phases = list(self.phases)
+        if self.age is not None:
+            # Interpreter start up to the creation of the timer.
+            phases.insert(0, {'name': 'startup', 'wall_ms': self.age * 1000.,
+                              'cpu_ms': None, 'child_cpu_ms': None})
+        return {'argv': sys.argv[1:],
+                'pid': os.getpid(),
+                'started': time.strftime('%Y-%m-%dT%H:%M:%S',
+                                         time.localtime(self.started)),
+                'phases': phases,
+                'total': {'wall_ms': (end[0] - self.started + (self.age or 0)) * 1000.,
+                          'cpu_ms': end[1] * 1000.,
+                          'child_cpu_ms': end[2] * 1000.}}
+
+    def write(self, path=None):
+        '''Write the summary as JSON to path, or to stderr.'''
+        import json
+        text = json.dumps(self.summary(), indent=2, sort_keys=True)
+        if path:
+            with open(path, 'w') as out:
+                out.write(text + '\n')
+        else:
+            sys.stderr.write(text + '\n')
@@ -0,0 +1,69 @@
+#! /usr/bin/env python
+'''
+Printing lookup records.
+
+write_records() prints (date, clockin, lunchout, lunchin, clockout)
+records as they are read, in one of LOOKUP_STYLES: a block per record,
+a table line per record, or a JSON object per line.  The command line
+and the shell both print lookups through it.
+'''
+
+import os
+import sys
+import errno
+
+from TimeClock.utils.sqlhelpers import PUNCH_COLUMNS
+
+LOOKUP_STYLES = ('block', 'table', 'json')
+
+LOOKUPSTRING = \
+"""
+==========================
+   DATE    | %(date)s
+--------------------------
+ CLOCK IN  |  %(cin)s
+ LUNCH OUT |  %(lout)s
+ LUNCH IN  |  %(lin)s
+ CLOCK OUT |  %(cout)s
+==========================
+"""
+
+# --format table: one line per record.
+TABLE_HEADER = \
+"""   DATE    | CLOCK IN | LUNCH OUT | LUNCH IN | CLOCK OUT
+-----------+----------+-----------+----------+----------
+"""
+TABLE_ROW = "%s | %8s | %9s | %8s | %9s\n"
+
+# Field names of a lookup record in LOOKUPSTRING.
+RECORD_FIELDS = ['date', 'cin', 'lout', 'lin', 'cout']
+
+def write_records(rows, style='block', out=None):
+    '''
+    Write lookup records to out (stdout by default) as 'block's of
+    LOOKUPSTRING, 'table' lines or 'json' lines, one record at a time.
+    Stops quietly if out is a pipe that has been closed.  Returns the
+    number of records written.
+    '''
+    out = out or sys.stdout
+    if style == 'json':
+        import json
+    count = 0
+    try:
+        for row in rows:
+            if style == 'json':
+                out.write(json.dumps(dict(zip(('date',) + PUNCH_COLUMNS, row))) + '\n')
+            elif style == 'table':
+                if not count:
+                    out.write(TABLE_HEADER)
+                out.write(TABLE_ROW % tuple(value or '' for value in row))
+            else:
+                print >> out, LOOKUPSTRING % dict(zip(RECORD_FIELDS, row)), '\n'
+            count += 1
+        out.flush()
+    except IOError as err:
+        if err.errno != errno.EPIPE:
+            raise
+        # Whoever was reading has seen enough; don't complain at exit.
+        sys.stdout = open(os.devnull, 'w')
+    return count
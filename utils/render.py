@@ -0,0 +1,187 @@
+#! /usr/bin/env python
+'''
+Chart renderers for reports.
+
+Every renderer takes the report series straight from memory as a list of
+(date, total, average) tuples, optionally followed by the 7 and 30 day
+rolling averages, and writes "<label> Hours.<ext>" into a directory,
+returning the path of the chart.  The gnuplot renderer reads
+the series back from the data file instead.
+
+ - gnuplot    : fills in the label and data file of the hoursreport.plt
+                template and runs gnuplot on it (the original behaviour).
+ - svg        : draws an SVG chart in-process with no dependencies.
+ - matplotlib : draws a PNG in-process, if matplotlib is installed.
+
+Only the gnuplot renderer starts another process; with the in-process
+renderers and no viewer, a report never forks.  Charts with different
+labels may be drawn from several threads at once.
+'''
+
+import os
+import sys
+import datetime
+import threading
+import subprocess
+
+PLT_TEMPLATE = 'hoursreport.plt'
+
+class RenderError(Exception):
+    '''Raised when a chart cannot be drawn.'''
+
+def _day(date_text):
+    return datetime.date(*[int(part) for part in date_text[:10].split('-')])
+
+class GnuplotRenderer(object):
+    '''Render with the gnuplot program and the hoursreport.plt template.'''
+
+    name = 'gnuplot'
+    extension = 'png'
+
+    def render(self, series, label, directory, datafile='hoursrpt'):
+        tag = label.replace(' ', '_')
+        plt = os.path.join(directory, "%shoursreport.plt" % tag)
+        with open(os.path.join(directory, PLT_TEMPLATE)) as template:
+            script = template.read().format(label, label, label=label,
+                                            datafile=datafile)
+        # Templates installed before it took {datafile} name it literally.
+        script = script.replace('"hoursrpt"', '"%s"' % datafile)
+        with open(plt, 'w') as newfile:
+            newfile.write(script)
+        try:
+            status = subprocess.call(['gnuplot', os.path.basename(plt)], cwd=directory)
+        except OSError:
+            raise RenderError("gnuplot is not installed; try --renderer svg.")
+        if status != 0:
+            raise RenderError("gnuplot failed on %s with exit status %d."
+                              % (os.path.basename(plt), status))
+        return os.path.join(directory, "%s Hours.%s" % (label, self.extension))
+
+class SVGRenderer(object):
+    '''Draw the chart as SVG in-process.'''
+
+    name = 'svg'
+    extension = 'svg'
+
+    WIDTH, HEIGHT = 900, 400
+    LEFT, RIGHT, TOP, BOTTOM = 60, 20, 40, 50
+    SERIES = [(1, 'Daily Hours', '#1f77b4'), (2, 'Avg Hours', '#d62728'),
+              (3, '7-day Avg', '#2ca02c'), (4, '30-day Avg', '#ff7f0e')]
+
+    def _lines(self, points, colour):
+        '''Polylines for points, broken wherever a value is missing.'''
+        lines, current = [], []
+        for point in points + [None]:
+            if point is None:
+                if current:
+                    lines.append(current)
+                current = []
+            else:
+                current.append("%.1f,%.1f" % point)
+        return ['<polyline fill="none" stroke="%s" stroke-width="2" points="%s"/>'
+                % (colour, ' '.join(line)) for line in lines]
+
+    def render(self, series, label, directory, datafile=None):
+        output = os.path.join(directory, "%s Hours.%s" % (label, self.extension))
+        days = [_day(row[0]) for row in series]
+        values = [value for row in series for value in row[1:] if value is not None]
+        plot_w = self.WIDTH - self.LEFT - self.RIGHT
+        plot_h = self.HEIGHT - self.TOP - self.BOTTOM
+
+        first = days[0] if days else datetime.date.today()
+        span = max((days[-1] - first).days if days else 0, 1)
+        top = max(max(values) if values else 0, 1) * 1.1
+        x = lambda day: self.LEFT + plot_w * (day - first).days / float(span)
+        y = lambda value: self.TOP + plot_h * (1 - value / top)
+
+        parts = ['<svg xmlns="http://www.w3.org/2000/svg" width="%d" height="%d" '
+                 'font-family="sans-serif" font-size="12">' % (self.WIDTH, self.HEIGHT),
+                 '<rect width="100%" height="100%" fill="white"/>',
+                 '<text x="%d" y="24" text-anchor="middle" font-size="16">'
+                 '%s Hours Worked</text>' % (self.WIDTH // 2, _escape(label))]
+
+        # Horizontal grid lines and hour labels
+        step = max(int(top / 5), 1)
+        for hours in range(0, int(top) + 1, step):
+            parts.append('<line x1="%d" x2="%d" y1="%.1f" y2="%.1f" stroke="#ddd"/>'
+                         % (self.LEFT, self.WIDTH - self.RIGHT, y(hours), y(hours)))
+            parts.append('<text x="%d" y="%.1f" text-anchor="end">%d</text>'
+                         % (self.LEFT - 6, y(hours) + 4, hours))
+
+        # Date labels, at most about ten of them
+        every = max(len(days) // 10, 1)
+        for day in days[::every]:
+            parts.append('<text x="%.1f" y="%d" text-anchor="middle">%s</text>'
+                         % (x(day), self.HEIGHT - self.BOTTOM + 18, day.strftime('%m/%d')))
+        parts.append('<text x="%d" y="%d" text-anchor="middle">Date</text>'
+                     % (self.LEFT + plot_w // 2, self.HEIGHT - 8))
+        parts.append('<text x="16" y="%d" text-anchor="middle" transform="rotate(-90 16 %d)">'
+                     'Hours</text>' % (self.TOP + plot_h // 2, self.TOP + plot_h // 2))
+
+        width = min(len(row) for row in series) if series else 3
+        for index, (column, title, colour) in enumerate(self.SERIES[:width - 1]):
+            points = [None if row[column] is None else (x(day), y(row[column]))
+                      for day, row in zip(days, series)]
+            parts.extend(self._lines(points, colour))
+            parts.append('<text x="%d" y="%d" fill="%s">%s</text>'
+                         % (self.LEFT + 10, self.TOP + 16 * (index + 1), colour, title))
+        parts.append('</svg>\n')
+
+        with open(output, 'w') as out:
+            out.write('\n'.join(parts))
+        return output
+
+class MatplotlibRenderer(object):
+    '''Draw the chart as PNG in-process with matplotlib.'''
+
+    name = 'matplotlib'
+    extension = 'png'
+
+    # pyplot keeps global state, so one chart is drawn at a time.
+    lock = threading.Lock()
+
+    def render(self, series, label, directory, datafile=None):
+        try:
+            import matplotlib
+            matplotlib.use('Agg')
+            from matplotlib import pyplot
+            from matplotlib.dates import DateFormatter
+        except ImportError:
+            raise RenderError("matplotlib is not installed; try --renderer svg.")
+
+        output = os.path.join(directory, "%s Hours.%s" % (label, self.extension))
+        days = [_day(row[0]) for row in series]
+        with self.lock:
+            figure = pyplot.figure(figsize=(9, 4), dpi=100)
+            axes = figure.add_subplot(111)
+            axes.plot(days, [row[1] for row in series], linewidth=2, label='Daily Hours')
+            axes.plot(days, [row[2] for row in series], linewidth=2, label='Avg Hours')
+            for column, title in [(3, '7-day Avg'), (4, '30-day Avg')]:
+                if series and len(series[0]) > column:
+                    axes.plot(days, [row[column] for row in series], linewidth=1,
+                              label=title)
+            axes.xaxis.set_major_formatter(DateFormatter('%m/%d'))
+            axes.set_title("%s Hours Worked" % label)
+            axes.set_xlabel("Date")
+            axes.set_ylabel("Hours")
+            axes.legend(loc='upper left')
+            axes.grid(True)
+            figure.savefig(output)
+            pyplot.close(figure)
+        return output
+
+RENDERERS = dict((renderer.name, renderer) for renderer in
+                 [GnuplotRenderer(), SVGRenderer(), MatplotlibRenderer()])
+
+def _escape(text):
+    return text.replace('&', '&amp;').replace('<', '&lt;').replace('>', '&gt;')
+
+def open_viewer(path):
+    '''Open a chart with the platform's viewer without waiting for it.'''
+    if sys.platform == 'win32':
+        os.startfile(path)
+    else:
+        try:
+            subprocess.Popen(['firefox', path])
+        except OSError:
+            print "Chart saved to %s" % path
@@ -0,0 +1,244 @@
+#! /usr/bin/env python
+'''
+Read-only report engine.
+
+Daily gross, lunch and total hours come from the daily_hours rollup, and
+the running average and running total are computed by one windowed query
+over the requested date range.  Nothing is written to the database, so a
+report never holds a write lock against concurrent punches.  A range that
+reaches into archived years is queried one database at a time, each part
+carrying the running values on from the one before.
+
+period_rows() splits the rows of one report over several periods into
+the report of each, so reports run together read the database once.
+
+write_hoursrpt() writes the rows to the pipe-separated hoursrpt data file
+read by gnuplot, with any extra per-day columns (such as the rolling
+averages from analytics.py) after the report's own.
+
+update_hoursrpt() keeps that file up to date for a report that is run
+again and again, such as a year to date chart refreshed all day.  A state
+file next to it records which report it holds and the change counter
+(see rollups.change_counter) when it was written.  On the next run only
+the days from the first one changed since then are rewritten, streamed
+straight from the cursor: usually just today's row, appended.  The running
+average of the rewritten days carries on from the running totals before
+them, and their rolling averages from the rows kept in the file.
+'''
+
+import os
+import json
+import bisect
+import datetime
+import collections
+
+from TimeClock.utils.storage import TEXT
+from TimeClock.utils.sqlhelpers import DEFAULT_EMPLOYEE
+from TimeClock.utils.shards import segments
+from TimeClock.utils.rollups import change_counter, changed_since, days_recorded, \
+    range_totals
+from TimeClock.utils.analytics import RollingAverages, ROLLING_WINDOWS
+
+REPORT_COLUMNS = ('date', 'clockin', 'lunchout', 'lunchin', 'clockout',
+                  'gross', 'lunch', 'total', 'average', 'cumulative')
+
+# Report columns written to hoursrpt, before any extra ones.
+HOURSRPT_COLUMNS = 9
+
+# Columns of the hoursrpt kept by update_hoursrpt(): the report's, then
+# the rolling averages.
+HOURSRPT_LAYOUT = REPORT_COLUMNS[:HOURSRPT_COLUMNS] + tuple(
+    "rolling_%d" % window for window in ROLLING_WINDOWS)
+
+# Where update_hoursrpt() keeps the state of the data file at path.
+HOURSRPT_STATE = "%s.state"
+
+# Write buffer for streaming rows into hoursrpt.
+WRITE_BUFFER = 64 * 1024
+
+def report_sql(fmt=TEXT, schema='main'):
+    '''
+    Return the report query for the given storage format, against the
+    database schema.  The running average and total carry on from the
+    :hours and :days worked before :start, which are 0 for a report of its
+    own.
+    '''
+    return '''
+           SELECT %s, %s, %s, %s, %s,
+                  d.gross, d.lunch, d.total,
+                  (:hours + TOTAL(d.total) OVER running)
+                  / NULLIF(:days + COUNT(d.total) OVER running, 0) AS average,
+                  CASE WHEN :days + COUNT(d.total) OVER running > 0
+                  THEN :hours + TOTAL(d.total) OVER running END AS cumulative
+           FROM %s.times t
+           JOIN %s.daily_hours d ON d.employee = t.employee AND d.date = t.date
+           WHERE t.employee = :employee AND t.date BETWEEN :start AND :end
+           WINDOW running AS (ORDER BY t.date ROWS UNBOUNDED PRECEDING)
+           ORDER BY t.date;
+           ''' % (fmt.date_sql('t.date'), fmt.time_sql('t.clockin'),
+                  fmt.time_sql('t.lunchout'), fmt.time_sql('t.lunchin'),
+                  fmt.time_sql('t.clockout'), schema, schema)
+
+def report_params(start_date, end_date, fmt=TEXT, employee=DEFAULT_EMPLOYEE,
+                  before=(0., 0)):
+    '''Return the parameters of report_sql() for a report.'''
+    return {'employee': employee, 'start': fmt.date_param(start_date),
+            'end': fmt.date_param(end_date), 'hours': before[0], 'days': before[1]}
+
+def report_rows(conn, start_date, end_date, fmt=TEXT, employee=DEFAULT_EMPLOYEE,
+                before=(0., 0)):
+    '''
+    Yield one row per day an employee worked between start_date and
+    end_date (YYYY-MM-DD, inclusive) in the order of REPORT_COLUMNS.  The
+    average and cumulative columns are running values, so the last row
+    holds the summary totals for the whole range; they carry on from the
+    (hours, days) worked before, if given.  Dates and times are returned
+    as text whatever the storage format fmt.
+    '''
+    hours, days = before
+    for schema, fmt, first, last in segments(conn, start_date, end_date, fmt):
+        cursor = conn.execute(report_sql(fmt, schema),
+                              report_params(first, last, fmt, employee, (hours, days)))
+        try:
+            for row in cursor:
+                if row[7] is not None:
+                    hours, days = row[9], days + 1
+                yield row
+        finally:
+            cursor.close()
+
+def period_rows(rows, periods):
+    '''
+    Split report rows covering every (start, end) period, in date order,
+    into the rows of each period's own report: the running average and
+    total start again from each period's first day.  Periods may overlap.
+    '''
+    dates = [row[0] for row in rows]
+    reports = []
+    for start, end in periods:
+        hours, days, report = 0., 0, []
+        for row in rows[bisect.bisect_left(dates, start):
+                        bisect.bisect_right(dates, end)]:
+            if row[7] is not None:
+                hours, days = hours + row[7], days + 1
+            report.append(tuple(row[:8]) + ((hours / days, hours) if days
+                                            else (None, None)))
+        reports.append(report)
+    return reports
+
+def _hoursrpt_line(row, extra=()):
+    values = tuple(row[:HOURSRPT_COLUMNS]) + tuple(extra)
+    return '|'.join("{}".format(value) for value in values) + '\n'
+
+def write_hoursrpt(path, rows, extra=None):
+    '''
+    Write report rows to the hoursrpt data file at path, each followed by
+    the matching tuple of extra columns if given.  Returns the chart
+    series: (date, total, average) plus the extra columns, per day.
+    '''
+    series = []
+    with open(path, 'w') as out:
+        for row, more in zip(rows, extra or [()] * len(rows)):
+            out.write(_hoursrpt_line(row, more))
+            series.append((row[0], row[7], row[8]) + tuple(more))
+    return series
+
+def parse_hoursrpt_line(line):
+    '''
+    Return the values of one hoursrpt line: the date and punches as text,
+    the hours as floats, and None for anything missing.
+    '''
+    fields = [None if field == 'None' else field
+              for field in line.rstrip('\r\n').split('|')]
+    return tuple(fields[:5]) + tuple(None if field is None else float(field)
+                                     for field in fields[5:])
+
+def read_hoursrpt(path):
+    '''Return the rows of the hoursrpt data file at path, parsed as above.'''
+    with open(path, 'rb') as lines:
+        return [parse_hoursrpt_line(line) for line in lines]
+
+def _shift_day(date_text, days):
+    day = datetime.date(int(date_text[:4]), int(date_text[5:7]), int(date_text[8:10]))
+    return (day + datetime.timedelta(days=days)).isoformat()
+
+def _read_state(path):
+    try:
+        with open(HOURSRPT_STATE % path) as state:
+            return json.load(state)
+    except (IOError, ValueError):
+        return None
+
+def _resume_date(conn, path, state, report, end_date, fmt):
+    '''
+    Return the first day of the report that may differ from the data file
+    at path described by state, the day after end_date if none does, or
+    None if the file holds some other report, or has been replaced since,
+    and must be written afresh.
+    '''
+    if not state or state.get('report') != report or state['end'] > end_date or \
+            state['size'] != os.path.getsize(path):
+        return None
+    days = [changed_since(conn, state['counter'], report['start'], end_date, fmt,
+                          report['employee']),
+            _shift_day(state['end'], 1) if state['end'] < end_date else None,
+            _shift_day(end_date, 1)]
+    return min(day for day in days if day is not None)
+
+def update_hoursrpt(conn, path, start_date, end_date, fmt=TEXT,
+                    employee=DEFAULT_EMPLOYEE, source=None):
+    '''
+    Bring the hoursrpt data file at path up to date with an employee's
+    report from start_date to end_date, laid out as HOURSRPT_LAYOUT.  Only
+    the days from the first one changed since the file was last written
+    are rewritten; all of them are if it held another report or a day
+    before that one was deleted.  source names the database, so that
+    databases sharing a directory are told apart.  Returns the number of
+    rows (kept, written).
+    '''
+    # Read before the rows, so a punch made meanwhile is rewritten next time.
+    counter = change_counter(conn)
+    report = {'source': source and os.path.abspath(source), 'employee': employee,
+              'start': start_date, 'storage': fmt.name,
+              'columns': list(HOURSRPT_LAYOUT)}
+    resume = None
+    if os.path.exists(path):
+        resume = _resume_date(conn, path, _read_state(path), report, end_date, fmt)
+    # A run that fails part way leaves no state, so the next one starts over.
+    if os.path.exists(HOURSRPT_STATE % path):
+        os.remove(HOURSRPT_STATE % path)
+
+    kept, offset, rolling = 0, 0, RollingAverages()
+    with open(path, 'r+b' if resume else 'wb', WRITE_BUFFER) as out:
+        if resume:
+            # Only the lines within the longest window feed the rolling
+            # averages; one line per day, so that many lines cover it.
+            recent = collections.deque(maxlen=max(ROLLING_WINDOWS))
+            for line in iter(out.readline, ''):
+                if line[:10] >= resume:
+                    break
+                recent.append(line)
+                kept, offset = kept + 1, offset + len(line)
+            if kept == days_recorded(conn, start_date, _shift_day(resume, -1), fmt,
+                                     employee):
+                for row in map(parse_hoursrpt_line, recent):
+                    rolling.add(row[0], row[7])
+            else:
+                kept, offset, resume = 0, 0, None
+            out.seek(offset)
+            out.truncate()
+
+        before = (0., 0)
+        if resume:
+            before = range_totals(conn, start_date, _shift_day(resume, -1), fmt,
+                                  employee)
+        written = 0
+        for row in report_rows(conn, resume or start_date, end_date, fmt, employee,
+                               before):
+            out.write(_hoursrpt_line(row, rolling.add(row[0], row[7])))
+            written += 1
+
+    with open(HOURSRPT_STATE % path, 'w') as state:
+        json.dump({'report': report, 'end': end_date, 'counter': counter,
+                   'size': os.path.getsize(path)}, state)
+    return kept, written
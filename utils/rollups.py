@@ -0,0 +1,428 @@
+#! /usr/bin/env python
+'''
+Pre-aggregated daily and monthly hours.
+
+Punches are appended to the punches table, one row per punch, and never
+changed.  daily_hours compacts them into one row per employee and date:
+the first clock in, the first lunch out and lunch in, the last clock
+out, and the gross, lunch and total hours.  The times view reads those
+columns back as the one record per day lookups and reports expect.
+A day may hold any number of stretches of work, each starting with a
+clock in or lunch in and ending with a lunch out or clock out, for split
+shifts or several breaks.  Its lunch is the time between them, and its
+total the gross hours less the lunch, once its punches alternate between
+in and out and it has clocked out.  monthly_hours holds the sum and count
+of daily totals per employee and YYYY-MM.
+Triggers on punches keep daily_hours current whenever a punch is written,
+and triggers on daily_hours carry each change into monthly_hours, so
+reports read a handful of pre-aggregated rows instead of parsing every
+punch in the range.
+
+cumulative_hours holds, for every employee and date in daily_hours, the
+hours and days worked up to and including that date.  The total for any
+range is then the difference of two index lookups, however long the
+history.  A punch for today only touches today's row; a punch for an
+earlier date also shifts every later row of that employee.
+
+Once closed years are archived (see archive.py and shards.py) their
+punches, daily_hours and cumulative_hours rows move to the shards, and
+the running totals each year closed on stay behind in archive_totals.
+monthly_hours is kept whole.  Further triggers refuse any punch dated in
+an archived year.
+
+The same triggers bump the counter in data_changes on every write to
+punches, so a cached report can tell whether its data is still current.
+PRAGMA data_version cannot do that: it is only comparable within one
+connection.  Each daily_hours row also records in changed the counter
+value of the write that last touched it, so the days changed since any
+earlier value of the counter can be found through an index.
+'''
+
+import datetime
+import calendar
+
+from TimeClock.utils.storage import TEXT
+from TimeClock.utils.sqlhelpers import DEFAULT_EMPLOYEE, PUNCH_COLUMNS
+from TimeClock.utils.shards import TABLES as ARCHIVE_TABLES, segments, closing_totals
+
+# Runs first in every trigger on punches.
+_BUMP = "UPDATE data_changes SET counter = counter + 1;"
+
+# The counter value stamped on the daily_hours rows a write touches.
+_COUNTER = "(SELECT counter FROM data_changes)"
+
+# Punches that start a stretch of work; the others end one.
+_STARTS = "kind IN ('clockin', 'lunchin')"
+
+# The columns of daily_hours that day_sql() fills in.
+DAY_COLUMNS = ('employee', 'date', 'clockin', 'lunchout', 'lunchin', 'clockout',
+               'gross', 'lunch', 'total', 'changed')
+
+def _walk_day(result, fmt):
+    '''
+    Scalar subquery walking the punches of the day being compacted in time
+    order, each next to the one before it, and returning result.
+    '''
+    return '''
+           (SELECT %s
+            FROM (SELECT seconds, starts, LAG(starts) OVER walk AS after_start,
+                         LAG(seconds) OVER walk AS since
+                  FROM (SELECT id, time, %s AS seconds, %s AS starts FROM punches p
+                        WHERE p.employee = day.employee AND p.date = day.date)
+                  WINDOW walk AS (ORDER BY time, id)))
+           ''' % (result, fmt.seconds_sql('time'), _STARTS)
+
+def day_sql(where, fmt=TEXT):
+    '''
+    Return a query compacting the punches matching the where clause into
+    one row per employee and date, in the order of DAY_COLUMNS.  Punches
+    are taken in time order.  Gross hours run from the first clock in to
+    the last clock out and lunch is the sum of the breaks, each from a
+    lunch out or clock out to the next lunch in or clock in.  The total is
+    only set once every punch alternates between in and out.
+
+    Most days hold each punch at most once, in the order clock in, lunch
+    out, lunch in, clock out.  Their lunch and total follow from the
+    compacted columns alone; only other days are walked punch by punch.
+    '''
+    seconds = fmt.seconds_sql
+    # One punch of each kind there is, in order.
+    in_order = ' AND '.join(
+        ["punches = %s" % ' + '.join("(%s IS NOT NULL)" % column
+                                     for column in PUNCH_COLUMNS)] + [
+        "(%s IS NULL OR %s IS NULL OR %s < %s)" % (first, later, first, later)
+        for number, first in enumerate(PUNCH_COLUMNS)
+        for later in PUNCH_COLUMNS[number + 1:]])
+    return '''
+           SELECT employee, date, clockin, lunchout, lunchin, clockout, gross, lunch,
+                  CASE WHEN alternates THEN gross - COALESCE(lunch, 0) END, %(counter)s
+           FROM (SELECT employee, date, clockin, lunchout, lunchin, clockout,
+                        (%(clockout)s - %(clockin)s) / 3600. AS gross,
+                        CASE WHEN in_order THEN (%(lunchin)s - %(lunchout)s) / 3600.
+                        ELSE %(lunch)s END AS lunch,
+                        CASE WHEN in_order THEN (lunchout IS NULL) = (lunchin IS NULL)
+                        ELSE %(alternates)s END AS alternates
+                 FROM (SELECT *, %(in_order)s AS in_order
+                       FROM (SELECT employee, date,
+                              MIN(CASE kind WHEN 'clockin' THEN time END) AS clockin,
+                              MIN(CASE kind WHEN 'lunchout' THEN time END) AS lunchout,
+                              MIN(CASE kind WHEN 'lunchin' THEN time END) AS lunchin,
+                              MAX(CASE kind WHEN 'clockout' THEN time END) AS clockout,
+                              COUNT(*) AS punches
+                             FROM punches WHERE %(where)s
+                             GROUP BY employee, date)) day)
+           ''' % {'counter': _COUNTER, 'where': where, 'in_order': in_order,
+                  'clockin': seconds('clockin'), 'clockout': seconds('clockout'),
+                  'lunchin': seconds('lunchin'), 'lunchout': seconds('lunchout'),
+                  'lunch': _walk_day("SUM(CASE WHEN starts AND after_start = 0 "
+                                     "THEN seconds - since END) / 3600.", fmt),
+                  'alternates': _walk_day("COUNT(*) = 2 * SUM(starts) AND "
+                                          "SUM(starts = (after_start IS NOT 1)) = COUNT(*)",
+                                          fmt)}
+
+def _compact_day(prefix, fmt):
+    '''Recompute the daily_hours row of the day a punch trigger fired for.'''
+    # Without the WHERE, ON CONFLICT would be read as the ON of a join.
+    return '''
+           INSERT INTO daily_hours (%s)
+           %s WHERE 1
+           ON CONFLICT (employee, date) DO UPDATE SET %s;
+           ''' % (', '.join(DAY_COLUMNS),
+                  day_sql("employee = %semployee AND date = %sdate" % (prefix, prefix), fmt),
+                  ', '.join("%s = excluded.%s" % (column, column)
+                            for column in DAY_COLUMNS[2:]))
+
+def _add_monthly(prefix, sign, fmt):
+    return '''
+           INSERT INTO monthly_hours (employee, month, hours, days)
+           VALUES (%(p)semployee, %(m)s,
+                   %(s)s COALESCE(%(p)stotal, 0), %(s)s (%(p)stotal IS NOT NULL))
+           ON CONFLICT (employee, month) DO UPDATE SET
+           hours = hours + excluded.hours, days = days + excluded.days;
+           ''' % {'p': prefix, 's': sign, 'm': fmt.month_sql(prefix + 'date')}
+
+def _shift_cumulative(new, old):
+    '''
+    Carry the change of a daily_hours row from old to new into the running
+    totals from its date on.  new or old is None for an inserted or a
+    deleted row.  Days without a total yet, which is every day until its
+    clock out, change nothing and touch no rows.
+    '''
+    total = lambda prefix: "%stotal" % prefix if prefix else "NULL"
+    return '''
+           UPDATE cumulative_hours SET
+           hours = hours + COALESCE(%(new)s, 0) - COALESCE(%(old)s, 0),
+           days = days + (%(new)s IS NOT NULL) - (%(old)s IS NOT NULL)
+           WHERE employee = %(row)semployee AND date >= %(row)sdate
+           AND %(new)s IS NOT %(old)s;
+           ''' % {'new': total(new), 'old': total(old), 'row': new or old}
+
+# A new day starts from the running totals of the day before it.
+_INSERT_CUMULATIVE = '''
+    INSERT INTO cumulative_hours (employee, date, hours, days)
+    SELECT new.employee, new.date, COALESCE(MAX(hours), 0), COALESCE(MAX(days), 0)
+    FROM (SELECT hours, days FROM cumulative_hours
+          WHERE employee = new.employee AND date < new.date
+          ORDER BY date DESC LIMIT 1);
+    '''
+
+def _refuse_archived(prefix, fmt):
+    '''WHEN clause matching a punch dated in an archived year.'''
+    return '''
+           WHEN CAST(substr(%s, 1, 4) AS INTEGER) <= (SELECT MAX(year) FROM archives)
+           ''' % fmt.month_sql(prefix + 'date')
+
+_ARCHIVED = "SELECT RAISE(ABORT, 'that year is archived and can no longer change');"
+
+# Lookups and reports read the compacted days as one record per day.
+TIMES_VIEW = '''
+    CREATE VIEW IF NOT EXISTS times AS
+    SELECT date, clockin, lunchout, lunchin, clockout, employee FROM daily_hours;
+    '''
+
+def tables(fmt=TEXT):
+    '''Return the DDL for the rollup tables.'''
+    return ['''
+            CREATE TABLE IF NOT EXISTS daily_hours (
+            employee TEXT NOT NULL,
+            date %s NOT NULL,
+            clockin %s,
+            lunchout %s,
+            lunchin %s,
+            clockout %s,
+            gross REAL,
+            lunch REAL,
+            total REAL,
+            changed INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (employee, date));
+            ''' % ((fmt.column_type,) * 5),
+            '''
+            CREATE TABLE IF NOT EXISTS monthly_hours (
+            employee TEXT NOT NULL,
+            month TEXT NOT NULL,
+            hours REAL NOT NULL DEFAULT 0,
+            days INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (employee, month));
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS data_changes (
+            id INTEGER PRIMARY KEY CHECK (id = 0),
+            counter INTEGER NOT NULL);
+            ''',
+            '''
+            CREATE TABLE IF NOT EXISTS cumulative_hours (
+            employee TEXT NOT NULL,
+            date %s NOT NULL,
+            hours REAL NOT NULL DEFAULT 0,
+            days INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (employee, date));
+            ''' % fmt.column_type]
+
+def triggers(fmt=TEXT):
+    '''Return the rollup trigger definitions keyed by trigger name.'''
+    return {
+        'punches_rollup_insert':
+            '''
+            AFTER INSERT ON punches
+            BEGIN %s %s END;
+            ''' % (_BUMP, _compact_day('new.', fmt)),
+        'punches_rollup_delete':
+            '''
+            AFTER DELETE ON punches
+            BEGIN
+                %s %s
+                DELETE FROM daily_hours
+                WHERE employee = old.employee AND date = old.date
+                AND NOT EXISTS (SELECT 1 FROM punches
+                                WHERE employee = old.employee AND date = old.date);
+            END;
+            ''' % (_BUMP, _compact_day('old.', fmt)),
+        'punches_append_only':
+            '''
+            BEFORE UPDATE ON punches
+            BEGIN SELECT RAISE(ABORT, 'punches cannot be changed once written'); END;
+            ''',
+        'punches_archived':
+            '''
+            BEFORE INSERT ON punches %s
+            BEGIN %s END;
+            ''' % (_refuse_archived('new.', fmt), _ARCHIVED),
+        'daily_rollup_insert':
+            '''
+            AFTER INSERT ON daily_hours
+            BEGIN %s %s %s END;
+            ''' % (_add_monthly('new.', '+', fmt), _INSERT_CUMULATIVE,
+                   _shift_cumulative('new.', None)),
+        'daily_rollup_update':
+            '''
+            AFTER UPDATE ON daily_hours
+            BEGIN %s %s %s END;
+            ''' % (_add_monthly('old.', '-', fmt), _add_monthly('new.', '+', fmt),
+                   _shift_cumulative('new.', 'old.')),
+        'daily_rollup_delete':
+            '''
+            AFTER DELETE ON daily_hours
+            BEGIN
+                %s %s
+                DELETE FROM cumulative_hours
+                WHERE employee = old.employee AND date = old.date;
+            END;
+            ''' % (_add_monthly('old.', '-', fmt), _shift_cumulative(None, 'old.')),
+    }
+
+# Finds the days an employee has had changed since a given counter value.
+CHANGED_INDEX = '''
+    CREATE INDEX IF NOT EXISTS daily_hours_changed ON daily_hours (employee, changed);
+    '''
+
+def create_triggers(conn, fmt=TEXT):
+    '''Install the triggers that keep the rollup tables current.'''
+    for name, body in sorted(triggers(fmt).items()):
+        conn.execute("CREATE TRIGGER IF NOT EXISTS %s %s" % (name, body))
+
+def drop_triggers(conn):
+    '''Remove the rollup triggers, e.g. while rebuilding in bulk.'''
+    for name in sorted(triggers()):
+        conn.execute("DROP TRIGGER IF EXISTS %s;" % name)
+
+def create_rollups(conn, fmt=TEXT):
+    '''Create the rollup tables and their triggers.'''
+    for table in tables(fmt) + ARCHIVE_TABLES:
+        conn.execute(table)
+    conn.execute(CHANGED_INDEX)
+    conn.execute(TIMES_VIEW)
+    conn.execute("INSERT OR IGNORE INTO data_changes (id, counter) VALUES (0, 0);")
+    create_triggers(conn, fmt)
+
+def change_counter(conn):
+    '''Return the number of writes made to punches so far.'''
+    return conn.execute("SELECT counter FROM data_changes;").fetchone()[0]
+
+def rebuild_rollups(conn, fmt=TEXT, start_date=None, end_date=None):
+    '''
+    Recompute the rollup tables from punches, fixing any drift.  If a date
+    range is given, only the months overlapping it are recomputed, along
+    with the running totals from then on.  Archived years are left as
+    they are.  Must be run inside a transaction; see
+    sqlhelpers.transaction.
+    '''
+    if start_date is None:
+        dates, params, month_params = "", (), ()
+        months = '''
+                 WHERE CAST(substr(month, 1, 4) AS INTEGER)
+                 > COALESCE((SELECT MAX(year) FROM archives), 0)
+                 '''
+        later, later_params = "", ()
+    else:
+        first = _parse(start_date).replace(day=1)
+        end = _parse(end_date)
+        last = end.replace(day=calendar.monthrange(end.year, end.month)[1])
+        dates = "AND date BETWEEN ? AND ?"
+        months = "WHERE month BETWEEN ? AND ?"
+        params = (fmt.date_param(first.isoformat()), fmt.date_param(last.isoformat()))
+        month_params = ("%04d-%02d" % (first.year, first.month),
+                        "%04d-%02d" % (last.year, last.month))
+        later, later_params = "AND date >= ?", params[:1]
+
+    drop_triggers(conn)
+    conn.execute(_BUMP)
+    conn.execute("DELETE FROM daily_hours WHERE 1 %s;" % dates, params)
+    conn.execute("DELETE FROM monthly_hours %s;" % months, month_params)
+    conn.execute("INSERT INTO daily_hours (%s) %s;"
+                 % (', '.join(DAY_COLUMNS), day_sql("1 %s" % dates, fmt)), params)
+    conn.execute('''
+                 INSERT INTO monthly_hours (employee, month, hours, days)
+                 SELECT employee, %s AS month, COALESCE(SUM(total), 0), COUNT(total)
+                 FROM daily_hours WHERE 1 %s GROUP BY employee, month;
+                 ''' % (fmt.month_sql('date'), dates), params)
+    # Running totals carry on from the last row before the range, or from
+    # the end of the last archived year.
+    conn.execute("DELETE FROM cumulative_hours WHERE 1 %s;" % later, later_params)
+    conn.execute('''
+                 INSERT INTO cumulative_hours (employee, date, hours, days)
+                 SELECT employee, date,
+                        COALESCE((SELECT hours FROM cumulative_hours c
+                                  WHERE c.employee = d.employee
+                                  ORDER BY c.date DESC LIMIT 1),
+                                 (SELECT hours FROM archive_totals a
+                                  WHERE a.employee = d.employee
+                                  ORDER BY a.year DESC LIMIT 1), 0)
+                        + SUM(COALESCE(total, 0)) OVER running,
+                        COALESCE((SELECT days FROM cumulative_hours c
+                                  WHERE c.employee = d.employee
+                                  ORDER BY c.date DESC LIMIT 1),
+                                 (SELECT days FROM archive_totals a
+                                  WHERE a.employee = d.employee
+                                  ORDER BY a.year DESC LIMIT 1), 0)
+                        + COUNT(total) OVER running
+                 FROM daily_hours d WHERE 1 %s
+                 WINDOW running AS (PARTITION BY employee ORDER BY date);
+                 ''' % later, later_params)
+    create_triggers(conn, fmt)
+
+def _parse(date_text):
+    return datetime.datetime.strptime(date_text, '%Y-%m-%d').date()
+
+def employees(conn):
+    '''Return the names of everyone with a dated record, in order.'''
+    return [row[0] for row in conn.execute(
+        "SELECT DISTINCT employee FROM monthly_hours ORDER BY employee;")]
+
+def _running_totals(conn, employee, date, fmt, before=False):
+    '''
+    (hours, days) an employee worked up to date, or up to the day before,
+    from the database holding date.  Where that has nothing earlier for
+    the employee, the totals the year before closed on are used.
+    '''
+    for schema, fmt, first, last in segments(conn, date, date, fmt):
+        row = conn.execute('''
+                           SELECT hours, days FROM %s.cumulative_hours
+                           WHERE employee = ? AND date %s ?
+                           ORDER BY date DESC LIMIT 1;
+                           ''' % (schema, '<' if before else '<='),
+                           (employee, fmt.date_param(date))).fetchone()
+        if row:
+            return row
+    return closing_totals(conn, employee, int(date[:4]) - 1)
+
+def changed_since(conn, counter, start_date, end_date, fmt=TEXT,
+                  employee=DEFAULT_EMPLOYEE):
+    '''
+    Return the first date between start_date and end_date inclusive whose
+    hours were written after the change counter stood at counter, or None.
+    Archived years never change, so only the main database is searched.
+    '''
+    # The unary + keeps the planner on daily_hours_changed, which holds only
+    # the few recent changes, rather than scanning the range by date.
+    row = conn.execute('''
+                       SELECT %s FROM (SELECT MIN(date) AS date FROM daily_hours
+                                       WHERE employee = ? AND changed > ?
+                                       AND +date BETWEEN ? AND ?);
+                       ''' % fmt.date_sql('date'),
+                       (employee, counter, fmt.date_param(start_date),
+                        fmt.date_param(end_date))).fetchone()
+    return row[0]
+
+def days_recorded(conn, start_date, end_date, fmt=TEXT, employee=DEFAULT_EMPLOYEE):
+    '''Return the number of dated records from start_date to end_date inclusive.'''
+    if start_date > end_date:
+        return 0
+    return sum(conn.execute('''
+                            SELECT COUNT(*) FROM %s.daily_hours
+                            WHERE employee = ? AND date BETWEEN ? AND ?;
+                            ''' % schema, (employee, fmt.date_param(first),
+                                           fmt.date_param(last))).fetchone()[0]
+               for schema, fmt, first, last in segments(conn, start_date, end_date, fmt))
+
+def range_totals(conn, start_date, end_date, fmt=TEXT, employee=DEFAULT_EMPLOYEE):
+    '''
+    Return (hours, days) an employee worked between start_date and end_date
+    inclusive, as the difference of the running totals at either end.
+    Takes two index lookups whatever the length of the range.
+    '''
+    if start_date > end_date:
+        return 0., 0
+    hours, days = _running_totals(conn, employee, end_date, fmt)
+    hours_before, days_before = _running_totals(conn, employee, start_date, fmt,
+                                                before=True)
+    return hours - hours_before, days - days_before
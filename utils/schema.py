@@ -0,0 +1,259 @@
+#! /usr/bin/env python
+'''
+Schema creation and migrations for the TimeClock database.
+
+The schema version is stored in PRAGMA user_version, so an up-to-date
+database is recognised without probing any tables.  Each entry in
+MIGRATIONS brings the schema up by one version and runs inside a single
+transaction together with the version bump.
+'''
+
+from TimeClock.utils.rollups import create_rollups, rebuild_rollups, \
+    create_triggers, drop_triggers, tables, CHANGED_INDEX
+from TimeClock.utils.sqlhelpers import transaction, PUNCH_COLUMNS, DEFAULT_EMPLOYEE
+from TimeClock.utils.storage import TEXT, FORMATS, storage_format
+
+def _times_sql(table='times', fmt=TEXT):
+    return '''
+           CREATE TABLE IF NOT EXISTS %s (
+           date %s,
+           clockin %s,
+           lunchout %s,
+           lunchin %s,
+           clockout %s,
+           employee TEXT NOT NULL DEFAULT '%s');
+           ''' % ((table,) + (fmt.column_type,) * 5 + (DEFAULT_EMPLOYEE,))
+
+def _create_times(conn):
+    '''Create the times table if this is a brand new database.'''
+    conn.execute(_times_sql())
+
+def _punches_sql(table='punches', fmt=TEXT):
+    return '''
+           CREATE TABLE IF NOT EXISTS %s (
+           id INTEGER PRIMARY KEY,
+           employee TEXT NOT NULL,
+           date %s NOT NULL,
+           time %s NOT NULL,
+           kind TEXT NOT NULL CHECK (kind IN (%s)));
+           ''' % (table, fmt.column_type, fmt.column_type,
+                  ', '.join("'%s'" % column for column in PUNCH_COLUMNS))
+
+# A day's punches in time order, read whenever one is written.
+PUNCHES_INDEX = '''
+    CREATE INDEX IF NOT EXISTS punches_day ON punches (employee, date, time);
+    '''
+
+def _is_table(conn, name):
+    return conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?;",
+                        (name,)).fetchone() is not None
+
+def _create_punches(conn):
+    '''
+    Move the records of the times table into punches, one row per punch
+    set, and drop it; the rollups bring times back as a view.  Migrations
+    build the rollups in their current layout, which reads punches, so
+    each one that does calls this first.
+    '''
+    if not _is_table(conn, 'times'):
+        return
+    fmt = storage_format(conn)
+    _add_employee(conn)
+    conn.execute(_punches_sql(fmt=fmt))
+    conn.execute(PUNCHES_INDEX)
+    # Punches at the same time keep the order of the columns.
+    conn.execute('''
+                 INSERT INTO punches (employee, date, time, kind)
+                 SELECT employee, date, time, kind FROM (%s)
+                 WHERE date IS NOT NULL AND time IS NOT NULL
+                 ORDER BY employee, date, time, step;
+                 ''' % ' UNION ALL '.join(
+                     "SELECT employee, date, %s AS time, '%s' AS kind, %d AS step FROM times"
+                     % (column, column, step) for step, column in enumerate(PUNCH_COLUMNS)))
+    conn.execute("DROP TABLE times;")
+
+def _migrate_unique_date(conn):
+    '''
+    Version 1: one row per date, enforced by a unique index.  Databases
+    written before the index existed may hold several rows for a day, so
+    those are merged into the oldest row first.
+    '''
+    _create_times(conn)
+    conn.execute('''
+                 UPDATE times SET
+                 clockin = COALESCE(clockin, (SELECT MAX(t.clockin) FROM times t
+                                              WHERE t.date = times.date)),
+                 lunchout = COALESCE(lunchout, (SELECT MAX(t.lunchout) FROM times t
+                                                WHERE t.date = times.date)),
+                 lunchin = COALESCE(lunchin, (SELECT MAX(t.lunchin) FROM times t
+                                              WHERE t.date = times.date)),
+                 clockout = COALESCE(clockout, (SELECT MAX(t.clockout) FROM times t
+                                                WHERE t.date = times.date))
+                 WHERE rowid IN (SELECT MIN(rowid) FROM times
+                                 GROUP BY date HAVING COUNT(*) > 1);
+                 ''')
+    conn.execute('''
+                 DELETE FROM times
+                 WHERE rowid NOT IN (SELECT MIN(rowid) FROM times GROUP BY date);
+                 ''')
+    conn.execute('''
+                 CREATE UNIQUE INDEX IF NOT EXISTS times_date ON times (date);
+                 ''')
+
+def _add_employee(conn):
+    '''Add times.employee to databases created before it existed.'''
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(times);")]
+    if 'employee' not in columns:
+        conn.execute("ALTER TABLE times ADD COLUMN employee TEXT NOT NULL DEFAULT '%s';"
+                     % DEFAULT_EMPLOYEE)
+
+def _migrate_rollups(conn):
+    '''Version 2: daily and monthly hours rollups kept current by triggers.'''
+    _create_punches(conn)
+    create_rollups(conn)
+    rebuild_rollups(conn)
+
+def _migrate_change_counter(conn):
+    '''
+    Version 3: a counter of writes to times, bumped by the rollup
+    triggers, for the report cache.
+    '''
+    _create_punches(conn)
+    create_rollups(conn, storage_format(conn))
+    drop_triggers(conn)
+    create_triggers(conn, storage_format(conn))
+
+def _migrate_employee(conn):
+    '''
+    Version 4: records belong to an employee, unique per employee and date.
+    Existing records go to DEFAULT_EMPLOYEE and the rollups are rebuilt
+    per employee.
+    '''
+    fmt = storage_format(conn)
+    _create_punches(conn)
+    drop_triggers(conn)
+    conn.execute("DROP TABLE IF EXISTS daily_hours;")
+    conn.execute("DROP TABLE IF EXISTS monthly_hours;")
+    create_rollups(conn, fmt)
+    rebuild_rollups(conn, fmt)
+
+def _migrate_cumulative(conn):
+    '''
+    Version 5: running totals of hours and days per employee and date, so
+    range totals are two lookups.
+    '''
+    fmt = storage_format(conn)
+    _create_punches(conn)
+    drop_triggers(conn)
+    conn.execute("DROP TABLE IF EXISTS cumulative_hours;")
+    create_rollups(conn, fmt)
+    rebuild_rollups(conn, fmt)
+
+def _migrate_changed(conn):
+    '''
+    Version 6: daily_hours.changed, the change counter of the write that
+    last touched each day, so a report's data file can be brought up to
+    date from the first day changed since it was written.
+    '''
+    _create_punches(conn)
+    columns = [row[1] for row in conn.execute("PRAGMA table_info(daily_hours);")]
+    if 'changed' not in columns:
+        conn.execute("ALTER TABLE daily_hours ADD COLUMN changed INTEGER NOT NULL "
+                     "DEFAULT 0;")
+    drop_triggers(conn)
+    create_rollups(conn, storage_format(conn))
+
+def _migrate_archives(conn):
+    '''
+    Version 7: closed years can be archived into shards (see archive.py),
+    listed in archives with the running totals they closed on, and the
+    triggers refusing records dated in them.
+    '''
+    _create_punches(conn)
+    drop_triggers(conn)
+    create_rollups(conn, storage_format(conn))
+
+def _migrate_punches(conn):
+    '''
+    Version 8: punches are appended to the punches table, one row each,
+    instead of updating a row of times per day, and times is a view of
+    the days compacted into daily_hours.  A day may now hold any number of
+    stretches of work.
+    '''
+    fmt = storage_format(conn)
+    _create_punches(conn)
+    drop_triggers(conn)
+    conn.execute("DROP TABLE IF EXISTS daily_hours;")
+    conn.execute("DROP TABLE IF EXISTS cumulative_hours;")
+    create_rollups(conn, fmt)
+    rebuild_rollups(conn, fmt)
+
+MIGRATIONS = [_migrate_unique_date,
+              _migrate_rollups,
+              _migrate_change_counter,
+              _migrate_employee,
+              _migrate_cumulative,
+              _migrate_changed,
+              _migrate_archives,
+              _migrate_punches]
+
+SCHEMA_VERSION = len(MIGRATIONS)
+
+def schema_version(conn):
+    '''Return the schema version recorded in the database.'''
+    return conn.execute("PRAGMA user_version;").fetchone()[0]
+
+def ensure_schema(conn):
+    '''
+    Create or upgrade the database schema to SCHEMA_VERSION.  Returns the
+    version the database was at before any migrations ran.
+    '''
+    version = schema_version(conn)
+    if version >= SCHEMA_VERSION:
+        return version
+
+    with transaction(conn):
+        # Another process may have migrated while we waited for the lock.
+        version = schema_version(conn)
+        for number in range(version, SCHEMA_VERSION):
+            MIGRATIONS[number](conn)
+        conn.execute("PRAGMA user_version = %d;" % SCHEMA_VERSION)
+    return version
+
+def convert_storage(conn, name):
+    '''
+    Rewrite punches, and the rollups keyed on their dates, in the storage
+    format called name ('text' or 'integer').  Archived years stay in the
+    format they were archived in.  Returns False if the database already
+    uses that format.
+    '''
+    target = FORMATS[name]
+    ensure_schema(conn)
+    source = storage_format(conn)
+    if source is target:
+        return False
+
+    convert = lambda kind, column: target.from_text_sql(
+        kind, source.date_sql(column) if kind == 'date' else source.time_sql(column))
+    with transaction(conn):
+        drop_triggers(conn)
+        conn.execute(_punches_sql('punches_converted', target))
+        conn.execute('''
+                     INSERT INTO punches_converted (id, employee, date, time, kind)
+                     SELECT id, employee, %s, %s, kind FROM punches ORDER BY id;
+                     ''' % (convert('date', 'date'), convert('time', 'time')))
+        conn.execute("DROP TABLE punches;")
+        conn.execute("ALTER TABLE punches_converted RENAME TO punches;")
+        conn.execute(PUNCHES_INDEX)
+
+        conn.execute("DROP TABLE daily_hours;")
+        conn.execute("DROP TABLE cumulative_hours;")
+        daily, monthly, changes, cumulative = tables(target)
+        conn.execute(daily)
+        conn.execute(CHANGED_INDEX)
+        conn.execute(cumulative)
+        rebuild_rollups(conn, target)
+
+    # Reclaim the space freed by the smaller rows.
+    conn.execute("VACUUM;")
+    return True
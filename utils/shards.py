@@ -0,0 +1,111 @@
+#! /usr/bin/env python
+'''
+Reading across the main database and its archived years.
+
+Closed years can be moved out of the database into one read-only shard
+file per year (see archive.py).  The archives table lists them, oldest
+first and always ending at the last archived year, so any date belongs
+either to the shard of its year or to the main database.
+
+segments() splits a date range into the part each database holds, oldest
+first, and ATTACHes a shard the first time a query reaches into it.  A
+shard stays attached for later queries on the same connection, up to
+MAX_ATTACHED of them; past that the others are detached first.
+
+archive_totals keeps the running totals (see rollups.py) each employee
+had at the end of every archived year, so totals that start or end
+before the first record still held somewhere are answered without
+opening older shards.
+'''
+
+import os
+
+from TimeClock.utils.storage import FORMATS
+
+# SQLite allows ten attached databases by default.
+MAX_ATTACHED = 8
+
+# Bounds for open-ended date ranges.
+FIRST_DATE = '0001-01-01'
+LAST_DATE = '9999-12-31'
+
+TABLES = ['''
+          CREATE TABLE IF NOT EXISTS archives (
+          year INTEGER PRIMARY KEY,
+          path TEXT NOT NULL,
+          storage TEXT NOT NULL);
+          ''',
+          '''
+          CREATE TABLE IF NOT EXISTS archive_totals (
+          employee TEXT NOT NULL,
+          year INTEGER NOT NULL,
+          hours REAL NOT NULL,
+          days INTEGER NOT NULL,
+          PRIMARY KEY (employee, year));
+          ''']
+
+def archives(conn):
+    '''Return (year, shard file name, storage format name) for every archived year.'''
+    return conn.execute("SELECT year, path, storage FROM main.archives ORDER BY year;"
+                        ).fetchall()
+
+def last_archived(conn):
+    '''Return the last archived year, or None.'''
+    return conn.execute("SELECT MAX(year) FROM main.archives;").fetchone()[0]
+
+def database_path(conn, schema='main'):
+    '''Return the file of an open database.'''
+    for number, name, path in conn.execute("PRAGMA database_list;"):
+        if name == schema:
+            return path
+
+def attach(conn, year, name):
+    '''ATTACH the shard of year, if it is not already, and return its schema name.'''
+    schema = "archive_%d" % year
+    attached = [row[1] for row in conn.execute("PRAGMA database_list;")]
+    if schema not in attached:
+        others = [other for other in attached if other.startswith('archive_')]
+        if len(others) >= MAX_ATTACHED:
+            for other in others:
+                conn.execute("DETACH DATABASE %s;" % other)
+        path = os.path.join(os.path.dirname(database_path(conn)), name)
+        conn.execute("ATTACH DATABASE ? AS %s;" % schema, (path,))
+    return schema
+
+def has_punches(conn, schema):
+    '''Whether a database has a punches table; shards archived before it have not.'''
+    return conn.execute("SELECT 1 FROM %s.sqlite_master WHERE type = 'table' "
+                        "AND name = 'punches';" % schema).fetchone() is not None
+
+def segments(conn, start_date, end_date, fmt, reverse=False):
+    '''
+    Yield (schema, storage format, start, end) for each database holding
+    part of start_date to end_date, oldest first or, if reverse, newest
+    first.  The main database, in storage format fmt, comes after every
+    shard.  Shards are attached as they are reached.
+    '''
+    parts = []
+    years = archives(conn)
+    for year, name, storage in years:
+        first, last = "%04d-01-01" % year, "%04d-12-31" % year
+        if first <= end_date and start_date <= last:
+            parts.append((year, name, FORMATS[storage],
+                          max(start_date, first), min(end_date, last)))
+    first = "%04d-01-01" % (years[-1][0] + 1) if years else FIRST_DATE
+    if end_date >= first:
+        parts.append((None, 'main', fmt, max(start_date, first), end_date))
+    for year, name, part_fmt, first, last in (reversed(parts) if reverse else parts):
+        schema = name if year is None else attach(conn, year, name)
+        yield schema, part_fmt, first, last
+
+def closing_totals(conn, employee, year):
+    '''
+    Return the running (hours, days) an employee had at the end of the
+    last archived year up to year, or (0., 0).
+    '''
+    row = conn.execute('''
+                       SELECT hours, days FROM main.archive_totals
+                       WHERE employee = ? AND year <= ?
+                       ORDER BY year DESC LIMIT 1;
+                       ''', (employee, year)).fetchone()
+    return row or (0., 0)
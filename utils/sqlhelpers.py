@@ -4,57 +4,149 @@ Helper functions for repeated SQL code.
 '''
 
 import time
+from contextlib import contextmanager
+from sqlite3 import OperationalError, IntegrityError
 
-TODAY = time.strftime("%Y-%m-%d", time.localtime())
+from TimeClock.utils.storage import TEXT
+from TimeClock.utils.connection import retry_on_lock
+from TimeClock.utils.shards import segments, FIRST_DATE, LAST_DATE
 
-def update_record(conn, column, date=TODAY, time="now', 'localtime"):
+# Placeholder passed by the command line flags when no time is given.
+NOW = "now', 'localtime"
+
+PUNCH_COLUMNS = ('clockin', 'lunchout', 'lunchin', 'clockout')
+
+# Whose time is recorded when no employee is named.  Records written
+# before times had an employee column belong to this employee.
+DEFAULT_EMPLOYEE = 'default'
+
+def current_date():
+    '''Return today's local date as YYYY-MM-DD.'''
+    return time.strftime("%Y-%m-%d", time.localtime())
+
+def current_time():
+    '''Return the local time of day as HH:MM:SS.'''
+    return time.strftime("%H:%M:%S", time.localtime())
+
+def write_punch(conn, column, date=None, time=None, fmt=TEXT,
+                employee=DEFAULT_EMPLOYEE, replace=False):
     '''
-    Update a record that already exists.  Column name must be provided, but
-    date and time default to the current date and/or time.
+    Append one punch ('clockin', 'lunchout', 'lunchin' or 'clockout') for
+    an employee to punches, dated today and timed now unless told
+    otherwise.  A second punch of a kind on the same day starts or ends
+    another stretch of work, unless replace, which first deletes that
+    day's punches of the kind, as when correcting one.  Nothing is
+    committed, so several punches can share one transaction.
     '''
-    try:
-        conn.execute('''
-                     UPDATE times SET %s=time('%s')
-                     WHERE date=date('%s');
-                     ''' % (column, time, date)
-                     )
-        conn.commit()
-    except OperationalError:
-        print "Something went wrong setting the %s column for %s." % (column, date)
-    else:
-        print "Punch accepted!"
-    return 0
-
-def new_record(conn, column, date=TODAY, time="now', 'localtime"):
-    '''
-    Create a new record.  Column name must be provided, but
-    date and time default to the current date and/or time.
+    if column not in PUNCH_COLUMNS:
+        raise ValueError("Unknown punch column: %s" % column)
+    date = date or current_date()
+    if time is None or time == NOW:
+        time = current_time()
+    if replace:
+        conn.execute("DELETE FROM punches WHERE employee = ? AND date = %s AND kind = ?;"
+                     % fmt.bind_date, (employee, fmt.date_param(date), column))
+    conn.execute('''
+                 INSERT INTO punches (employee, date, time, kind)
+                 VALUES (?, %s, %s, ?);
+                 ''' % (fmt.bind_date, fmt.bind_time),
+                 (employee, fmt.date_param(date), fmt.time_param(time), column)
+                 )
+
+def commit_punch(conn, column, date=None, time=None, fmt=TEXT,
+                 employee=DEFAULT_EMPLOYEE, replace=False):
     '''
-    try:
-        conn.execute('''
-                     INSERT INTO times (date, %s)
-                     VALUES (date('%s'), time('%s'));
-                     ''' % (column, date, time)
-                     )
-        conn.commit()
-    except OperationalError:
-        print "Something went wrong setting the %s column for %s." % (column, date)
-    else:
-        print "Punch accepted!"
-    return 0
-
-def check_record_exists(conn, date=TODAY):
-    '''
-    Check whether a record for a given date already exists.
+    Write and commit a punch, retrying with backoff while another
+    connection holds the write lock.
     '''
-    try:
-        res = conn.execute('''
-                           SELECT COUNT(*) FROM times
-                           WHERE date='%s';
-                           ''' % date
-                           )
-    except OperationalError:
-        print "Something went wrong running the SQL command."
-    else:
-        return bool(res.fetchone()[0])
+    def attempt():
+        try:
+            write_punch(conn, column, date, time, fmt, employee, replace)
+            conn.commit()
+        except (OperationalError, IntegrityError):
+            conn.rollback()
+            raise
+    retry_on_lock(attempt)
+
+def _record_columns(fmt):
+    '''The columns of a lookup record, as text.'''
+    return ', '.join([fmt.date_sql('date')] +
+                     [fmt.time_sql(column) for column in PUNCH_COLUMNS])
+
+def lookup_record(conn, date=None, fmt=TEXT, employee=DEFAULT_EMPLOYEE):
+    '''
+    Return an employee's (date, clockin, lunchout, lunchin, clockout)
+    record for a date, today unless given, as text, or None if nothing
+    was punched that day.
+    '''
+    date = date or current_date()
+    for schema, fmt, first, last in segments(conn, date, date, fmt):
+        return conn.execute('''
+                            SELECT %s FROM %s.times
+                            WHERE employee = ? AND date = %s;
+                            ''' % (_record_columns(fmt), schema, fmt.bind_date),
+                            (employee, fmt.date_param(date))).fetchone()
+
+def lookup_records(conn, start_date, end_date, fmt=TEXT, employee=DEFAULT_EMPLOYEE,
+                   limit=-1):
+    '''
+    Yield an employee's records from start_date to end_date inclusive,
+    oldest first, at most limit of them (-1 for all).  Rows come from the
+    (employee, date) index one at a time, so a dump of any length is read
+    in constant memory.  Archived years are read from their shards.
+    '''
+    for schema, fmt, first, last in segments(conn, start_date, end_date, fmt):
+        cursor = conn.execute('''
+                              SELECT %s FROM %s.times
+                              WHERE employee = ? AND date BETWEEN %s AND %s
+                              ORDER BY date
+                              LIMIT ?;
+                              ''' % (_record_columns(fmt), schema,
+                                     fmt.bind_date, fmt.bind_date),
+                              (employee, fmt.date_param(first),
+                               fmt.date_param(last), limit))
+        for row in cursor:
+            yield row
+            limit -= 1
+        if limit == 0:
+            return
 
+def recent_start(conn, count, fmt=TEXT, employee=DEFAULT_EMPLOYEE):
+    '''
+    Return the date of an employee's count-th most recent record, or of
+    their first record if they have fewer, or None if they have none.
+    Archived years are only opened if the main database has too few.
+    '''
+    start = None
+    for schema, fmt, first, last in segments(conn, FIRST_DATE, LAST_DATE, fmt,
+                                             reverse=True):
+        date, found = conn.execute('''
+                                   SELECT %s, COUNT(*) FROM (
+                                       SELECT date FROM %s.times WHERE employee = ?
+                                       ORDER BY date DESC LIMIT ?);
+                                   ''' % (fmt.date_sql('MIN(date)'), schema),
+                                   (employee, count)).fetchone()
+        start = date or start
+        count -= found
+        if count <= 0:
+            break
+    return start
+
+@contextmanager
+def transaction(conn):
+    '''
+    Run the enclosed statements in one explicit write transaction.  The
+    sqlite3 module would otherwise commit before every DDL statement.
+    '''
+    isolation_level = conn.isolation_level
+    conn.isolation_level = None
+    try:
+        conn.execute("BEGIN IMMEDIATE;")
+        try:
+            yield conn
+        except Exception:
+            conn.execute("ROLLBACK;")
+            raise
+        conn.execute("COMMIT;")
+    finally:
+        conn.isolation_level = isolation_level
@@ -0,0 +1,116 @@
+#! /usr/bin/env python
+'''
+Storage formats for dates and punch times in the punches table.
+
+ - text    : YYYY-MM-DD dates and HH:MM:SS times (the original layout).
+ - integer : days since 1970-01-01 for dates and seconds since midnight
+             for times.  Rows are smaller and hours are plain integer
+             subtraction instead of strftime() parsing.
+
+Each format knows how to bind user input and how to turn a stored column
+back into text or into seconds inside SQL, so the queries elsewhere are
+written once for both formats.  The format in use is read from the
+declared type of punches.date, or of times.date in a database that has
+not been migrated to punches yet.
+'''
+
+import datetime
+
+EPOCH = datetime.date(1970, 1, 1)
+
+class TextFormat(object):
+    '''Dates and times stored as ISO text.'''
+
+    name = 'text'
+    column_type = 'TEXT'
+
+    # Placeholders used when binding a date or a time of day.
+    bind_date = "date(?)"
+    bind_time = "time(?)"
+
+    def date_param(self, date_text):
+        return date_text
+
+    def time_param(self, time_text):
+        return time_text
+
+    def date_sql(self, column):
+        '''SQL for a stored date as YYYY-MM-DD.'''
+        return column
+
+    def time_sql(self, column):
+        '''SQL for a stored time as HH:MM:SS.'''
+        return column
+
+    def seconds_sql(self, column):
+        '''SQL for a stored time as a number of seconds.'''
+        return "strftime('%%s', %s)" % column
+
+    def month_sql(self, column):
+        '''SQL for the YYYY-MM month of a stored date.'''
+        return "substr(%s, 1, 7)" % column
+
+    def days_sql(self, column):
+        '''SQL for a stored date as days since 1970-01-01.'''
+        return "CAST(julianday(%s) - 2440587.5 AS INTEGER)" % column
+
+    def day_seconds_sql(self, column):
+        '''SQL for a stored time as seconds since midnight.'''
+        return "CAST(strftime('%%s', '1970-01-01 ' || %s) AS INTEGER)" % column
+
+    def from_text_sql(self, kind, column):
+        '''SQL converting a text-format date or time column to this format.'''
+        return column
+
+class IntegerFormat(TextFormat):
+    '''Dates as epoch days and times as seconds since midnight.'''
+
+    name = 'integer'
+    column_type = 'INTEGER'
+
+    bind_date = "?"
+    bind_time = "?"
+
+    def date_param(self, date_text):
+        year, month, day = [int(part) for part in date_text.split('-')]
+        return (datetime.date(year, month, day) - EPOCH).days
+
+    def time_param(self, time_text):
+        parts = [int(part) for part in time_text.split(':')] + [0, 0]
+        return parts[0] * 3600 + parts[1] * 60 + parts[2]
+
+    def date_sql(self, column):
+        return "date(%s * 86400, 'unixepoch')" % column
+
+    def time_sql(self, column):
+        return "time(%s, 'unixepoch')" % column
+
+    def seconds_sql(self, column):
+        return column
+
+    def month_sql(self, column):
+        return "strftime('%%Y-%%m', %s * 86400, 'unixepoch')" % column
+
+    def days_sql(self, column):
+        return column
+
+    def day_seconds_sql(self, column):
+        return column
+
+    def from_text_sql(self, kind, column):
+        if kind == 'date':
+            return TEXT.days_sql(column)
+        return TEXT.day_seconds_sql(column)
+
+TEXT = TextFormat()
+INTEGER = IntegerFormat()
+
+FORMATS = {TEXT.name: TEXT, INTEGER.name: INTEGER}
+
+def storage_format(conn):
+    '''Return the format used by the punches, or times, table of conn.'''
+    for table in ('punches', 'times'):
+        for column in conn.execute("PRAGMA table_info(%s);" % table):
+            if column[1] == 'date':
+                return INTEGER if column[2].upper() == INTEGER.column_type else TEXT
+    return TEXT
@@ -1,30 +1,43 @@
-#! /usr/bin/env python
-"""
-Parse dates and times.
-"""
-
-import datetime
-
-def validate_date(date_text):
-    '''Make sure string is in YYYY-MM-DD format.'''
-    if date_text == "now', 'localtime":
-        return 0
-    else:
-        try:
-            datetime.datetime.strptime(date_text, '%Y-%m-%d')
-            return 0
-        except ValueError:
-            raise ValueError("Incorrect date format.  Should be YYYY-MM-DD")
-        
-def validate_time(time_text):
-    '''Make sure string is in HH:MM:SS format.'''
-    if time_text == "now', 'localtime":
-        return 0
-    else:
-        try:
-            datetime.datetime.strptime(time_text, '%H:%M:%S')
-            return 0
-        except ValueError:
-            raise ValueError("Incorrect date format.  Should be 24-hour, HH:MM")
-            
-            
+#! /usr/bin/env python
+"""
+Parse dates and times.
+
+Dates and times are checked with regular expressions rather than
+strptime(), whose first call imports _strptime and locale and costs more
+than the punch being validated.  Every field takes its full width of
+digits: SQLite's date() and time() return NULL for "2024-5-6" or
+"8:00:00", so a value strptime() would accept could not be stored.  The
+same patterns check the CLI, the shell and bulk imports.
+"""
+
+import re
+import datetime
+
+DATE_PATTERN = r'(\d{4})-(0[1-9]|1[0-2])-(0[1-9]|[12]\d|3[01])'
+TIME_PATTERN = r'([01]\d|2[0-3]):([0-5]\d):([0-5]\d)'
+
+DATE_RE = re.compile('^%s$' % DATE_PATTERN)
+TIME_RE = re.compile('^%s$' % TIME_PATTERN)
+
+def validate_date(date_text):
+    '''Make sure string is in YYYY-MM-DD format.'''
+    if date_text == "now', 'localtime":
+        return 0
+    else:
+        match = DATE_RE.match(date_text)
+        try:
+            if not match:
+                raise ValueError(date_text)
+            datetime.date(*[int(part) for part in match.groups()])
+            return 0
+        except ValueError:
+            raise ValueError("Incorrect date format.  Should be YYYY-MM-DD")
+
+def validate_time(time_text):
+    '''Make sure string is in HH:MM:SS format.'''
+    if time_text == "now', 'localtime":
+        return 0
+    elif TIME_RE.match(time_text):
+        return 0
+    else:
+        raise ValueError("Incorrect time format.  Should be 24-hour, HH:MM:SS")